@@ -0,0 +1,377 @@
+#===========================================================================
+# aimmap.py
+#
+# Calibrated mapping from stream image pixels to servo positions, so a
+# click on the picture can put the laser dot on the spot in one move.
+#
+# For each calibrated camera pose the laser is swept over a grid while
+# the camera watches for the dot. A homography from image pixels to
+# laser servo counts is fitted to what it saw and evaluated once over the
+# whole image into a lookup table, so aiming is a table lookup. Nudging
+# the camera with the laser parked gives the camera's servo counts per
+# pixel, which is used to centre the camera on a pixel and to reuse the
+# nearest calibrated pose when the camera has moved since.
+#
+# 2026-10-18
+#===========================================================================
+import os
+import json
+import time
+import threading
+import logging
+
+import numpy
+
+import camctl
+
+VERSION         = 1
+IMAGE_SIZE      = (640, 360)        # pixel space, same as the stream
+LUT_STEP        = 4                 # pixels between lookup table entries
+CAMERA_GAIN     = (1/8.0, 1/8.0)    # camera counts per pixel until calibrated
+GRAB_TIMEOUT    = 5.0               # seconds to wait for a camera frame
+LASER_GRID      = (-60, -30, 0, 30, 60) # laser offsets swept in each axis
+CAMERA_NUDGE    = 20                # camera counts moved to measure its gain
+SETTLE_TIME     = 0.5               # seconds for servos and camera to settle after a move
+MOVE_TIMEOUT    = 5.0               # seconds to wait for a move to finish
+DOT_THRESHOLD   = 40                # brightness the dot must add
+DOT_RADIUS      = 8                 # pixels around the peak for the centroid
+
+log = logging.getLogger(__name__)
+
+def fit_homography(src, dst):
+    """Least squares homography taking the (x, y) points src to dst,
+    as a 3x3 array. Needs at least four points."""
+    src = numpy.asarray(src, dtype=float)
+    dst = numpy.asarray(dst, dtype=float)
+    if len(src) < 4:
+        raise ValueError("need at least 4 points, got {}".format(len(src)))
+    # normalise both sets for a well conditioned solve
+    def normaliser(points):
+        mean = points.mean(axis=0)
+        scale = numpy.sqrt(2) / max(1e-9, numpy.sqrt(((points - mean)**2).sum(axis=1)).mean())
+        return numpy.array([[scale, 0, -scale*mean[0]],
+                            [0, scale, -scale*mean[1]],
+                            [0, 0, 1]])
+    Ts = normaliser(src)
+    Td = normaliser(dst)
+    s = numpy.dot(Ts, numpy.vstack([src.T, numpy.ones(len(src))])).T
+    d = numpy.dot(Td, numpy.vstack([dst.T, numpy.ones(len(dst))])).T
+    rows = []
+    for (x, y, w), (u, v, t) in zip(s, d):
+        rows.append([0, 0, 0, -x, -y, -1, v*x, v*y, v])
+        rows.append([x, y, 1, 0, 0, 0, -u*x, -u*y, -u])
+    h = numpy.linalg.svd(numpy.array(rows))[2][-1].reshape(3, 3)
+    H = numpy.dot(numpy.linalg.inv(Td), numpy.dot(h, Ts))
+    return H / H[2, 2]
+
+class PoseMap():
+    """Pixel to laser servo lookup table for one camera pose."""
+
+    def __init__(self, pose, homography, size=IMAGE_SIZE, step=LUT_STEP):
+        self.pose = tuple(pose)
+        self.homography = numpy.asarray(homography, dtype=float)
+        self.size = size
+        self.step = step
+        xs = numpy.arange(0, size[0] + step, step, dtype=float)
+        ys = numpy.arange(0, size[1] + step, step, dtype=float)
+        gx, gy = numpy.meshgrid(xs, ys)
+        points = numpy.vstack([gx.ravel(), gy.ravel(), numpy.ones(gx.size)])
+        laser = numpy.dot(self.homography, points)
+        laser = numpy.rint(laser[:2] / laser[2]).astype(int)
+        # plain lists index faster than numpy for single lookups
+        self._x = laser[0].reshape(gx.shape).tolist()
+        self._y = laser[1].reshape(gx.shape).tolist()
+        self._cols = len(xs)
+        self._rows = len(ys)
+        self._scale = 1.0 / step
+
+    def lookup(self, pixel):
+        """Return laser (x, y) servo counts for an image pixel."""
+        col = int(pixel[0] * self._scale + 0.5)
+        row = int(pixel[1] * self._scale + 0.5)
+        if not 0 <= col < self._cols:
+            col = 0 if col < 0 else self._cols - 1
+        if not 0 <= row < self._rows:
+            row = 0 if row < 0 else self._rows - 1
+        return (self._x[row][col], self._y[row][col])
+
+class AimMap():
+    """All calibrated poses plus the camera gain. Poses are only added
+    by replacing dict entries, so lookups need no lock."""
+
+    def __init__(self, path=None, size=IMAGE_SIZE):
+        self.path = path
+        self.size = size
+        self.camera_gain = CAMERA_GAIN
+        self.poses = {}
+        self._lock = threading.Lock()
+        if not path == None and os.path.isfile(path):
+            self.load()
+
+    def calibrated(self, ):
+        return len(self.poses) > 0
+
+    def add_pose(self, pose, homography):
+        pose_map = PoseMap(pose, homography, self.size)
+        with self._lock:
+            self.poses[pose_map.pose] = pose_map
+
+    def set_camera_gain(self, gain):
+        self.camera_gain = tuple(gain)
+
+    def laser_for_pixel(self, camera, pixel):
+        """Return laser servo position that puts the dot on pixel with the
+        camera at position camera, or None if no calibrated pose sees it."""
+        poses = self.poses.values()
+        if not poses:
+            return None
+        pose_map = poses[0]
+        if len(poses) > 1:
+            pose_map = min(poses, key=lambda p: (p.pose[0]-camera[0])**2 +
+                                                (p.pose[1]-camera[1])**2)
+        # where the pixel was in the picture taken from the calibrated pose
+        gx, gy = self.camera_gain
+        x = pixel[0] + (camera[0] - pose_map.pose[0]) / gx
+        y = pixel[1] + (camera[1] - pose_map.pose[1]) / gy
+        if not (0 <= x <= self.size[0] and 0 <= y <= self.size[1]):
+            return None
+        return pose_map.lookup((x, y))
+
+    def camera_for_pixel(self, camera, pixel):
+        """Return camera servo position that centres pixel in the picture."""
+        gx, gy = self.camera_gain
+        return (int(round(camera[0] + (pixel[0] - self.size[0]/2.0) * gx)),
+                int(round(camera[1] + (pixel[1] - self.size[1]/2.0) * gy)))
+
+    def save(self, path=None):
+        """Write the calibration, replacing the file atomically."""
+        path = self.path if path == None else path
+        with self._lock:
+            data = {'version': VERSION,
+                    'camera_gain': list(self.camera_gain),
+                    'poses': [{'camera': list(p.pose),
+                               'homography': p.homography.ravel().tolist()}
+                              for p in self.poses.values()]}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(data, separators=(',',':'), sort_keys=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+
+    def load(self, path=None):
+        path = self.path if path == None else path
+        with open(path, 'rb') as f:
+            data = json.load(f)
+        if not data.get('version') == VERSION:
+            raise ValueError("unknown calibration version {}".format(data.get('version')))
+        self.camera_gain = tuple(data['camera_gain'])
+        for entry in data['poses']:
+            self.add_pose(entry['camera'], numpy.reshape(entry['homography'], (3, 3)))
+
+#-------------------------------------------------------------------------
+# Calibration
+#-------------------------------------------------------------------------
+def find_dot(image, background, threshold=DOT_THRESHOLD, radius=DOT_RADIUS):
+    """Return (x, y) of the laser dot, the brightest spot image has over
+    background, to sub-pixel accuracy, or None if there isn't one."""
+    diff = image.astype(numpy.int16) - background
+    peak = int(diff.argmax())
+    py, px = divmod(peak, diff.shape[1])
+    if diff[py, px] < threshold:
+        return None
+    y0, x0 = max(0, py-radius), max(0, px-radius)
+    window = diff[y0:py+radius+1, x0:px+radius+1].astype(float)
+    window[window < diff[py, px] / 2.0] = 0
+    total = window.sum()
+    ys, xs = numpy.indices(window.shape)
+    return (x0 + (xs*window).sum()/total, y0 + (ys*window).sum()/total)
+
+class LumaFrames():
+    """Feed consumer keeping the luminance plane of the latest raw YUV
+    frame of size (width, height)."""
+
+    def __init__(self, size):
+        w, h = size
+        self.size = size
+        self.shape = ((h + 15) // 16 * 16, (w + 31) // 32 * 32)   # YUV padding
+        self.plane = self.shape[0] * self.shape[1]
+        self.frame = None
+        self.count = 0
+        self.closed = False
+        self._buf = numpy.zeros(self.plane, dtype=numpy.uint8)
+        self._written = 0
+        self._cond = threading.Condition()
+
+    def write(self, b):
+        n = len(b)
+        if self._written < self.plane:
+            take = min(n, self.plane - self._written)
+            self._buf[self._written:self._written+take] = numpy.frombuffer(b, dtype=numpy.uint8,
+                                                                           count=take)
+        self._written += n
+        return n
+
+    def commit(self, ):
+        w, h = self.size
+        with self._cond:
+            if self._written >= self.plane:
+                self.frame = self._buf.reshape(self.shape)[:h, :w].copy()
+                self.count += 1
+                self._cond.notify_all()
+        self._written = 0
+
+    def close(self, ):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def grab(self, timeout=GRAB_TIMEOUT):
+        """Return the luminance of the first frame started after this
+        call as a 2D array."""
+        deadline = time.time() + timeout
+        with self._cond:
+            # the frame being written may have started before the call
+            wanted = self.count + 2
+            while self.count < wanted:
+                remaining = deadline - time.time()
+                if self.closed or remaining <= 0:
+                    raise RuntimeError("no frame from camera")
+                self._cond.wait(remaining)
+            return self.frame
+
+class Calibrator(threading.Thread):
+    """Calibrates the current camera pose in the background. Servo and
+    laser commands go through the hardware actor, frames come from the
+    analytics feed at the aim map's size, registered for the whole
+    calibration so the camera stays open."""
+
+    def __init__(self, box, actor, aimmap, settle=SETTLE_TIME):
+        threading.Thread.__init__(self, name="Calibrator")
+        self.daemon = True
+        self.box = box
+        self.actor = actor
+        self.aimmap = aimmap
+        self.settle = settle
+        self.error = None
+        self._frames = None
+
+    def grab(self, ):
+        """Return the luminance plane of a frame as a 2D array."""
+        return self._frames.grab()
+
+    def run(self, ):
+        try:
+            self.calibrate()
+        except Exception as e:
+            self.error = e
+            log.exception("calibration failed")
+
+    def _move(self, camera=None, laser=None):
+        if not camera == None:
+            self.actor.camera_set_position(camera)
+        if not laser == None:
+            self.actor.laser_set_position(laser)
+        self.actor.settled().wait(MOVE_TIMEOUT)
+        time.sleep(self.settle)
+
+    def calibrate(self, ):
+        cameras = self.box.cameras
+        self._frames = LumaFrames(self.aimmap.size)
+        cameras.register(camctl.ANALYTICS_PORT, self._frames, resize=self.aimmap.size)
+        try:
+            self._calibrate()
+        finally:
+            cameras.unregister(camctl.ANALYTICS_PORT, self._frames)
+
+    def _calibrate(self, ):
+        camera = self.box.camera_get_position()
+        laser = self.box.laser_get_position()
+        was_on = self.box.get_laser_state()
+        self.actor.laser_off()
+        self._move()
+        background = self.grab().astype(numpy.int16)
+        self.actor.laser_on()
+        pixels = []
+        counts = []
+        try:
+            for dy in LASER_GRID:
+                for dx in LASER_GRID:
+                    target = (laser[0] + dx, laser[1] + dy)
+                    self._move(laser=target)
+                    dot = find_dot(self.grab(), background)
+                    if not dot == None:
+                        pixels.append(dot)
+                        counts.append(target)
+            if len(pixels) < 6:
+                raise RuntimeError("laser dot seen {} times, need 6".format(len(pixels)))
+            self.aimmap.add_pose(camera, fit_homography(pixels, counts))
+            # nudge the camera with the laser parked to get its gain
+            self._move(laser=laser)
+            start = find_dot(self.grab(), background)
+            gain = list(self.aimmap.camera_gain)
+            for axis in (0, 1):
+                nudged = list(camera)
+                nudged[axis] += CAMERA_NUDGE
+                self._move(camera=tuple(nudged))
+                # background shifts too, diff against a fresh laser off frame
+                self.actor.laser_off()
+                self._move()
+                shifted = self.grab().astype(numpy.int16)
+                self.actor.laser_on()
+                self._move()
+                end = find_dot(self.grab(), shifted)
+                if not start == None and not end == None and abs(start[axis] - end[axis]) > 1:
+                    gain[axis] = CAMERA_NUDGE / (start[axis] - end[axis])
+                self._move(camera=camera)
+            self.aimmap.set_camera_gain(gain)
+        finally:
+            self.actor.laser_set_position(laser)
+            if not was_on:
+                self.actor.laser_off()
+        if not self.aimmap.path == None:
+            self.aimmap.save()
+        log.info("calibrated camera pose %s from %d points, camera gain %.3f %.3f",
+                 camera, len(pixels), gain[0], gain[1])
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # Fit a made up pixel to servo homography from a noisy laser sweep,
+    # then compare aiming by table lookup against evaluating the
+    # homography for each click.
+    LOOKUPS = 100000
+    truth = numpy.array([[0.35, 0.02, 210.0], [0.01, -0.33, 550.0], [0.00002, 0.00001, 1.0]])
+    truth_inv = numpy.linalg.inv(truth)
+    counts = [(320 + dx, 490 + dy) for dy in LASER_GRID for dx in LASER_GRID]
+    pixels = []
+    for c in counts:
+        p = numpy.dot(truth_inv, [c[0], c[1], 1.0])
+        pixels.append((p[0]/p[2] + numpy.random.normal(0, 0.5),
+                       p[1]/p[2] + numpy.random.normal(0, 0.5)))
+    aimmap = AimMap()
+    aimmap.add_pose((290, 100), fit_homography(pixels, counts))
+
+    clicks = (numpy.random.uniform(0, 1, (LOOKUPS, 2)) * IMAGE_SIZE).tolist()
+    error = 0.0
+    for x, y in clicks[:1000]:
+        want = numpy.dot(truth, [x, y, 1.0])
+        got = aimmap.laser_for_pixel((290, 100), (x, y))
+        error = max(error, abs(got[0] - want[0]/want[2]), abs(got[1] - want[1]/want[2]))
+
+    H = aimmap.poses[(290, 100)].homography
+    start = time.time()
+    for x, y in clicks:
+        p = numpy.dot(H, [x, y, 1.0])
+        (int(round(p[0]/p[2])), int(round(p[1]/p[2])))
+    direct = time.time() - start
+    start = time.time()
+    for x, y in clicks:
+        aimmap.laser_for_pixel((290, 100), (x, y))
+    table = time.time() - start
+
+    print "{} points, worst aim error {:.1f} servo counts".format(len(counts), error)
+    print "{} lookups".format(LOOKUPS)
+    print "  homography  : {:.2f} us each".format(1e6 * direct / LOOKUPS)
+    print "  table       : {:.2f} us each".format(1e6 * table / LOOKUPS)
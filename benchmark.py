@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#===========================================================================
+# benchmark.py
+#
+# Latency and throughput benchmarks for the laser camera box, run against
+# the simulated hardware backend so they work off the Pi.
+#
+#   command latency     - actor command until the PWM registers change
+#   I2C per move        - bus transactions per servo move
+#   websocket rate      - commands per second through MainServerApp
+#   stream rate         - MJPEG frames per second per /stream client
+#   startup             - new process until the server could listen
+#
+# Results are written as a JSON report. Given a baseline report, any
+# metric that got worse by more than the tolerance is listed and the
+# exit status is 1, so a CI job can fail on it.
+#
+#   $ python benchmark.py -o report.json -b baseline.json
+#
+# 2026-10-18
+#===========================================================================
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import argparse
+import subprocess
+
+import hwbackend
+os.environ[hwbackend.ENV_VAR] = hwbackend.SimBackend.name
+
+import tornado.gen
+import tornado.ioloop
+import tornado.netutil
+import tornado.httpserver
+import tornado.iostream
+import tornado.tcpclient
+import tornado.websocket
+
+import lasercam
+import hwactor
+import mjpegger
+import wscommands
+import clock
+
+VERSION     = 1         # report format
+TOLERANCE   = 0.2       # fraction a metric may get worse by
+
+LOWER       = 'lower'   # which way is better
+HIGHER      = 'higher'
+
+class Report():
+    """Collects metrics as name : {value, unit, better}."""
+
+    def __init__(self, ):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        self.metrics[name] = {'value': round(value, 4), 'unit': unit, 'better': better}
+
+    def add_stats(self, name, samples, unit, better=LOWER):
+        """Add mean, median and 95th percentile of samples."""
+        samples = sorted(samples)
+        n = len(samples)
+        self.add(name+'_mean', sum(samples)/n, unit, better)
+        self.add(name+'_p50', samples[n//2], unit, better)
+        self.add(name+'_p95', samples[min(n-1, int(n*0.95))], unit, better)
+
+    def as_dict(self, ):
+        return {
+            'version'   : VERSION,
+            'time'      : datetime.datetime.utcnow().isoformat() + 'Z',
+            'python'    : platform.python_version(),
+            'machine'   : platform.machine(),
+            'backend'   : hwbackend.SimBackend.name,
+            'metrics'   : self.metrics,
+        }
+
+def compare(metrics, baseline, tolerance=TOLERANCE):
+    """Return list of (name, value, baseline value) that got worse."""
+    worse = []
+    for name, base in baseline.items():
+        if not name in metrics or base['value'] == 0:
+            continue
+        value = metrics[name]['value']
+        change = (value - base['value']) / abs(base['value'])
+        if base['better'] == HIGHER:
+            change = -change
+        if change > tolerance:
+            worse.append((name, value, base['value']))
+    return worse
+
+#-------------------------------------------------------------------------
+# Hardware
+#-------------------------------------------------------------------------
+def bench_latency(report, samples=50):
+    """Time from queueing a move on the actor until the last I2C transfer
+    that put it in the PWM registers, with modelled bus timing."""
+    backend = hwbackend.SimBackend()
+    box = lasercam.LaserCamBox(backend=backend)
+    box.warm_up()
+    device = backend.i2c.get_i2c_device(lasercam.LaserCamBox.PWM_I2C)
+    actor = hwactor.HardwareActor(box)
+    actor.start()
+    x, y = lasercam.LaserCamBox.CAMERA_HOME
+    latencies = []
+    for i in xrange(samples):
+        target = (x + 10*(i % 2 + 1), y)
+        start = time.time()
+        actor.camera_set_position(target)
+        while not device.get_pwm(lasercam.LaserCamBox.CAMERA_X_CHAN)[1] == target[0]:
+            time.sleep(0.0001)
+        latencies.append(1000 * (device.last_transfer - start))
+        # one move per servo tick, like someone jogging
+        time.sleep(actor.tick)
+    actor.stop()
+    actor.join()
+    report.add_stats('command_latency', latencies, 'ms')
+
+def bench_i2c(report, moves=500):
+    """I2C transactions per move, called directly and through the actor
+    with a burst of moves like a joystick sends."""
+    backend = hwbackend.SimBackend(bus_time=0)
+    box = lasercam.LaserCamBox(backend=backend)
+    box.warm_up()
+    device = backend.i2c.get_i2c_device(lasercam.LaserCamBox.PWM_I2C)
+    start = device.transactions
+    for i in xrange(moves):
+        if i % 2:
+            box.camera_right(1)
+        else:
+            box.camera_left(1)
+    report.add('i2c_per_move_direct', float(device.transactions - start) / moves,
+               'transactions', LOWER)
+    actor = hwactor.HardwareActor(box)
+    actor.start()
+    start = device.transactions
+    for i in xrange(moves):
+        actor.camera_move_relative((1, 0))
+    actor.stop()
+    actor.join()
+    report.add('i2c_per_move_actor', float(device.transactions - start) / moves,
+               'transactions', LOWER)
+
+#-------------------------------------------------------------------------
+# Startup
+#-------------------------------------------------------------------------
+STARTUP_SCRIPT = """
+import time
+start = time.time()
+import laser_server
+laser_server.MainServerApp()
+print time.time() - start
+"""
+
+def bench_startup(report, runs=5):
+    """Seconds for a new process to import the server and build the
+    application, ready to listen, and the whole process time with the
+    interpreter starting."""
+    imports = []
+    total = []
+    for i in xrange(runs):
+        start = time.time()
+        out = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+        total.append(time.time() - start)
+        imports.append(float(out.split()[-1]))
+    report.add_stats('startup_import', imports, 's')
+    report.add_stats('startup_process', total, 's')
+
+#-------------------------------------------------------------------------
+# Server
+#-------------------------------------------------------------------------
+@tornado.gen.coroutine
+def _wait_idle(actor):
+    while actor.queue_depth() > 0:
+        yield tornado.gen.sleep(0.01)
+    yield tornado.gen.sleep(2 * actor.tick)
+
+@tornado.gen.coroutine
+def _ws_rate(port, actor, messages, binary):
+    conn = yield tornado.websocket.websocket_connect('ws://127.0.0.1:{}/ws'.format(port))
+    yield _wait_idle(actor)
+    if binary:
+        message = wscommands.pack([('CM', (1, 0))])
+    else:
+        message = u'CM:1:0'
+    done = actor.intents + messages
+    start = clock.monotonic()
+    for i in xrange(messages):
+        conn.write_message(message, binary=binary)
+    while actor.intents < done:
+        yield tornado.gen.sleep(0.001)
+    elapsed = clock.monotonic() - start
+    conn.close()
+    raise tornado.gen.Return(messages / elapsed)
+
+@tornado.gen.coroutine
+def _stream_rate(port, seconds):
+    stream = yield tornado.tcpclient.TCPClient().connect('127.0.0.1', port)
+    yield stream.write(b"GET /stream HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+    yield stream.read_until(b"\r\n\r\n")
+    frames = 0
+    tail = b""
+    tornado.ioloop.IOLoop.current().call_later(seconds, stream.close)
+    try:
+        while True:
+            data = tail + (yield stream.read_bytes(64*1024, partial=True))
+            frames += data.count(mjpegger.BOUNDARY)
+            # keep enough to catch a boundary split across reads
+            tail = data[-(len(mjpegger.BOUNDARY)-1):]
+    except tornado.iostream.StreamClosedError:
+        pass
+    raise tornado.gen.Return(frames / seconds)
+
+def bench_server(report, messages=2000, clients=3, seconds=5.0):
+    """Websocket command rate and per client stream frame rate through
+    a MainServerApp on a local port."""
+    import laser_server
+    laser_server.theActor.start()
+    sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+    port = sockets[0].getsockname()[1]
+    server = tornado.httpserver.HTTPServer(laser_server.MainServerApp())
+    server.add_sockets(sockets)
+    ioloop = tornado.ioloop.IOLoop.instance()
+
+    box = laser_server.theBox
+    resize, quality = laser_server.STREAM_TIERS[0]
+    box.mjpegstream_start(resize=resize, quality=quality,
+                          tiers=laser_server.STREAM_TIERS[1:],
+                          on_frame=laser_server.theNotifier.frame_ready)
+    box.cameras.wait_first_frame(10)
+    rates = ioloop.run_sync(lambda: [_stream_rate(port, seconds) for i in xrange(clients)],
+                            timeout=seconds+10)
+    box.mjpegstream_stop()
+    report.add_stats('stream_fps', rates, 'frames/s', HIGHER)
+
+    # the stream is stopped when a websocket closes, so these go last
+    for binary, name in ((False, 'ws_text'), (True, 'ws_binary')):
+        rate = ioloop.run_sync(lambda: _ws_rate(port, laser_server.theActor,
+                                                 messages, binary), timeout=60)
+        report.add(name+'_messages_per_s', rate, 'messages/s', HIGHER)
+
+    server.stop()
+    box.cameras.close()
+    laser_server.theActor.stop()
+    laser_server.theActor.join()
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="laser camera box benchmarks")
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help="report file to write")
+    parser.add_argument('-b', '--baseline',
+                        help="earlier report to compare against")
+    parser.add_argument('-t', '--tolerance', type=float, default=TOLERANCE,
+                        help="allowed fractional regression")
+    args = parser.parse_args()
+
+    report = Report()
+    bench_startup(report)
+    bench_latency(report)
+    bench_i2c(report)
+    bench_server(report)
+
+    with open(args.output, 'w') as f:
+        json.dump(report.as_dict(), f, indent=2, sort_keys=True)
+    for name in sorted(report.metrics):
+        metric = report.metrics[name]
+        print "{:32s} {:10.3f} {}".format(name, metric['value'], metric['unit'])
+    print "report written to {}".format(args.output)
+
+    if not args.baseline == None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['metrics']
+        worse = compare(report.metrics, baseline, args.tolerance)
+        for name, value, base in worse:
+            print "REGRESSION {}: {} was {}".format(name, value, base)
+        if worse:
+            sys.exit(1)
@@ -0,0 +1,491 @@
+#===========================================================================
+# camctl.py
+#
+# Camera lifecycle manager. The camera is opened once and kept in a warm
+# standby state between streams so starting a stream does not pay for
+# camera init and sensor warm up. After STANDBY_TIMEOUT in standby the
+# camera is closed completely.
+#
+#   OFF --warm_up()/start()--> STANDBY --start()--> STREAMING
+#   STREAMING --stop()--> STANDBY --timeout/close()--> OFF
+#
+# Each video splitter port in use is a feed: one capture, at one size
+# and format, handed to every consumer registered on the port. Port 0 is
+# the full quality MJPEG stream for viewers, ports 1 and 2 lower quality
+# tiers of it, and port 3 small raw frames for analysis such as motion
+# detection. A consumer writes straight from the camera's buffers, no
+# frame is copied per consumer, and a feed only runs while someone is
+# registered. Registered consumers keep the camera open without a stream.
+#
+# Also provides a fake camera so start up latency can be measured
+# without a Pi.
+#
+# 2026-10-18
+#===========================================================================
+import threading
+import time
+import logging
+
+import clock
+import mjpegger
+
+OFF             = 'off'
+STANDBY         = 'standby'
+STREAMING       = 'streaming'
+
+STANDBY_TIMEOUT =   120     # seconds in standby before camera is closed
+CLOSE_TIMEOUT   =   5.0     # seconds close() waits for the captures to stop
+
+# splitter ports, 1 and 2 carry the lower quality stream tiers
+VIEW_PORT       = 0         # full quality MJPEG for viewers
+ANALYTICS_PORT  = 3         # small raw frames for analysis
+ANALYTICS_SIZE  = (160, 90)
+ANALYTICS_FORMAT = 'yuv'
+
+log = logging.getLogger(__name__)
+
+class Feed():
+    """One capture on a splitter port, handed to every registered
+    consumer. A consumer has write(), commit() and close() and is given
+    the camera's own buffers, one frame at a time. The capture runs
+    while anyone is registered. Consumers added while a frame is being
+    written start with the next one. Removing the last consumer tells
+    the capture to stop and returns without waiting for it, the thread
+    clears _capture on its way out."""
+
+    def __init__(self, manager, port, resize, format, quality=None, on_frame=None):
+        self.manager = manager
+        self.port = port
+        self.resize = resize
+        self.format = format
+        self.quality = quality
+        self.on_frame = on_frame
+        self.consumers = []         # replaced, never changed in place
+        self._pending = []
+        self._capture = None
+        self._dropped = 0           # by consumers since removed
+
+    def add(self, consumer):
+        """Register consumer, starting the capture if it is the first."""
+        with self.manager._lock:
+            if self._capture == None:
+                self.consumers = [consumer]
+                # a capture for this port may still be stopping, the new
+                # one waits for it to let go of the port
+                previous = self.manager._captures.get(self.port)
+                self._capture = _CaptureThread(self.manager, self, self.resize, self.quality,
+                                               self.on_frame, self.port, self.format,
+                                               previous)
+                self.manager._captures[self.port] = self._capture
+                self._capture.start()
+            else:
+                self._pending = self._pending + [consumer]
+
+    def remove(self, consumer):
+        """Unregister and close consumer, telling the capture to stop if
+        it was the last. Does not wait for the capture thread. Return the
+        number left."""
+        with self.manager._lock:
+            if consumer in self.consumers:
+                self.consumers = [c for c in self.consumers if not c is consumer]
+                self._dropped += getattr(consumer, 'dropped', 0)
+            self._pending = [c for c in self._pending if not c is consumer]
+            consumer.close()
+            left = len(self.consumers) + len(self._pending)
+            if left == 0 and not self._capture == None:
+                self._capture.stop()
+            return left
+
+    def is_running(self, ):
+        """True while the capture thread runs, including while it stops."""
+        return not self._capture == None
+
+    # output interface for the capture thread
+    def write(self, b):
+        for consumer in self.consumers:
+            consumer.write(b)
+        return len(b)
+
+    def flush(self, ):
+        pass
+
+    def commit(self, ):
+        for consumer in self.consumers:
+            consumer.commit()
+        if self._pending:
+            with self.manager._lock:
+                self.consumers = self.consumers + self._pending
+                self._pending = []
+
+    @property
+    def dropped(self, ):
+        """Frames dropped by consumers, current and removed, only goes up."""
+        return self._dropped + sum([getattr(c, 'dropped', 0) for c in self.consumers])
+
+    def close(self, ):
+        pass
+
+class CameraManager():
+    """Owns the camera and a feed per splitter port. Nothing here waits on
+    the camera unless asked to, opening happens on the capture threads."""
+
+    def __init__(self, factory, resize=(640,360), standby_timeout=STANDBY_TIMEOUT):
+        self.factory = factory          # returns a new, configured camera
+        self.resize = resize
+        self.quality = None
+        self.tiers = []                 # (resize, quality) for tiers 1, 2, ...
+        self.standby_timeout = standby_timeout
+        self.state = OFF
+        self.camera = None
+        self.frames = None
+        self.first_frame = threading.Event()
+        self.time_to_first_frame = None
+        self.feeds = {}                 # splitter port : Feed
+        self._captures = {}             # splitter port : capture thread, until it exits
+        self._subscribers = {}          # tier : [FrameRing, subscribers]
+        self._on_frame = None
+        self._started = None
+        self._timer = None
+        self._lock = threading.RLock()
+        self._open_lock = threading.Lock()
+
+    def warm_up(self, wait=True):
+        """Open the camera into standby, if it is off. With wait False
+        this returns at once and the camera is opened in the background."""
+        if not wait:
+            thread = threading.Thread(target=self._open, name="CameraWarmUp")
+            thread.daemon = True
+            thread.start()
+        else:
+            self._open()
+
+    def _open(self, ):
+        with self._open_lock:
+            if self.camera == None:
+                self.camera = self.factory()
+        with self._lock:
+            if self.state == OFF:
+                self.state = STANDBY
+                self._arm_timer()
+        return self.camera
+
+    def _feed(self, port, resize=None):
+        feed = self.feeds.get(port)
+        if feed == None:
+            if port == VIEW_PORT:
+                feed = Feed(self, port, self.resize, 'mjpeg', self.quality, self._frame)
+            elif port == ANALYTICS_PORT:
+                feed = Feed(self, port, resize or ANALYTICS_SIZE, ANALYTICS_FORMAT)
+            else:
+                resize, quality = self.tiers[port-1]
+                feed = Feed(self, port, resize, 'mjpeg', quality, self._on_frame)
+            self.feeds[port] = feed
+        return feed
+
+    def register(self, port, consumer, resize=None):
+        """Start handing the frames of splitter port to consumer,
+        VIEW_PORT for full quality MJPEG or ANALYTICS_PORT for small raw
+        frames. The camera stays open while anything is registered.
+        resize asks for another size of raw frames, which only works if
+        the analytics feed is not already running at a different one,
+        ValueError otherwise."""
+        with self._lock:
+            feed = self._feed(port, resize)
+            if not resize == None and not tuple(feed.resize) == tuple(resize):
+                raise ValueError("port {} already runs at {}".format(port, feed.resize))
+            self._cancel_timer()
+            feed.add(consumer)
+
+    def unregister(self, port, consumer):
+        """Stop handing frames to consumer and close it."""
+        with self._lock:
+            feed = self.feeds.get(port)
+            if feed == None:
+                return
+            if feed.remove(consumer) == 0:
+                del self.feeds[port]
+                if not self.feeds and not self.state == OFF:
+                    self.state = STANDBY
+                    self._arm_timer()
+
+    def start(self, on_frame=None):
+        """Start streaming into self.frames. Returns without waiting for
+        the camera or the first frame, use wait_first_frame() for that.
+        The optional on_frame callback is called from the capture thread
+        per frame."""
+        with self._lock:
+            if self.state == STREAMING:
+                return
+            self._started = clock.monotonic()
+            self.first_frame.clear()
+            self._on_frame = on_frame
+            self.frames = mjpegger.FrameRing()
+            self.register(VIEW_PORT, self.frames)
+            self.state = STREAMING
+
+    def subscribe(self, tier):
+        """Return the FrameRing for a tier, starting its capture if this
+        is the first subscriber. Tier 0 is the main stream. Returns None
+        if not streaming."""
+        with self._lock:
+            if not self.state == STREAMING:
+                return None
+            if tier == 0:
+                return self.frames
+            entry = self._subscribers.get(tier)
+            if entry == None:
+                entry = self._subscribers[tier] = [mjpegger.FrameRing(), 0]
+                self.register(tier, entry[0])
+            entry[1] += 1
+            return entry[0]
+
+    def unsubscribe(self, tier):
+        """Drop a subscriber, the capture stops with the last one."""
+        with self._lock:
+            entry = self._subscribers.get(tier)
+            if entry == None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._subscribers[tier]
+                self.unregister(tier, entry[0])
+
+    def wait_first_frame(self, timeout=None):
+        """Block until the first frame of the current stream arrives."""
+        return self.first_frame.wait(timeout)
+
+    def stop(self, ):
+        """Stop streaming, the camera stays open in standby."""
+        with self._lock:
+            if not self.state == STREAMING:
+                return
+            for tier, (ring, subscribers) in self._subscribers.items():
+                self.unregister(tier, ring)
+            self._subscribers = {}
+            frames = self.frames
+            self.frames = None
+            self.state = STANDBY
+            self.unregister(VIEW_PORT, frames)
+
+    def close(self, ):
+        """Stop streaming, close and drop every consumer and release the
+        camera once the captures have stopped. A capture still running
+        after CLOSE_TIMEOUT keeps the camera open, it is tried again at
+        the standby timeout. Waits, so don't call it on the IOLoop or
+        holding the lock."""
+        with self._lock:
+            self.stop()
+            for port, feed in self.feeds.items():
+                for consumer in feed.consumers + feed._pending:
+                    self.unregister(port, consumer)
+            self._cancel_timer()
+            captures = self._captures.values()
+        # outside the lock, the capture threads take it on their way out
+        deadline = clock.monotonic() + CLOSE_TIMEOUT
+        for capture in captures:
+            capture.join(max(0.0, deadline - clock.monotonic()))
+        with self._lock:
+            if self.feeds:
+                return                  # registered again meanwhile
+            if any([capture.is_alive() for capture in captures]):
+                # never pull the camera out from under a recording
+                log.warning("camera captures did not stop, camera left open")
+                self._arm_timer()
+                return
+            with self._open_lock:
+                if not self.camera == None:
+                    self.camera.close()
+                    self.camera = None
+            self.state = OFF
+
+    def is_streaming(self, ):
+        return self.state == STREAMING
+
+    def _frame(self, ):
+        if not self.first_frame.is_set() and not self._started == None:
+            self.time_to_first_frame = clock.monotonic() - self._started
+            self.first_frame.set()
+        if not self._on_frame == None:
+            self._on_frame()
+
+    def _arm_timer(self, ):
+        self._cancel_timer()
+        if self.standby_timeout == None:
+            return
+        self._timer = threading.Timer(self.standby_timeout, self._standby_expired)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self, ):
+        if not self._timer == None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _standby_expired(self, ):
+        with self._lock:
+            if not self.state == STANDBY or self.feeds:
+                return
+        self.close()
+
+    def _capture_done(self, capture):
+        # called by a capture thread as it exits
+        with self._lock:
+            if capture.ring._capture is capture:
+                capture.ring._capture = None
+            if self._captures.get(capture.splitter_port) is capture:
+                del self._captures[capture.splitter_port]
+
+class _CaptureThread(mjpegger.CaptureThread):
+    """Capture thread that opens the camera first if it is off, after
+    the previous capture on its port, if any, has finished."""
+
+    def __init__(self, manager, ring, resize, quality, on_frame, splitter_port=0,
+                 format='mjpeg', previous=None):
+        mjpegger.CaptureThread.__init__(self, None, resize, ring, on_frame,
+                                        quality, splitter_port, format)
+        self.manager = manager
+        self.previous = previous
+
+    def run(self, ):
+        try:
+            if not self.previous == None:
+                self.previous.join()
+                self.previous = None
+            self.camera = self.manager._open()
+            if self.keepRunning:
+                mjpegger.CaptureThread.run(self)
+        finally:
+            self.manager._capture_done(self)
+
+#-------------------------------------------------------------------------
+# Fake camera
+#-------------------------------------------------------------------------
+class FakeCamera():
+    """Stands in for picamera.PiCamera. Opening takes init_delay seconds
+    and the first capture on a freshly opened camera takes another
+    warmup_delay, like the sensor settling. Frames come every 1/framerate.
+    Recordings write them in chunks like the encoder does, so they have
+    to be split back into frames."""
+
+    CHUNK = 16*1024             # bytes per write when recording
+
+    def __init__(self, init_delay=1.0, warmup_delay=0.5, framerate=30,
+                 frame_size=40*1024, **kwargs):
+        time.sleep(init_delay)
+        self.warmup_delay = warmup_delay
+        self.framerate = framerate
+        self.frame = '\xff\xd8' + 'x' * frame_size + '\xff\xd9'
+        self.hflip = False
+        self.vflip = False
+        self.closed = False
+        self.frames_captured = 0
+        self._warm = False
+        self._recordings = {}       # splitter port : [thread, running]
+
+    def capture_continuous(self, output, format='jpeg', use_video_port=False,
+                           resize=None, **kwargs):
+        if not self._warm:
+            time.sleep(self.warmup_delay)
+            self._warm = True
+        while not self.closed:
+            time.sleep(1.0 / self.framerate)
+            output.write(self.frame)
+            self.frames_captured += 1
+            yield output
+
+    def start_recording(self, output, format='h264', resize=None, splitter_port=1, **kwargs):
+        if splitter_port in self._recordings:
+            raise RuntimeError("recording already running on port {}".format(splitter_port))
+        entry = [None, True]
+        entry[0] = threading.Thread(target=self._record, args=(output, entry),
+                                    name="FakeRecording")
+        entry[0].daemon = True
+        self._recordings[splitter_port] = entry
+        entry[0].start()
+
+    def wait_recording(self, timeout=0, splitter_port=1):
+        time.sleep(timeout)
+
+    def stop_recording(self, splitter_port=1):
+        entry = self._recordings.pop(splitter_port, None)
+        if not entry == None:
+            entry[1] = False
+            entry[0].join()
+
+    def _record(self, output, entry):
+        if not self._warm:
+            time.sleep(self.warmup_delay)
+            self._warm = True
+        chunks = [self.frame[i:i+self.CHUNK] for i in xrange(0, len(self.frame), self.CHUNK)]
+        while entry[1] and not self.closed:
+            time.sleep(1.0 / self.framerate)
+            for chunk in chunks:
+                output.write(chunk)
+            self.frames_captured += 1
+
+    def close(self, ):
+        self.closed = True
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # Time to first frame from cold (camera off) and from warm standby,
+    # using the fake camera.
+    RUNS = 3
+    manager = CameraManager(FakeCamera, standby_timeout=None)
+    cold = []
+    warm = []
+    for i in xrange(RUNS):
+        manager.close()
+        manager.start()
+        manager.wait_first_frame()
+        cold.append(manager.time_to_first_frame)
+        manager.stop()
+        manager.start()
+        manager.wait_first_frame()
+        warm.append(manager.time_to_first_frame)
+        manager.stop()
+    manager.close()
+    print "time to first frame, {} runs".format(RUNS)
+    print "  cold  : {:.3f} s".format(sum(cold)/RUNS)
+    print "  warm  : {:.3f} s".format(sum(warm)/RUNS)
+
+    # Three viewers and an analytics consumer, one added part way, off
+    # one capture per port. Every consumer should see whole frames only.
+    class Consumer():
+        def __init__(self, ):
+            self.frames = 0
+            self.partial = 0
+            self._size = 0
+        def write(self, b):
+            self._size += len(b)
+        def commit(self, ):
+            self.frames += 1
+            if not self._size == len(camera.frame):
+                self.partial += 1
+            self._size = 0
+        def close(self, ):
+            pass
+    SECONDS = 2.0
+    cameras = []
+    def factory():
+        cameras.append(FakeCamera(init_delay=0, warmup_delay=0))
+        return cameras[-1]
+    manager = CameraManager(factory, standby_timeout=None)
+    camera = manager._open()
+    viewers = [Consumer() for i in xrange(3)]
+    analytics = Consumer()
+    manager.register(VIEW_PORT, viewers[0])
+    manager.register(VIEW_PORT, viewers[1])
+    manager.register(ANALYTICS_PORT, analytics)
+    time.sleep(SECONDS / 2)
+    manager.register(VIEW_PORT, viewers[2])
+    time.sleep(SECONDS / 2)
+    captures = len(manager.feeds)
+    manager.close()
+    print "feeds, {:.0f} s".format(SECONDS)
+    print "  captures running : {}, frames captured {}".format(captures, camera.frames_captured)
+    for i, viewer in enumerate(viewers):
+        print "  viewer {}         : {} frames, {} partial".format(i, viewer.frames, viewer.partial)
+    print "  analytics        : {} frames, {} partial".format(analytics.frames, analytics.partial)
@@ -0,0 +1,46 @@
+#===========================================================================
+# clock.py
+#
+# Monotonic clock for timers and deadlines. Python 2.7 has no
+# time.monotonic(), so call clock_gettime(CLOCK_MONOTONIC) directly and
+# fall back to time.time() where that is not available.
+#
+# 2026-10-18
+#===========================================================================
+import time
+import ctypes
+import ctypes.util
+
+CLOCK_MONOTONIC = 1     # from <linux/time.h>
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _wall():
+    return time.time()
+
+def _find_clock_gettime():
+    for name in ('rt', 'c'):
+        path = ctypes.util.find_library(name)
+        if path == None:
+            continue
+        try:
+            return ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+    return None
+
+_clock_gettime = _find_clock_gettime()
+
+def _monotonic():
+    ts = _timespec()
+    if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+        raise OSError(ctypes.get_errno(), "clock_gettime failed")
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+elif not _clock_gettime == None:
+    monotonic = _monotonic
+else:
+    monotonic = _wall
@@ -0,0 +1,108 @@
+#===========================================================================
+# futures.py
+#
+# Thread safe Future, a small subset of concurrent.futures.Future which
+# python 2 lacks, and a one thread worker to run slow calls on. Servo
+# moves and snapshots complete on their own threads with these, the
+# server hands the results over to its IOLoop.
+#
+# 2026-10-18
+#===========================================================================
+import threading
+import Queue
+
+class Future():
+    """Result of work done on another thread. Callbacks run on the
+    thread that completes it."""
+
+    def __init__(self, ):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+
+    def done(self, ):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until done, return True unless the timeout ran out."""
+        return self._event.wait(timeout)
+
+    def result(self, ):
+        """Return what the future was completed with, None until done.
+        Raises the exception if it failed."""
+        if not self._exception == None:
+            raise self._exception
+        return self._result
+
+    def exception(self, ):
+        """Return the exception it failed with, or None."""
+        return self._exception
+
+    def add_done_callback(self, func):
+        """Call func(future) when done, straight away if it already is."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def set_result(self, result=None):
+        self._complete(result, None)
+
+    def set_exception(self, exception):
+        self._complete(None, exception)
+
+    def _complete(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+def call(func, *args):
+    """Call func(*args) now, return a done Future of what it returned
+    or raised."""
+    future = Future()
+    try:
+        result = func(*args)
+    except Exception as e:
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+    return future
+
+class Worker():
+    """Runs calls one at a time, in order, on a daemon thread started
+    with the first one. Like a concurrent.futures executor with one
+    thread."""
+
+    def __init__(self, name="Worker"):
+        self.name = name
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """Queue func(*args), return a Future of what it returns or raises."""
+        future = Future()
+        self._queue.put((future, func, args))
+        with self._lock:
+            if self._thread == None:
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+        return future
+
+    def _run(self, ):
+        while True:
+            future, func, args = self._queue.get()
+            try:
+                result = func(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
@@ -0,0 +1,382 @@
+#===========================================================================
+# hwactor.py
+#
+# Single owner thread for the laser camera box hardware. Callers queue
+# intents without blocking and the actor applies them. Servo moves that
+# arrive within one servo tick are merged into one target per axis and
+# sent with a single PWM update.
+#
+# With smooth set, servo moves follow a trajectory: each new target is
+# approached one servo tick at a time within speed and acceleration
+# limits, and settled() returns a Future that is done once everything
+# queued before it has finished moving.
+#
+# The actor also runs the idle watchdog. Every command re-arms it and
+# servo power is cut if nothing arrives before it expires.
+#
+# After every batch and servo tick the actor reads back the hardware
+# state and publishes it, so state() can be shown from any thread
+# without touching the hardware there.
+#
+# 2026-10-18
+#===========================================================================
+import threading
+import Queue
+import time
+import logging
+
+import lasercam
+import servocal
+import trajectory
+import futures
+import watchdog
+import metrics
+
+# intent kinds
+CAMERA_REL  = 0
+CAMERA_ABS  = 1
+LASER_REL   = 2
+LASER_ABS   = 3
+CALL        = 4
+STOP        = 5
+CAMERA_TURN = 6     # relative, in degrees
+LASER_TURN  = 7     # relative, in degrees
+SETTLE      = 8
+
+log = logging.getLogger(__name__)
+
+QUEUE_SECONDS = metrics.Histogram('hwactor_queue_seconds',
+                                  'Time from queueing an intent until it is done', ('kind',))
+
+class HardwareActor(threading.Thread):
+    """Thread that owns all access to a LaserCamBox."""
+
+    TICK = 1.0 / lasercam.LaserCamBox.PWM_FREQ     # one servo frame
+
+    # LaserCamBox methods that are queued and run on the actor thread as is
+    PASSTHROUGH = set(['laser_on', 'laser_off', 'camera_led_on', 'camera_led_off',
+                       'status_led_on', 'status_led_off', 'enable_pwm', 'disable_pwm',
+                       'enable_audio', 'disable_audio', 'speak', 'warm_up'])
+
+    def __init__(self, box, tick=None, idle_timeout=None, smooth=False):
+        threading.Thread.__init__(self, name="HardwareActor")
+        self.daemon = True
+        self.box = box
+        self.tick = tick if not tick == None else HardwareActor.TICK
+        self._queue = Queue.Queue()
+        self._last_apply = 0
+        self.watchdog = None
+        if not idle_timeout == None:
+            self.watchdog = watchdog.Watchdog(idle_timeout)
+        self.planners = None
+        if smooth:
+            self.planners = {servocal.CAMERA: trajectory.Trajectory((0, 0), *trajectory.CAMERA_LIMITS),
+                             servocal.LASER: trajectory.Trajectory((0, 0), *trajectory.LASER_LIMITS)}
+        self._targets = {}          # channels : counts being moved to
+        self._waiters = []          # futures done when motion stops
+        self._oldest = None         # stamp of oldest move not yet started
+        # nothing read from GPIO until the actor has used the box
+        self._state = {'camera': box.camera_get_position(),
+                       'laser': box.laser_get_position(),
+                       'laser_on': 0, 'camera_led': 0, 'status_leds': [0, 0, 0],
+                       'pwm_enabled': False}
+        # counters
+        self.intents = 0
+        self.moves = 0
+        self.applies = 0
+        self.calls = 0
+        self.max_latency = 0.0
+
+    def __getattr__(self, name):
+        if name in HardwareActor.PASSTHROUGH:
+            func = getattr(self.box, name)
+            return lambda *args, **kwargs: self.call(func, *args, **kwargs)
+        raise AttributeError(name)
+
+    #-------------------------------------------------------------------
+    # non-blocking API, safe to call from any thread
+    #-------------------------------------------------------------------
+    def _put(self, kind, args):
+        self._queue.put((kind, args, time.time()))
+
+    def call(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) to run on the actor thread."""
+        self._put(CALL, (func, args, kwargs))
+
+    def camera_move_relative(self, amount):
+        self._put(CAMERA_REL, amount)
+
+    def camera_set_position(self, position):
+        if isinstance(position, tuple) and len(position) == 2:
+            self._put(CAMERA_ABS, position)
+
+    def laser_move_relative(self, amount):
+        self._put(LASER_REL, amount)
+
+    def laser_set_position(self, position):
+        if isinstance(position, tuple) and len(position) == 2:
+            self._put(LASER_ABS, position)
+
+    def camera_home(self, ):
+        self.camera_set_position(lasercam.LaserCamBox.CAMERA_HOME)
+
+    def laser_home(self, ):
+        self.laser_set_position(lasercam.LaserCamBox.LASER_HOME)
+
+    def settled(self, ):
+        """Return a futures.Future that is done once the servo moves
+        queued so far have finished."""
+        future = futures.Future()
+        self._put(SETTLE, future)
+        return future
+
+    def camera_move_angle(self, amount):
+        self._put(CAMERA_TURN, amount)
+
+    def camera_set_angle(self, angles):
+        if isinstance(angles, tuple) and len(angles) == 2:
+            self._put(CAMERA_ABS, self.box.calibration.to_pwm(servocal.CAMERA, angles))
+
+    def laser_move_angle(self, amount):
+        self._put(LASER_TURN, amount)
+
+    def laser_set_angle(self, angles):
+        if isinstance(angles, tuple) and len(angles) == 2:
+            self._put(LASER_ABS, self.box.calibration.to_pwm(servocal.LASER, angles))
+
+    def _camera_step(self, step):
+        return self.box.camera_step if step == None else step
+
+    def _laser_step(self, step):
+        return self.box.laser_step if step == None else step
+
+    def camera_up(self, step=None):
+        self.camera_move_angle((0, -self._camera_step(step)))
+
+    def camera_down(self, step=None):
+        self.camera_move_angle((0, self._camera_step(step)))
+
+    def camera_left(self, step=None):
+        self.camera_move_angle((-self._camera_step(step), 0))
+
+    def camera_right(self, step=None):
+        self.camera_move_angle((self._camera_step(step), 0))
+
+    def laser_up(self, step=None):
+        self.laser_move_angle((0, self._laser_step(step)))
+
+    def laser_down(self, step=None):
+        self.laser_move_angle((0, -self._laser_step(step)))
+
+    def laser_left(self, step=None):
+        self.laser_move_angle((-self._laser_step(step), 0))
+
+    def laser_right(self, step=None):
+        self.laser_move_angle((self._laser_step(step), 0))
+
+    def state(self, ):
+        """Return the hardware state last published by the actor as a
+        dict of camera, laser, laser_on, camera_led, status_leds and
+        pwm_enabled. Never touches the hardware."""
+        return self._state
+
+    def queue_depth(self, ):
+        """Return number of intents waiting."""
+        return self._queue.qsize()
+
+    def coalescing_ratio(self, ):
+        """Return servo moves received per PWM update sent."""
+        if self.applies == 0:
+            return 0.0
+        return float(self.moves) / self.applies
+
+    def stop(self, ):
+        self._put(STOP, None)
+
+    #-------------------------------------------------------------------
+    # actor thread
+    #-------------------------------------------------------------------
+    def run(self, ):
+        running = True
+        while running:
+            try:
+                batch = [self._queue.get(timeout=self._wait_time())]
+            except Queue.Empty:
+                if self._moving():
+                    self._step()
+                else:
+                    self._idle_expired()
+                self._publish()
+                continue
+            # wait out the rest of the servo tick so a burst is merged
+            delay = self._last_apply + self.tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+            running = self._process(batch)
+            if self._moving():
+                self._step()
+            if not self.watchdog == None:
+                self.watchdog.kick()
+            self._publish()
+        self._settle()
+
+    def _wait_time(self, ):
+        if self._moving():
+            return max(0, self._last_apply + self.tick - time.time())
+        return self._idle_remaining()
+
+    def _idle_remaining(self, ):
+        if self.watchdog == None:
+            return None
+        return self.watchdog.remaining()
+
+    def _idle_expired(self, ):
+        if self.watchdog.remaining() > 0:
+            return          # woke up early, wait again
+        if self.watchdog.expire():
+            log.info("idle for %g s, servo power off", self.watchdog.timeout)
+            self.box.disable_pwm()
+
+    def _process(self, batch):
+        camera = None
+        laser = None
+        oldest = None
+        for kind, args, stamp in batch:
+            self.intents += 1
+            if kind == STOP:
+                self._apply(camera, laser, oldest)
+                return False
+            if kind == SETTLE:
+                self._apply(camera, laser, oldest)
+                camera = laser = oldest = None
+                self._waiters.append(args)
+                if not self._moving():
+                    self._settle()
+                continue
+            if kind == CALL:
+                # keep ordering, pending moves go out first
+                self._apply(camera, laser, oldest)
+                camera = laser = oldest = None
+                func, fargs, fkwargs = args
+                try:
+                    func(*fargs, **fkwargs)
+                except Exception:
+                    log.exception("hardware call %s failed", func.__name__)
+                self.calls += 1
+                QUEUE_SECONDS.observe(time.time() - stamp, ('call',))
+                continue
+            self.moves += 1
+            oldest = stamp if oldest == None else oldest
+            if kind == CAMERA_REL:
+                x, y = camera or self._base(servocal.CAMERA)
+                camera = self._clamp(servocal.CAMERA, (x + args[0], y + args[1]))
+            elif kind == CAMERA_TURN:
+                camera = self.box.calibration.move(servocal.CAMERA,
+                                    camera or self._base(servocal.CAMERA), args)
+            elif kind == CAMERA_ABS:
+                camera = args
+            elif kind == LASER_REL:
+                x, y = laser or self._base(servocal.LASER)
+                laser = self._clamp(servocal.LASER, (x + args[0], y + args[1]))
+            elif kind == LASER_TURN:
+                laser = self.box.calibration.move(servocal.LASER,
+                                    laser or self._base(servocal.LASER), args)
+            elif kind == LASER_ABS:
+                laser = args
+        self._apply(camera, laser, oldest)
+        return True
+
+    def _clamp(self, channels, position):
+        # same limits as each individual jog would have hit
+        return self.box.calibration.bound(channels, position)
+
+    def _position(self, channels):
+        if channels == servocal.CAMERA:
+            return self.box.camera_get_position()
+        return self.box.laser_get_position()
+
+    def _base(self, channels):
+        # relative moves add to where the servos are heading
+        if self._moving(channels):
+            return self._targets[channels]
+        return self._position(channels)
+
+    def _moving(self, channels=None):
+        if self.planners == None:
+            return False
+        if channels == None:
+            return any([p.moving() for p in self.planners.values()])
+        return self.planners[channels].moving()
+
+    def _apply(self, camera, laser, oldest):
+        if camera == None and laser == None:
+            return
+        if self.planners == None:
+            self.box.set_positions(camera=camera, laser=laser)
+            self._last_apply = time.time()
+            self.applies += 1
+            self._observe(oldest)
+            return
+        # hand the targets to the planners, the next _step starts moving
+        calibration = self.box.calibration
+        for channels, target in ((servocal.CAMERA, camera), (servocal.LASER, laser)):
+            if target == None:
+                continue
+            planner = self.planners[channels]
+            if not planner.moving():
+                # the box may have been moved behind the actor's back
+                planner.jump(calibration.to_angles(channels, self._position(channels)))
+            self._targets[channels] = tuple(target)
+            planner.set_target(calibration.to_angles(channels, target))
+        if self._oldest == None:
+            self._oldest = oldest
+
+    def _step(self, ):
+        """Send the next setpoint of every moving servo pair."""
+        positions = {}
+        for channels, planner in self.planners.items():
+            if not planner.moving():
+                continue
+            angles = planner.step(self.tick)
+            if planner.moving():
+                positions[channels] = self.box.calibration.to_pwm(channels, angles)
+            else:
+                # land exactly on the counts asked for
+                positions[channels] = self._targets[channels]
+        self.box.set_positions(camera=positions.get(servocal.CAMERA),
+                               laser=positions.get(servocal.LASER))
+        self._last_apply = time.time()
+        self.applies += 1
+        if not self._oldest == None:
+            self._observe(self._oldest)
+            self._oldest = None
+        if not self._moving():
+            self._settle()
+
+    def _publish(self, ):
+        box = self.box
+        try:
+            self._state = {'camera': box.camera_get_position(),
+                           'laser': box.laser_get_position(),
+                           'laser_on': box.get_laser_state(),
+                           'camera_led': box.get_camera_led_state(),
+                           'status_leds': [box.get_status_led_state(led) for led in (1, 2, 3)],
+                           'pwm_enabled': box.get_pwm_state() == 0}
+        except Exception:
+            log.exception("reading hardware state failed")
+
+    def _settle(self, ):
+        waiters, self._waiters = self._waiters, []
+        if waiters:
+            self._publish()     # state() shows what was waited for
+        for future in waiters:
+            future.set_result()
+
+    def _observe(self, oldest):
+        self.max_latency = max(self.max_latency, self._last_apply - oldest)
+        QUEUE_SECONDS.observe(self._last_apply - oldest, ('move',))
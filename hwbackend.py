@@ -0,0 +1,202 @@
+#===========================================================================
+# hwbackend.py
+#
+# Hardware backends for the laser camera box. A backend hands out the
+# GPIO module, the PCA9685 PWM controller and the camera, so LaserCamBox
+# does not import any Pi only library itself.
+#
+#   PiBackend   - the real thing, RPi.GPIO, Adafruit_PCA9685, picamera
+#   SimBackend  - simulated parts that count operations and model I2C
+#                 bus timing, for running and measuring off the Pi
+#
+# The backend used by default is picked with the LASERCAM_BACKEND
+# environment variable, 'pi' (default) or 'sim'.
+#
+# 2026-10-18
+#===========================================================================
+import os
+import math
+import time
+
+import pwmout
+import camctl
+
+ENV_VAR         = 'LASERCAM_BACKEND'
+I2C_BYTE_TIME   = 9 / 100000.0      # seconds per byte at 100 kHz, 8 bits + ack
+
+class PiBackend():
+    """Real hardware. Libraries are only imported when first used."""
+
+    name = 'pi'
+
+    def gpio(self, ):
+        """Return the GPIO module."""
+        import RPi.GPIO as GPIO
+        return GPIO
+
+    def pwm(self, address, i2c=None):
+        """Return a PCA9685 at address."""
+        from Adafruit_PCA9685 import PCA9685
+        return PCA9685(address, i2c=i2c)
+
+    def camera(self, **kwargs):
+        """Return a newly opened camera."""
+        import picamera
+        return picamera.PiCamera(**kwargs)
+
+    def counters(self, ):
+        return {}
+
+class SimBackend():
+    """Simulated hardware. Pass bus_time=0 to take I2C timing out."""
+
+    name = 'sim'
+
+    def __init__(self, bus_time=I2C_BYTE_TIME, camera_init=1.0, camera_warmup=0.5,
+                 framerate=30, frame_size=40*1024):
+        self.i2c = pwmout.FakeI2C(bus_time)
+        self.GPIO = SimGPIO()
+        self.camera_init = camera_init
+        self.camera_warmup = camera_warmup
+        self.framerate = framerate
+        self.frame_size = frame_size
+        self.cameras = []
+
+    def gpio(self, ):
+        return self.GPIO
+
+    def pwm(self, address, i2c=None):
+        bus = self.i2c if i2c == None else i2c
+        return SimPCA9685(bus.get_i2c_device(address))
+
+    def camera(self, **kwargs):
+        camera = camctl.FakeCamera(self.camera_init, self.camera_warmup,
+                                   self.framerate, self.frame_size, **kwargs)
+        self.cameras.append(camera)
+        return camera
+
+    def counters(self, ):
+        """Return dict of operation counts so far."""
+        devices = self.i2c.devices.values()
+        return {
+            'gpio_writes'       : self.GPIO.writes,
+            'gpio_reads'        : self.GPIO.reads,
+            'i2c_transactions'  : sum([d.transactions for d in devices]),
+            'i2c_bytes'         : sum([d.bytes_written for d in devices]),
+            'cameras_opened'    : len(self.cameras),
+            'frames_captured'   : sum([c.frames_captured for c in self.cameras]),
+        }
+
+def get_backend(name=None):
+    """Return a new backend by name, default from the environment."""
+    if name == None:
+        name = os.environ.get(ENV_VAR, PiBackend.name)
+    if name == PiBackend.name:
+        return PiBackend()
+    if name == SimBackend.name:
+        return SimBackend()
+    raise ValueError("unknown hardware backend {}".format(name))
+
+#-------------------------------------------------------------------------
+# Simulated parts
+#-------------------------------------------------------------------------
+class SimGPIO():
+    """Stands in for the RPi.GPIO module. Keeps pin levels and counts
+    reads and writes. press(pin) fires an edge callback like a button."""
+
+    BCM         = 11
+    BOARD       = 10
+    OUT         = 0
+    IN          = 1
+    LOW         = 0
+    HIGH        = 1
+    PUD_OFF     = 20
+    PUD_DOWN    = 21
+    PUD_UP      = 22
+    RISING      = 31
+    FALLING     = 32
+    BOTH        = 33
+
+    def __init__(self, ):
+        self.mode = None
+        self.pins = {}
+        self.callbacks = {}
+        self.writes = 0
+        self.reads = 0
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, initial=0, pull_up_down=None):
+        if direction == SimGPIO.IN:
+            initial = SimGPIO.HIGH if pull_up_down == SimGPIO.PUD_UP else SimGPIO.LOW
+        self.pins[pin] = initial
+
+    def output(self, pin, value):
+        self.writes += 1
+        self.pins[pin] = value
+
+    def input(self, pin):
+        self.reads += 1
+        return self.pins.get(pin, SimGPIO.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+
+    def press(self, pin):
+        """Simulate a falling edge on pin."""
+        callback = self.callbacks.get(pin)
+        if not callback == None:
+            callback(pin)
+
+    def cleanup(self, ):
+        self.pins = {}
+        self.callbacks = {}
+
+class SimPCA9685():
+    """Same interface and register traffic as Adafruit_PCA9685.PCA9685,
+    on top of a pwmout.FakeI2CDevice."""
+
+    MODE2       = 0x01
+    PRESCALE    = 0xFE
+    ALL_LED_ON_L= 0xFA
+    RESTART     = 0x80
+    SLEEP       = 0x10
+    ALLCALL     = 0x01
+    OUTDRV      = 0x04
+
+    def __init__(self, device):
+        self._device = device
+        self.set_all_pwm(0, 0)
+        self._device.write8(SimPCA9685.MODE2, SimPCA9685.OUTDRV)
+        self._device.write8(pwmout.MODE1, SimPCA9685.ALLCALL)
+        time.sleep(0.005)   # wait for oscillator
+        mode1 = self._device.readU8(pwmout.MODE1) & ~SimPCA9685.SLEEP
+        self._device.write8(pwmout.MODE1, mode1)
+        time.sleep(0.005)
+
+    def set_pwm_freq(self, freq_hz):
+        prescale = int(math.floor(25000000.0 / 4096.0 / freq_hz - 1.0 + 0.5))
+        oldmode = self._device.readU8(pwmout.MODE1)
+        self._device.write8(pwmout.MODE1, (oldmode & 0x7F) | SimPCA9685.SLEEP)
+        self._device.write8(SimPCA9685.PRESCALE, prescale)
+        self._device.write8(pwmout.MODE1, oldmode)
+        time.sleep(0.005)
+        self._device.write8(pwmout.MODE1, oldmode | SimPCA9685.RESTART)
+
+    def set_pwm(self, channel, on, off):
+        reg = pwmout.LED0_ON_L + pwmout.REGS_PER_CHAN*channel
+        self._device.write8(reg, on & 0xFF)
+        self._device.write8(reg+1, on >> 8)
+        self._device.write8(reg+2, off & 0xFF)
+        self._device.write8(reg+3, off >> 8)
+
+    def set_all_pwm(self, on, off):
+        reg = SimPCA9685.ALL_LED_ON_L
+        self._device.write8(reg, on & 0xFF)
+        self._device.write8(reg+1, on >> 8)
+        self._device.write8(reg+2, off & 0xFF)
+        self._device.write8(reg+3, off >> 8)
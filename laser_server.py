@@ -8,31 +8,211 @@
 # Carter Nelson
 #===========================================================================
 import time
-import pickle
+START_TIME = time.time()        # before the imports, for the startup time
+
 import os.path
+import datetime
+import logging
+import threading
 
 import tornado.httpserver
 import tornado.websocket
 import tornado.web
 import tornado.ioloop
+import tornado.iostream
+import tornado.locks
+import tornado.gen
+import tornado.concurrent
 
 import lasercam
+import mjpegger
+import wscommands
+import hwactor
+import speech
+import presets
+import watchdog
+import clock
+import metrics
+import servocal
+import sessions
+import snapshot
+import recorder
+import patterns
+
+log = logging.getLogger(__name__)
+
+# preset storage file
+PRESETS_FILE = '/home/pi/rpi-laser/presets.json'
 
-# location storeage pickle file
+# old location storage pickle file, imported if there are no presets yet
 LOCATIONS_PKL = '/home/pi/rpi-laser/locations.pkl'
 
+# pixel to servo calibration file
+CALIBRATION_FILE = '/home/pi/rpi-laser/calibration.json'
+
+# servo angle calibration file, written by servocal.py
+SERVO_CAL_FILE = servocal.DEFAULT_FILE
+
+# cache directory for synthesized speech
+SPEECH_CACHE = '/home/pi/rpi-laser/speech'
+
+# clips saved from the pre-event recording, with the seconds of video
+# before and after the trigger
+CLIP_DIR = '/home/pi/rpi-laser/clips'
+CLIP_PRE_SECONDS = 10.0
+CLIP_POST_SECONDS = 10.0
+
+# camera stream quality tiers as ((width, height), jpeg quality), best
+# first, each client is moved between them to suit its connection
+STREAM_TIERS = [((640,360), 85), ((480,270), 60), ((320,180), 40)]
+STREAM_MAX_FPS = 30
+STREAM_MIN_FPS = 2
+
+# /snapshot.jpg, with no stream running a captured frame is served for
+# SNAPSHOT_TTL seconds, clients may reuse one for SNAPSHOT_MAX_AGE
+SNAPSHOT_TTL = 5.0
+SNAPSHOT_MAX_AGE = 1
+
 # define port server will listen to
 PORT = 8080
 
-# a single global instance to be used by the server
-theBox = lasercam.LaserCamBox()
+# a single global instance to be used by the server, nothing is touched
+# until first use or warm_up()
+theBox = lasercam.LaserCamBox(calibration=servocal.ServoCalibration(SERVO_CAL_FILE))
+
+# all hardware access goes through this, started with the server,
+# servos move smoothly and power is cut after watchdog.MAX_IDLE_TIME
+# without a command
+theActor = hwactor.HardwareActor(theBox, idle_timeout=watchdog.MAX_IDLE_TIME, smooth=True)
+
+# camera and laser presets in degrees, shared by all connections
+thePresets = presets.PresetStore(PRESETS_FILE, legacy_pkl=LOCATIONS_PKL,
+                                 convert=lambda kind, position: theBox.calibration.to_angles(
+                                     servocal.CAMERA if kind == 'camera' else servocal.LASER, position))
+
+# speech output, amp is switched on around playback by the speaker
+# thread itself, one GPIO write, so it is on before aplay starts
+theSpeaker = speech.Speaker(speech.PhraseCache(SPEECH_CACHE),
+                            amp_on=theBox.enable_audio,
+                            amp_off=theBox.disable_audio)
+
+# click to aim calibration and follow the cat, shared by all connections,
+# made by aiming() as they need NumPy, which is slow to import
+theAimMap = None
+theTracker = None
+theCalibrator = None
+_aimingLock = threading.Lock()
+
+# the last seconds of video while the stream or the tracker runs, saved
+# as a clip on RC, the top button or when the tracker sees motion start,
+# see armRecorder()
+theRecorder = recorder.ClipRecorder(theBox.cameras, CLIP_DIR,
+                                    pre=CLIP_PRE_SECONDS, post=CLIP_POST_SECONDS)
+# the viewer feed it records is the same one the stream uses
+theBox.cameras.resize, theBox.cameras.quality = STREAM_TIERS[0]
+theBox.register_btn_func(lambda: theRecorder.trigger('button'))
+
+# laser patterns played on the server, PP:n plays number n, recording
+# with PR goes into the last one
+thePatterns = [patterns.circle(), patterns.figure_eight(), patterns.chase(),
+               patterns.Pattern('recorded')]
+thePlayer = patterns.PatternPlayer(theActor, theBox.laser_get_position)
+
+def aiming():
+    """Return the aim map and the tracker, loading them the first time."""
+    global theAimMap, theTracker
+    with _aimingLock:
+        if theTracker == None:
+            import aimmap
+            import tracker
+            theAimMap = aimmap.AimMap(CALIBRATION_FILE)
+            # motion detection driving the laser and camera
+            theTracker = tracker.Tracker(theBox, theActor, theAimMap,
+                                         on_motion=lambda: theRecorder.trigger('motion'))
+    return theAimMap, theTracker
+
+def stopTracking():
+    if not theTracker == None:
+        theTracker.stop()
+    armRecorder()
+
+def armRecorder():
+    """Keep the last seconds of video in memory only while the stream or
+    the tracker runs, so the encoder is not kept busy for nothing. A
+    clip triggered otherwise starts at the trigger."""
+    if theBox.mjpgstream_is_alive() or (not theTracker == None and theTracker.is_running()):
+        theRecorder.arm()
+    else:
+        theRecorder.disarm()
+
+def readState():
+    """Hardware state shown to every client, keys as in sessions.py. The
+    hardware part is what the actor last published, nothing is read
+    from the hardware on the IOLoop."""
+    hw = theActor.state()
+    return {'c': list(hw['camera']),
+            'l': list(hw['laser']),
+            'z': hw['laser_on'],
+            'q': hw['camera_led'],
+            'e': list(hw['status_leds']),
+            'p': int(hw['pwm_enabled']),
+            's': "/stream" if theBox.mjpgstream_is_alive() else "",
+            'v': int(theRecorder.is_recording())}
+
+def on_ioloop(future):
+    """Return a tornado Future completed on the IOLoop with the result
+    or exception of a futures.Future done on another thread."""
+    bridged = tornado.concurrent.Future()
+    def copy(done):
+        if done.exception() == None:
+            bridged.set_result(done.result())
+        else:
+            bridged.set_exception(done.exception())
+    if future.done():
+        copy(future)
+    else:
+        ioloop = tornado.ioloop.IOLoop.instance()
+        future.add_done_callback(lambda done: ioloop.add_callback(copy, done))
+    return bridged
+
+# latest frame for /snapshot.jpg
+theSnapshots = snapshot.SnapshotCache(theBox.cameras, ttl=SNAPSHOT_TTL)
+
+# websocket clients, one controls and the rest watch
+theSessions = sessions.SessionManager(readState)
+
+# profiler for the IOLoop thread, switched with /profile?enable=1
+theProfiler = metrics.Profiler()
+
+# instrumentation served at /metrics
+WS_COMMAND_SECONDS = metrics.Histogram('ws_command_seconds',
+                                       'Time to handle a websocket command', ('op',))
+STREAM_FRAMES_SENT = metrics.Counter('stream_frames_sent_total',
+                                     'Frames sent to a stream client', ('client',))
+STREAM_FRAMES_SKIPPED = metrics.Counter('stream_frames_skipped_total',
+                                        'Frames a stream client was too slow for', ('client',))
+STREAM_TIER = metrics.Gauge('stream_tier', 'Quality tier a stream client is on', ('client',))
+STARTUP_SECONDS = metrics.Gauge('server_startup_seconds',
+                                'Seconds from process start until the server was listening')
+IOLOOP_LAG_SECONDS = metrics.Histogram('ioloop_lag_seconds',
+                                       'How late the IOLoop ran a timed callback')
+metrics.Gauge('hwactor_queue_depth', 'Intents waiting for the hardware actor',
+              func=theActor.queue_depth)
+metrics.Gauge('speech_queue_depth', 'Phrases waiting to be spoken',
+              func=theSpeaker.queue_depth)
+metrics.Gauge('websocket_clients', 'Websocket clients connected',
+              func=lambda: len(theSessions.sessions))
+metrics.Gauge('recorder_buffer_bytes', 'Bytes of video held for the next clip',
+              func=theRecorder.used)
+metrics.Gauge('profiler_enabled', '1 if the IOLoop profiler is on',
+              func=lambda: int(theProfiler.enabled))
 
 # status LEDs for server
 #STREAM_STATUS_LED   = 1     # blinks if camera stream is running
 CONNECT_STATUS_LED  = 1     # on if someone is accessing webpage
 SERVER_STATUS_LED   = 3     # on if server is running
 
-# dictionary of phrases for audio output
+# dictionary of phrases for audio output, a new one cuts off the one playing
 sound = {}
 sound['S1'] = 'hey cat!'
 sound['S2'] = 'meow meow meow'
@@ -47,30 +227,190 @@ sound['S9'] = 'sound 9'
 #-------------------------------------------------------------------------
 # Tornado Server Setup
 #-------------------------------------------------------------------------   
+class FrameNotifier():
+    """Wakes up stream handlers on the IOLoop when a new frame arrives."""
+
+    def __init__(self, ):
+        self.ioloop = tornado.ioloop.IOLoop.instance()
+        self.condition = tornado.locks.Condition()
+
+    def frame_ready(self, ):
+        """Called from the capture thread."""
+        self.ioloop.add_callback(self.condition.notify_all)
+
+    def wait(self, timeout=1.0):
+        """Return a Future that resolves on the next frame or timeout."""
+        return self.condition.wait(timeout=datetime.timedelta(seconds=timeout))
+
+# a single global frame notifier, shared by all stream handlers
+theNotifier = FrameNotifier()
+
+class LoopLagMonitor():
+    """Schedules a callback every interval seconds and records how late
+    the IOLoop got round to running it."""
+
+    def __init__(self, interval=0.5):
+        self.ioloop = tornado.ioloop.IOLoop.instance()
+        self.interval = interval
+        self._due = None
+
+    def start(self, ):
+        self._due = self.ioloop.time() + self.interval
+        self.ioloop.call_at(self._due, self._check)
+
+    def _check(self, ):
+        IOLOOP_LAG_SECONDS.observe(max(0.0, self.ioloop.time() - self._due))
+        self.start()
+
 class KillHandler(tornado.web.RequestHandler):
     """RequestHandler that stops the server."""
     
     def get(self):
-        print "KILL Request from {}".format(self.request.remote_ip)
+        log.info("KILL request from %s", self.request.remote_ip)
         tornado.ioloop.IOLoop.instance().stop()
 
+class MetricsHandler(tornado.web.RequestHandler):
+    """RequestHandler for metrics in Prometheus text format."""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.render())
+
+class ProfileHandler(tornado.web.RequestHandler):
+    """RequestHandler for the IOLoop profiler. ?enable=1 or 0 switches it
+    on or off, ?reset=1 clears it. Returns the current profile."""
+
+    def get(self):
+        enable = self.get_argument('enable', None)
+        if enable == '1':
+            theProfiler.enable()
+        elif enable == '0':
+            theProfiler.disable()
+        if self.get_argument('reset', None) == '1':
+            theProfiler.reset()
+        self.set_header('Content-Type', 'text/plain')
+        self.write("profiler {}\n\n".format('on' if theProfiler.enabled else 'off'))
+        self.write(theProfiler.report(self.get_argument('sort', 'cumulative')))
+
 class LaserCamHandler(tornado.web.RequestHandler):
     """RequestHandlder for main page."""
     
     def get(self):
-        print "GET Request from {}".format(self.request.remote_ip)
+        log.info("GET request from %s", self.request.remote_ip)
         self.render("lasercam.html")
         
+class StreamHandler(tornado.web.RequestHandler):
+    """RequestHandler for the MJPEG stream."""
+
+    def initialize(self, lasercambox, notifier):
+        self.lasercambox = lasercambox
+        self.notifier = notifier
+        self.closed = False
+
+    def on_connection_close(self):
+        self.closed = True
+
+    @tornado.gen.coroutine
+    def get(self):
+        log.info("STREAM request from %s", self.request.remote_ip)
+        self.set_header('Content-type',
+                        'multipart/x-mixed-replace; boundary='+mjpegger.BOUNDARY)
+        self.set_header('Cache-Control', 'no-cache')
+        cameras = self.lasercambox.cameras
+        pacer = mjpegger.StreamPacer(1 + len(cameras.tiers),
+                                     STREAM_MAX_FPS, STREAM_MIN_FPS)
+        tier = 0
+        ring = cameras.subscribe(tier)
+        last_count = 0
+        client = "{}:{}".format(self.request.remote_ip,
+                                self.request.connection.stream.socket.getpeername()[1])
+        labels = (client,)
+        STREAM_TIER.set(tier, labels)
+        try:
+            while not self.closed:
+                if ring == None or not ring.running:
+                    break
+                buf = ring.acquire(last_count, timeout=0)
+                if buf == None:
+                    yield self.notifier.wait()
+                    continue
+                try:
+                    if last_count and buf.count > last_count + 1:
+                        STREAM_FRAMES_SKIPPED.inc(buf.count - last_count - 1, labels)
+                    last_count = buf.count
+                    part = buf.part().tobytes()
+                finally:
+                    ring.release(buf)
+                backlog = mjpegger.send_backlog(self.request.connection.stream.socket)
+                start = clock.monotonic()
+                self.write(part)
+                try:
+                    # don't take another frame until this one is on its way,
+                    # slow clients skip frames instead of queueing them
+                    yield self.flush()
+                except tornado.iostream.StreamClosedError:
+                    return
+                STREAM_FRAMES_SENT.inc(labels=labels)
+                pacer.sent(clock.monotonic() - start, len(part), backlog)
+                if not pacer.tier == tier:
+                    cameras.unsubscribe(tier)
+                    tier = pacer.tier
+                    ring = cameras.subscribe(tier)
+                    last_count = 0
+                    STREAM_TIER.set(tier, labels)
+                delay = pacer.delay()
+                if delay > 0:
+                    yield tornado.gen.sleep(delay)
+        finally:
+            cameras.unsubscribe(tier)
+            for metric in (STREAM_FRAMES_SENT, STREAM_FRAMES_SKIPPED, STREAM_TIER):
+                metric.remove(labels)
+
+class SnapshotHandler(tornado.web.RequestHandler):
+    """RequestHandler for the latest camera frame as one JPEG. ?w=N
+    returns a thumbnail at least N pixels wide, of the sizes in
+    snapshot.THUMB_WIDTHS."""
+
+    def initialize(self, snapshots):
+        self.snapshots = snapshots
+
+    @tornado.gen.coroutine
+    def get(self):
+        shot = yield self._snapshot()
+        if shot == None:
+            raise tornado.web.HTTPError(503, "no frame from camera")
+        width = self.get_argument('w', None)
+        if not width == None and not width.isdigit():
+            raise tornado.web.HTTPError(400, "bad width")
+        self.set_header('Cache-Control', 'max-age={}'.format(SNAPSHOT_MAX_AGE))
+        self.set_header('Etag', shot.etag if width == None else shot.thumb_etag(width))
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.set_header('Content-Type', 'image/jpeg')
+        if width == None:
+            self.write(shot.jpeg)
+            return
+        try:
+            thumb = yield on_ioloop(shot.thumbnail(int(width)))
+        except ImportError:
+            raise tornado.web.HTTPError(501, "thumbnails need python-imaging")
+        self.write(thumb)
+
+    def _snapshot(self):
+        """Return a Future of the newest snapshot."""
+        return on_ioloop(self.snapshots.get())
+
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     """WebSocketHandler for web socket communications."""
     
-    def initialize(self, lasercambox):
+    def initialize(self, lasercambox, actor, speaker, presets, sessions):
         self.lasercambox = lasercambox
-        self.lasercambox.enable_pwm(update=True)
+        self.actor = actor
+        self.speaker = speaker
+        self.presets = presets
+        self.sessions = sessions
 
-        self.cameraLocation = [None,None,None,None,None]
-        self.laserLocation = [None,None,None,None,None]
-        self._loadLocations()
         self.storeCamera = False
         self.storeLaser = False
         self.camera_loop = None
@@ -80,157 +420,243 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
         self._blink_count = 0
             
     def open(self):
-        print "WS open from {}".format(self.request.remote_ip)
-        self.lasercambox.status_led_on(CONNECT_STATUS_LED)
+        log.info("WS open from %s", self.request.remote_ip)
+        self.sessions.join(self)
+        self.actor.status_led_on(CONNECT_STATUS_LED)
+        # likely to want the stream, get the camera ready
+        self.lasercambox.camera_warm_up(wait=False)
     
     def on_close(self):
-        print "WS close"
-        self._shutDown()
+        log.info("WS close from %s", self.request.remote_ip)
+        had_control = self.sessions.leave(self)
+        if not self.sessions.sessions:
+            self._shutDown()
+        elif had_control:
+            self._stopActivity()
+
+    # commands an observer may send without taking control, the stream
+    # is shared so starting and stopping it is left to the controller
+    OBSERVER_COMMANDS = set(['RL'])
     
+    # opcode : handler(self, *args)
+    COMMANDS = {
+        'LU' : lambda self: self.actor.laser_up(),
+        'LD' : lambda self: self.actor.laser_down(),
+        'LL' : lambda self: self.actor.laser_left(),
+        'LR' : lambda self: self.actor.laser_right(),
+        'LN' : lambda self: self.actor.laser_on(),
+        'LO' : lambda self: self.actor.laser_off(),
+        'LP' : lambda self, x, y: self.actor.laser_set_position((x,y)),
+        'L!' : lambda self: self._armLaserStore(),
+        'L1' : lambda self: self._laserPreset(1),
+        'L2' : lambda self: self._laserPreset(2),
+        'L3' : lambda self: self._laserPreset(3),
+        'L4' : lambda self: self._laserPreset(4),
+        'L5' : lambda self: self._laserPreset(5),
+        'LS' : lambda self, n: self._storeLaserPreset(n),
+        'LG' : lambda self, n: self.actor.laser_set_angle(self.presets.get('laser', n)),
+        'LA' : lambda self, x, y: self._aimLaser(x, y),
+        'LK' : lambda self: self._calibrate(),
+        'PP' : lambda self, n: self._playPattern(n),
+        'PS' : lambda self: thePlayer.stop(),
+        'PV' : lambda self, percent: thePlayer.set_speed(percent / 100.0),
+        'PL' : lambda self, loop: thePlayer.set_loop(bool(loop)),
+        'PR' : lambda self, start: self._recordPattern(start),
+        'TN' : lambda self: self._startTracking(),
+        'TO' : lambda self: stopTracking(),
+        'RQ' : lambda self: None,   # taking control is done by dispatch
+        'RL' : lambda self: self._releaseControl(),
+        'RC' : lambda self: theRecorder.trigger('ws'),
+        'CU' : lambda self: self.actor.camera_up(),
+        'CD' : lambda self: self.actor.camera_down(),
+        'CL' : lambda self: self.actor.camera_left(),
+        'CR' : lambda self: self.actor.camera_right(),
+        'CM' : lambda self, x, y: self.actor.camera_move_angle((x,y)),
+        'CP' : lambda self, x, y: self.actor.camera_set_position((x,y)),
+        'CN' : lambda self: self._startStream(),
+        'CO' : lambda self: self._stopStream(),
+        'C!' : lambda self: self._armCameraStore(),
+        'C1' : lambda self: self._cameraPreset(1),
+        'C2' : lambda self: self._cameraPreset(2),
+        'C3' : lambda self: self._cameraPreset(3),
+        'C4' : lambda self: self._cameraPreset(4),
+        'C5' : lambda self: self._cameraPreset(5),
+        'CS' : lambda self, n: self._storeCameraPreset(n),
+        'CG' : lambda self, n: self.actor.camera_set_angle(self.presets.get('camera', n)),
+        'CA' : lambda self, x, y: self.actor.camera_set_position(
+                    aiming()[0].camera_for_pixel(self.lasercambox.camera_get_position(), (x,y))),
+        'QN' : lambda self: self.actor.camera_led_on(),
+        'QO' : lambda self: self.actor.camera_led_off(),
+        'SN' : lambda self: self.actor.enable_pwm(),
+        'SO' : lambda self: self.actor.disable_pwm(),
+        'S1' : lambda self: self.speaker.say(sound['S1'], preempt=True),
+        'S2' : lambda self: self.speaker.say(sound['S2'], preempt=True),
+        'S3' : lambda self: self.speaker.say(sound['S3'], preempt=True),
+        'S4' : lambda self: self.speaker.say(sound['S4'], preempt=True),
+        'S5' : lambda self: self.speaker.say(sound['S5'], preempt=True),
+        'S6' : lambda self: self.speaker.say(sound['S6'], preempt=True),
+        'S7' : lambda self: self.speaker.say(sound['S7'], preempt=True),
+        'S8' : lambda self: self.speaker.say(sound['S8'], preempt=True),
+        'S9' : lambda self: self.speaker.say(sound['S9'], preempt=True),
+    }
+
     def on_message(self, message):
-        print "WS message: {} = ".format(message),
-        MSG = message.strip().upper()
-        if (MSG=='LU'):
-            print "laser up"
-            self.lasercambox.laser_up()
-        elif (MSG=='LD'):
-            print "laser down"
-            self.lasercambox.laser_down()
-        elif (MSG=='LL'):
-            print "laser left"
-            self.lasercambox.laser_left()
-        elif (MSG=='LR'):
-            print "laser right"
-            self.lasercambox.laser_right()
-        elif (MSG=='LN'):
-            print "laser on"
-            self.lasercambox.laser_on()
-        elif (MSG=='LO'):
-            print "laser off"
-            self.lasercambox.laser_off()
-        elif (MSG=='L!'):
-            print "laser storage armed"
-            self.storeLaser=True
-        elif (MSG=='L1'):
-            self._laserPreset(0)
-        elif (MSG=='L2'):
-            self._laserPreset(1)
-        elif (MSG=='L3'):
-            self._laserPreset(2)
-        elif (MSG=='L4'):
-            self._laserPreset(3)
-        elif (MSG=='L5'):
-            self._laserPreset(4)
-        elif (MSG=='CU'):
-            print "camera up"
-            self.lasercambox.camera_up()
-        elif (MSG=='CD'):
-            print "camera down"
-            self.lasercambox.camera_down()
-        elif (MSG=='CL'):
-            print "camera left"
-            self.lasercambox.camera_left()
-        elif (MSG=='CR'):
-            print "camera right"
-            self.lasercambox.camera_right()
-        elif (MSG=='CN'):
-            print "camera start stream"
-            self._startStream()
-        elif (MSG=='CO'):
-            print "camera stop stream"
-            self._startStream()
-        elif (MSG=='C!'):
-            print "camera storage armed"
-            self.storeCamera=True
-        elif (MSG=='C1'):
-            self._cameraPreset(0)
-        elif (MSG=='C2'):
-            self._cameraPreset(1)
-        elif (MSG=='C3'):
-            self._cameraPreset(2)
-        elif (MSG=='C4'):
-            self._cameraPreset(3)
-        elif (MSG=='C5'):
-            self._cameraPreset(4)
-        elif (MSG=='QN'):
-            print "camera LED on"
-            self.lasercambox.camera_led_on()
-        elif (MSG=='QO'):
-            print "camera LED off"
-            self.lasercambox.camera_led_off()
-        elif (MSG=='SN'):
-            print "servos on"
-            self.lasercambox.enable_pwm()
-        elif (MSG=='SO'):
-            print "servos off"
-            self.lasercambox.disable_pwm()
-        elif (MSG.startswith("CM")):
-            x = int(float(MSG.split(":")[1]))
-            y = int(float(MSG.split(":")[2]))
-            self.lasercambox.camera_move_relative((x,y))           
-            print "camera relative move %i, %i" % (x,y)
-        elif (MSG in ['S1','S2','S3','S4','S5','S6','S7','S8','S9']):
-            print "playing sound"
-            self.lasercambox.speak(sound[MSG])
-        else:
-            print "unknown command"
-              
+        try:
+            if isinstance(message, unicode):
+                commands = wscommands.parse_text(message)
+            else:
+                commands = wscommands.parse_binary(message)
+        except wscommands.ProtocolError as e:
+            log.warning("WS bad message: %s", e)
+            return
+        for op, args in commands:
+            self.dispatch(op, args)
+
+    def dispatch(self, op, args=()):
+        """Run the handler for a single command."""
+        handler = WebSocketHandler.COMMANDS.get(op)
+        if handler == None:
+            log.warning("WS unknown command: %s", op)
+            return
+        if not len(args) == wscommands.NARGS[op]:
+            log.warning("WS wrong number of arguments: %s %s", op, args)
+            return
+        if not op in WebSocketHandler.OBSERVER_COMMANDS and not self._takeControl():
+            log.debug("WS command from observer: %s", op)
+            return
+        log.debug("WS command: %s %s", op, args)
+        start = metrics.now()
+        handler(self, *args)
+        WS_COMMAND_SECONDS.observe(metrics.now() - start, (op,))
+
+    def _takeControl(self):
+        """Return True if this client has or now gets control."""
+        if self.sessions.is_controller(self):
+            return self.sessions.acquire(self)
+        if not self.sessions.acquire(self):
+            return False
+        log.info("WS control to %s", self.request.remote_ip)
+        self.actor.enable_pwm(update=True)
+        return True
+
+    def _releaseControl(self):
+        """Let go of control, stopping anything left running."""
+        if self.sessions.is_controller(self):
+            self.sessions.release(self)
+            self._stopActivity()
+
+    def _stopActivity(self):
+        thePlayer.stop()
+        stopTracking()
+
+    def _armLaserStore(self):
+        log.info("laser storage armed")
+        self.storeLaser = True
+
+    def _armCameraStore(self):
+        log.info("camera storage armed")
+        self.storeCamera = True
+
     def _startStream(self):
-        self.lasercambox.mjpegstream_start()
-        addr = self.request.host.partition(":")[0]
-        self.write_message("http://" + addr + ":8081/")
+        resize, quality = STREAM_TIERS[0]
+        self.lasercambox.mjpegstream_start(resize=resize, quality=quality,
+                                           tiers=STREAM_TIERS[1:],
+                                           on_frame=theNotifier.frame_ready)
+        armRecorder()
+        # clients pick up the stream URL from the next state update
         
-    def _startStream(self):
-        self.write_message("")
+    def _stopStream(self):
         self.lasercambox.mjpegstream_stop()
+        armRecorder()
         
-    def _cameraPreset(self, position=None):
-        if position==None:
-            return
+    def _cameraPreset(self, name):
         if self.storeCamera:
-            print "storing camera location %i" % (position+1)
-            self.cameraLocation[position]=(self.lasercambox.camera_get_position())
+            self._storeCameraPreset(name)
             self.storeCamera = False
         else:
-            print "goto camera store %i" % (position+1)
-            self.lasercambox.camera_set_position(self.cameraLocation[position])
-            
-    def _laserPreset(self, position=None):
-        if position==None:
-            return
+            log.debug("goto camera store %s", name)
+            self.actor.camera_set_angle(self.presets.get('camera', name))
+
+    def _storeCameraPreset(self, name):
+        log.info("storing camera location %s", name)
+        self.presets.set('camera', name, self.lasercambox.camera_get_angle())
+
+    def _laserPreset(self, name):
         if self.storeLaser:
-            print "storing laser location %i" % (position+1)
-            self.laserLocation[position]=(self.lasercambox.laser_get_position())
+            self._storeLaserPreset(name)
             self.storeLaser = False
         else:
-            print "goto laser store %i" % (position+1)
-            self.lasercambox.laser_set_position(self.laserLocation[position])
-            
-    def _loadLocations(self):
-        if os.path.isfile(LOCATIONS_PKL):
-            with open(LOCATIONS_PKL,'rb') as PKL:
-                temp = pickle.load(PKL)
-            self.cameraLocation = temp[0]
-            self.laserLocation = temp[1]
-            print "locations loaded"
-            
-    def _saveLocations(self):
-        temp = [self.cameraLocation,self.laserLocation]
-        with open(LOCATIONS_PKL,'wb') as PKL:
-            pickle.dump(temp, PKL)
-        print "locations saved"
-                
+            log.debug("goto laser store %s", name)
+            self.actor.laser_set_angle(self.presets.get('laser', name))
+
+    def _storeLaserPreset(self, name):
+        log.info("storing laser location %s", name)
+        self.presets.set('laser', name, self.lasercambox.laser_get_angle())
+
+    def _aimLaser(self, x, y):
+        target = aiming()[0].laser_for_pixel(self.lasercambox.camera_get_position(), (x,y))
+        if target == None:
+            log.warning("no aiming calibration covers pixel %d %d", x, y)
+            return
+        self.actor.laser_set_position(target)
+
+    def _calibrate(self):
+        global theCalibrator
+        if not theCalibrator == None and theCalibrator.is_alive():
+            log.warning("calibration already running")
+            return
+        import aimmap
+        aimMap, tracker = aiming()
+        # calibration takes over the analytics feed, at its own frame size
+        tracker.stop()
+        log.info("calibrating aim at camera %s", self.lasercambox.camera_get_position())
+        theCalibrator = aimmap.Calibrator(self.lasercambox, self.actor, aimMap)
+        theCalibrator.start()
+
+    def _startTracking(self):
+        if not theCalibrator == None and theCalibrator.is_alive():
+            log.warning("calibration running, not tracking")
+            return
+        log.info("following the cat")
+        thePlayer.stop()
+        aiming()[1].start()
+        armRecorder()
+
+    def _playPattern(self, n):
+        if not 1 <= n <= len(thePatterns) or len(thePatterns[n-1]) == 0:
+            log.warning("no pattern %d", n)
+            return
+        log.info("playing pattern %s", thePatterns[n-1].name)
+        thePlayer.play(thePatterns[n-1])
+
+    def _recordPattern(self, start):
+        if start:
+            log.info("recording pattern")
+            thePlayer.record()
+            return
+        pattern = thePlayer.stop_recording()
+        if not pattern == None:
+            log.info("recorded %.1f s pattern", pattern.duration())
+            thePatterns[-1] = pattern
+
+    def _settled(self):
+        """Return a Future that is done when the servo moves queued so
+        far have finished."""
+        return on_ioloop(self.actor.settled())
+
+    @tornado.gen.coroutine
     def _shutDown(self):
+        self._stopActivity()
         self.lasercambox.mjpegstream_stop()
-        self.lasercambox.enable_pwm()
-        self.lasercambox.camera_home()
-        self.lasercambox.laser_home()  
-        self.lasercambox.camera_led_off()
-        self.lasercambox.laser_off()
-        self.lasercambox.status_led_off(CONNECT_STATUS_LED)
-        self._saveLocations()
-        time.sleep(1) # give servos time to move
-        self.lasercambox.disable_pwm()
+        armRecorder()
+        self.actor.enable_pwm()
+        self.actor.camera_home()
+        self.actor.laser_home()
+        self.actor.camera_led_off()
+        self.actor.laser_off()
+        self.actor.status_led_off(CONNECT_STATUS_LED)
+        yield self._settled()
+        self.actor.disable_pwm()
     
     '''    
     def _toggle_stream_LED(self):
@@ -252,7 +678,16 @@ class MainServerApp(tornado.web.Application):
         handlers = [
             (r"/kill",              KillHandler),
             (r"/lasercam",          LaserCamHandler),
-            (r"/ws",                WebSocketHandler, dict(lasercambox=theBox)),             
+            (r"/metrics",           MetricsHandler),
+            (r"/profile",           ProfileHandler),
+            (r"/stream",            StreamHandler, dict(lasercambox=theBox,
+                                                        notifier=theNotifier)),
+            (r"/snapshot.jpg",      SnapshotHandler, dict(snapshots=theSnapshots)),
+            (r"/ws",                WebSocketHandler, dict(lasercambox=theBox,
+                                                           actor=theActor,
+                                                           speaker=theSpeaker,
+                                                           presets=thePresets,
+                                                           sessions=theSessions)),             
         ]
         
         settings = {
@@ -266,9 +701,31 @@ class MainServerApp(tornado.web.Application):
 # MAIN
 #===========================================================
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    theActor.start()
+    thePlayer.start()
+    theSpeaker.start()
+    theSpeaker.prerender(sound.values())
     tornado.httpserver.HTTPServer(MainServerApp()).listen(PORT)
-    print "Server started on port {}...".format(PORT)
-    theBox.status_led_on(SERVER_STATUS_LED)
+    LoopLagMonitor().start()
+    STARTUP_SECONDS.set(time.time() - START_TIME)
+    print "Server started on port {} in {:.2f} s...".format(PORT, STARTUP_SECONDS.value())
+    # hardware comes up on the actor thread and aiming on its own while
+    # requests are served
+    theActor.warm_up()
+    warm_up = threading.Thread(target=aiming, name="AimingWarmUp")
+    warm_up.daemon = True
+    warm_up.start()
+    theActor.status_led_on(SERVER_STATUS_LED)
     tornado.ioloop.IOLoop.instance().start()
-    theBox.status_led_off(SERVER_STATUS_LED)
+    theActor.status_led_off(SERVER_STATUS_LED)
+    thePlayer.shutdown()
+    stopTracking()
+    theRecorder.disarm()
+    theRecorder.wait()
+    theSpeaker.stop()
+    thePresets.close()
+    theActor.stop()
+    theActor.join()
     print "i guess we're done then."       
\ No newline at end of file
@@ -5,69 +5,212 @@
 # Control laser with Wii remote over bluetooth.
 #  * bluetooth via USB dongle and standard linux BT stack
 #  * Wii remote control using Cwiid (http://abstrakraft.org/cwiid/)
-#       sudo apt-get install python-cwiid 
+#       sudo apt-get install python-cwiid
+#
+# The Wiimote reports in callback mode, so the laser follows the
+# nunchuk as soon as a report arrives instead of on a polling tick.
+# Stick values map to servo values through a 256 entry table per axis,
+# spanning each laser servo's calibrated range, and the laser is only
+# written when its output actually changes, small stick wobbles inside
+# the deadband are ignored.
+#
+# Input comes from a source object, either the Wiimote or a recorded
+# stick trace, so the controller can be run without one:
+#   $ python laser_wii.py --replay trace.txt
 #
 # 2015-03-09
 # Carter Nelson
 #===========================================================================
+import sys
 import time
+import threading
 
 import lasercam
-import cwiid
+import servocal
 
 NUNCHUK_MIN = 31
 NUNCHUK_MAX = 229
-#SERVO_MIN = 205     # linear
-#SERVO_MAX = 410     # linear
-SERVO_MIN = 130     # non-linear
-SERVO_MAX = 600     # non-linear
-
-lasercambox = lasercam.LaserCamBox()
-lasercambox.enablePWM(update=True)
-
-def interp(xval, xmin, xmax, ymin, ymax):
-    """Linear interpolation."""
-    xval = xmin if (xval<xmin) else xval
-    xval = xmax if (xval>xmax) else xval
-    xv = float(xval)
-    xn = float(xmin)
-    xx = float(xmax)
-    yn = float(ymin)
-    yx = float(ymax)
-    xi = yn + (xv-xn) * ((yx-yn)/(xx-xn))
-    return int(xi)
-    
-for x in xrange(1,5):
-    lasercambox.statusLEDOn(2)
-    time.sleep(0.5)
-    lasercambox.statusLEDOff(2)
-    time.sleep(0.5)
-print "Press 1+2 on Wiimote now..."
-wiimote = cwiid.Wiimote()  
-wiimote.led = 9
-wiimote.rpt_mode = cwiid.RPT_BTN | cwiid.RPT_EXT
-time.sleep(1)
-print "Connected."
-lasercambox.statusLEDOn(2)
-
-abort = False
-    
-print "Press A to quit."
-while not abort:
-    buttons = wiimote.state['buttons']
-    nunchuk_buttons = wiimote.state['nunchuk']['buttons']
-    nunchuk_stick = wiimote.state['nunchuk']['stick']   
-    if (buttons & cwiid.BTN_A):
-        abort = True
-    if (nunchuk_buttons & cwiid.NUNCHUK_BTN_Z):
-        lasercambox.laserOn()
-    else:
-        lasercambox.laserOff()
-    sx = interp(nunchuk_stick[0],NUNCHUK_MIN,NUNCHUK_MAX,SERVO_MIN,SERVO_MAX)
-    sy = interp(nunchuk_stick[1],NUNCHUK_MIN,NUNCHUK_MAX,SERVO_MIN,SERVO_MAX)
-    lasercambox.laserSetPosition( (sx,sy) )
-    time.sleep(0.05)
-
-lasercambox.laserOff()
-lasercambox.statusLEDOff(2)
-lasercambox.disablePWM()
+DEADBAND = 2        # stick counts ignored around the last position used
+
+def make_table(servo, xmin=NUNCHUK_MIN, xmax=NUNCHUK_MAX):
+    """Return list mapping every stick value 0-255 to a servo value,
+    for a servocal.ServoTable. The stick range spans the servo's
+    calibrated angles evenly."""
+    amin, amax = servo.limits
+    table = []
+    for x in xrange(256):
+        x = min(max(x, xmin), xmax)
+        table.append(servo.pwm(amin + (x - xmin) * (amax - amin) / float(xmax - xmin)))
+    return table
+
+class WiiLaserController():
+    """Turns nunchuk samples into laser commands on a LaserCamBox,
+    sending only what changed."""
+
+    def __init__(self, box, deadband=DEADBAND, tables=None):
+        self.box = box
+        self.deadband = deadband
+        if tables == None:
+            tables = [make_table(box.calibration[channel]) for channel in servocal.LASER]
+        self.tables = tables        # (x, y) stick to servo value tables
+        self.done = threading.Event()
+        self._stick = None          # stick sample last acted on
+        self._position = None       # laser position last sent
+        self._laser = None          # laser on/off last sent
+        # counters
+        self.samples = 0
+        self.writes = 0
+
+    def stick(self, sx, sy):
+        """New stick sample."""
+        self.samples += 1
+        last = self._stick
+        if (not last == None and abs(sx - last[0]) <= self.deadband
+                             and abs(sy - last[1]) <= self.deadband):
+            return
+        self._stick = (sx, sy)
+        position = (self.tables[0][sx], self.tables[1][sy])
+        if not position == self._position:
+            self.box.laser_set_position(position)
+            self._position = position
+            self.writes += 1
+
+    def trigger(self, pressed):
+        """Z button state, the laser is on while it is held."""
+        pressed = bool(pressed)
+        if pressed == self._laser:
+            return
+        if pressed:
+            self.box.laser_on()
+        else:
+            self.box.laser_off()
+        self._laser = pressed
+        self.writes += 1
+
+    def quit(self, ):
+        self.done.set()
+
+class WiimoteSource():
+    """Feeds a controller from a Wiimote with nunchuk, using callbacks.
+    With record set to a list, samples are added to it as trace lines."""
+
+    def __init__(self, record=None):
+        import cwiid
+        self.cwiid = cwiid
+        self.record = record
+        self.wiimote = None
+        self.controller = None
+        self._start = None
+
+    def connect(self, ):
+        """Wait for the Wiimote, press 1+2 on it."""
+        self.wiimote = self.cwiid.Wiimote()
+        self.wiimote.led = 9
+
+    def run(self, controller):
+        self.controller = controller
+        self._start = time.time()
+        self.wiimote.rpt_mode = self.cwiid.RPT_BTN | self.cwiid.RPT_EXT
+        self.wiimote.mesg_callback = self._callback
+        self.wiimote.enable(self.cwiid.FLAG_MESG_IFC)
+        controller.done.wait()
+        self.wiimote.disable(self.cwiid.FLAG_MESG_IFC)
+
+    def _callback(self, mesg_list, timestamp):
+        # called from the cwiid thread
+        for mesg_type, mesg in mesg_list:
+            if mesg_type == self.cwiid.MSG_NUNCHUK:
+                sx, sy = mesg['stick']
+                z = mesg['buttons'] & self.cwiid.NUNCHUK_BTN_Z
+                self.controller.stick(sx, sy)
+                self.controller.trigger(z)
+                if not self.record == None:
+                    self.record.append((time.time() - self._start, sx, sy, int(bool(z))))
+            elif mesg_type == self.cwiid.MSG_BTN:
+                if mesg & self.cwiid.BTN_A:
+                    self.controller.quit()
+
+class TraceSource():
+    """Feeds a controller from a recorded trace of (seconds, stick x,
+    stick y, z) samples, in real time or as fast as possible."""
+
+    def __init__(self, trace, realtime=True):
+        self.trace = trace
+        self.realtime = realtime
+
+    def connect(self, ):
+        pass
+
+    def run(self, controller):
+        start = time.time()
+        for t, sx, sy, z in self.trace:
+            if self.realtime:
+                delay = start + t - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            controller.stick(sx, sy)
+            controller.trigger(z)
+            if controller.done.is_set():
+                break
+        controller.quit()
+
+def load_trace(path):
+    """Read a trace file, one 'seconds x y z' sample per line."""
+    trace = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if fields and not fields[0].startswith('#'):
+                trace.append((float(fields[0]),) + tuple([int(v) for v in fields[1:4]]))
+    return trace
+
+def save_trace(path, trace):
+    with open(path, 'w') as f:
+        for sample in trace:
+            f.write("{:.4f} {} {} {}\n".format(*sample))
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--replay':
+        # replay a trace on simulated hardware, compare bus traffic with
+        # the old loop that wrote every 50 ms whatever the stick did
+        import hwbackend
+        trace = load_trace(sys.argv[2])
+        backend = hwbackend.SimBackend(bus_time=0)
+        box = lasercam.LaserCamBox(backend=backend,
+                                   calibration=servocal.ServoCalibration(servocal.DEFAULT_FILE))
+        box.warm_up()
+        controller = WiiLaserController(box)
+        start = backend.counters()
+        TraceSource(trace, realtime=False).run(controller)
+        end = backend.counters()
+        ticks = int(trace[-1][0] / 0.05) + 1
+        print "{} samples over {:.1f} s".format(len(trace), trace[-1][0])
+        print "  controller writes  : {}".format(controller.writes)
+        print "  I2C transactions   : {}".format(end['i2c_transactions'] - start['i2c_transactions'])
+        print "  GPIO writes        : {}".format(end['gpio_writes'] - start['gpio_writes'])
+        print "  old polling writes : {}".format(2 * ticks)
+        sys.exit(0)
+
+    lasercambox = lasercam.LaserCamBox(calibration=servocal.ServoCalibration(servocal.DEFAULT_FILE))
+    lasercambox.enable_pwm(update=True)
+
+    for x in xrange(1,5):
+        lasercambox.status_led_on(2)
+        time.sleep(0.5)
+        lasercambox.status_led_off(2)
+        time.sleep(0.5)
+    print "Press 1+2 on Wiimote now..."
+    source = WiimoteSource()
+    source.connect()
+    print "Connected."
+    lasercambox.status_led_on(2)
+
+    print "Press A to quit."
+    source.run(WiiLaserController(lasercambox))
+
+    lasercambox.laser_off()
+    lasercambox.status_led_off(2)
+    lasercambox.disable_pwm()
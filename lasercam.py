@@ -7,12 +7,18 @@
 # Carter Nelson
 #===========================================================================
 import os
+import threading
 
-import RPi.GPIO as GPIO
-from Adafruit_PCA9685 import PCA9685 as PWM
+import camctl
+import pwmout
+import hwbackend
+import metrics
+import servocal
 
-import picamera
-import mjpegger
+UPDATE_PWM_SECONDS = metrics.Histogram('lasercam_update_pwm_seconds',
+                                       'Time to send servo positions to the PWM controller')
+INIT_SECONDS = metrics.Histogram('lasercam_init_seconds',
+                                 'Time for a part of the hardware to come up', ('part',))
 
 class LaserCamBox():
     """Provides hardware interface to laser/camera box."""
@@ -29,39 +35,32 @@ class LaserCamBox():
     LASER_Y_CHAN        =   3       # PWM channel for laser Y
     CAMERA_X_CHAN       =   0       # PWM channel for camera X
     CAMERA_Y_CHAN       =   1       # PWM channel for camera Y   
-    #SERVO_MIN           =   205     # minimum PWM value for servo
-    #SERVO_MAX           =   410     # maximum PWM value for servo
-    SERVO_MIN           =   130     # minimum PWM value for servo
-    SERVO_MAX           =   600     # maximum PWM value for servo
     CAMERA_HOME         =   (290,100)
     LASER_HOME          =   (320,490)
-    DEF_STEP            =   10      # default servo step
+    DEF_STEP            =   4.0     # default servo step in degrees
     PWM_I2C             =   0x40    # i2c address for PWM controller
     PWM_FREQ            =   50      # frequency in Hz for PWM controller
     
-    def __init__(self, ):
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(LaserCamBox.AMP_PIN,     GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(LaserCamBox.OE_PIN,      GPIO.OUT, initial=GPIO.HIGH)
-        GPIO.setup(LaserCamBox.LASER_PIN,   GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(LaserCamBox.CAM_LED_PIN, GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(LaserCamBox.LED1_PIN,    GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(LaserCamBox.LED2_PIN,    GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(LaserCamBox.LED3_PIN,    GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(LaserCamBox.TOP_BTN_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.add_event_detect(LaserCamBox.TOP_BTN_PIN,
-                                GPIO.FALLING,
-                                bouncetime=500,
-                                callback=self.btn_callback)
+    def __init__(self, i2c=None, backend=None, calibration=None):
+        if backend == None:
+            backend = hwbackend.get_backend()
+        if calibration == None:
+            calibration = servocal.ServoCalibration()
+        self.backend = backend
+        self.calibration = calibration
+        self.i2c = i2c
+        
+        # GPIO, audio and PWM come up on first use, or all with warm_up()
+        self._gpio = None
+        self._audio = False
+        self._pwm = None
+        self._pwm_out = None
+        self._init_lock = threading.RLock()
+        self.init_seconds = {}          # part : seconds it took to come up
         
         self.top_btn_func = None
         
-        self.PWM = PWM(LaserCamBox.PWM_I2C)
-        self.PWM.set_pwm_freq(LaserCamBox.PWM_FREQ)
-        
-        self.camera = None
-        self._mjpegger = None        
+        self.cameras = camctl.CameraManager(self._open_camera)
         
         self.camera_x = LaserCamBox.CAMERA_HOME[0]
         self.camera_y = LaserCamBox.CAMERA_HOME[1]
@@ -71,6 +70,84 @@ class LaserCamBox():
         self.laser_y = LaserCamBox.LASER_HOME[1]
         self.laser_step = LaserCamBox.DEF_STEP
     
+    def warm_up(self, camera=False):
+        """Bring up GPIO, audio and PWM now rather than on first use, and
+        with camera True start opening the camera in the background."""
+        self.GPIO
+        self._init_audio()
+        self.PWM
+        if camera:
+            self.camera_warm_up(wait=False)
+    
+    @property
+    def GPIO(self, ):
+        """The GPIO module, pins are set up the first time it is used."""
+        if self._gpio == None:
+            self._init_gpio()
+        return self._gpio
+    
+    @property
+    def PWM(self, ):
+        """The PCA9685, set up the first time it is used."""
+        if self._pwm == None:
+            self._init_pwm()
+        return self._pwm
+    
+    @property
+    def pwm_out(self, ):
+        """Cached output to the PCA9685."""
+        if self._pwm_out == None:
+            self._init_pwm()
+        return self._pwm_out
+    
+    def _init_gpio(self, ):
+        with self._init_lock:
+            if not self._gpio == None:
+                return
+            start = metrics.now()
+            GPIO = self.backend.gpio()
+            GPIO.setwarnings(False)
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(LaserCamBox.OE_PIN,      GPIO.OUT, initial=GPIO.HIGH)
+            GPIO.setup(LaserCamBox.LASER_PIN,   GPIO.OUT, initial=GPIO.LOW)
+            GPIO.setup(LaserCamBox.CAM_LED_PIN, GPIO.OUT, initial=GPIO.LOW)
+            GPIO.setup(LaserCamBox.LED1_PIN,    GPIO.OUT, initial=GPIO.LOW)
+            GPIO.setup(LaserCamBox.LED2_PIN,    GPIO.OUT, initial=GPIO.LOW)
+            GPIO.setup(LaserCamBox.LED3_PIN,    GPIO.OUT, initial=GPIO.LOW)
+            GPIO.setup(LaserCamBox.TOP_BTN_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            GPIO.add_event_detect(LaserCamBox.TOP_BTN_PIN,
+                                    GPIO.FALLING,
+                                    bouncetime=500,
+                                    callback=self.btn_callback)
+            self._gpio = GPIO
+            self._initialized('gpio', start)
+    
+    def _init_audio(self, ):
+        with self._init_lock:
+            if self._audio:
+                return
+            start = metrics.now()
+            GPIO = self.GPIO
+            GPIO.setup(LaserCamBox.AMP_PIN, GPIO.OUT, initial=GPIO.LOW)
+            self._audio = True
+            self._initialized('audio', start)
+    
+    def _init_pwm(self, ):
+        with self._init_lock:
+            if not self._pwm == None:
+                return
+            start = metrics.now()
+            PWM = self.backend.pwm(LaserCamBox.PWM_I2C, i2c=self.i2c)
+            PWM.set_pwm_freq(LaserCamBox.PWM_FREQ)
+            self._pwm_out = pwmout.PWMOutput(PWM._device)
+            self._pwm = PWM
+            self._initialized('pwm', start)
+    
+    def _initialized(self, part, start):
+        seconds = metrics.now() - start
+        self.init_seconds[part] = seconds
+        INIT_SECONDS.observe(seconds, (part,))
+    
     def register_btn_func(self, func):
         self.top_btn_func = func
         
@@ -79,43 +156,49 @@ class LaserCamBox():
             if not self.top_btn_func == None:
                 self.top_btn_func()
         
-    def _bound(self, val, val_min, val_max):
-        val = val if val > val_min else val_min
-        val = val if val < val_max else val_max
-        return val
-    
     def check_servo_values(self, ):
-        """Bound the PWM values to MIN and MAX."""
-        self.laser_x = self._bound(self.laser_x, LaserCamBox.SERVO_MIN, LaserCamBox.SERVO_MAX)
-        self.laser_y = self._bound(self.laser_y, LaserCamBox.SERVO_MIN, LaserCamBox.SERVO_MAX)
-        self.camera_x = self._bound(self.camera_x, LaserCamBox.SERVO_MIN, LaserCamBox.SERVO_MAX)
-        self.camera_y = self._bound(self.camera_y, LaserCamBox.SERVO_MIN, LaserCamBox.SERVO_MAX)
+        """Bound the PWM values to each servo's calibrated range."""
+        self.laser_x, self.laser_y = self.calibration.bound(servocal.LASER,
+                                                            (self.laser_x, self.laser_y))
+        self.camera_x, self.camera_y = self.calibration.bound(servocal.CAMERA,
+                                                              (self.camera_x, self.camera_y))
         
     def update_pwm(self, ):
-        """Send current PWM values to PWM device."""
+        """Send changed PWM values to PWM device."""
+        start = metrics.now()
         self.check_servo_values()
-        self.PWM.set_pwm(LaserCamBox.LASER_X_CHAN, 0, self.laser_x)
-        self.PWM.set_pwm(LaserCamBox.LASER_Y_CHAN, 0, self.laser_y)
-        self.PWM.set_pwm(LaserCamBox.CAMERA_X_CHAN, 0, self.camera_x)
-        self.PWM.set_pwm(LaserCamBox.CAMERA_Y_CHAN, 0, self.camera_y)
+        self.pwm_out.set_pwm(LaserCamBox.LASER_X_CHAN, 0, self.laser_x)
+        self.pwm_out.set_pwm(LaserCamBox.LASER_Y_CHAN, 0, self.laser_y)
+        self.pwm_out.set_pwm(LaserCamBox.CAMERA_X_CHAN, 0, self.camera_x)
+        self.pwm_out.set_pwm(LaserCamBox.CAMERA_Y_CHAN, 0, self.camera_y)
+        self.pwm_out.flush()
+        UPDATE_PWM_SECONDS.observe(metrics.now() - start)
+        
+    def set_positions(self, camera=None, laser=None):
+        """Move camera and/or laser to absolute positions with one update."""
+        if not camera == None:
+            self.camera_x, self.camera_y = camera
+        if not laser == None:
+            self.laser_x, self.laser_y = laser
+        self.update_pwm()
         
     def enable_pwm(self, update=False):
         """Enable power to the servos."""
-        GPIO.output(LaserCamBox.OE_PIN, GPIO.LOW)
+        self.GPIO.output(LaserCamBox.OE_PIN, self.GPIO.LOW)
         if update:
             self.update_pwm()
         
     def disable_pwm(self, ):
         """Disable power to the servos."""
-        GPIO.output(LaserCamBox.OE_PIN, GPIO.HIGH)
+        self.GPIO.output(LaserCamBox.OE_PIN, self.GPIO.HIGH)
         
     def get_pwm_state(self, ):
         """Return 0 if servos are enabled or 1 if disabled."""
-        return GPIO.input(LaserCamBox.OE_PIN)
+        return self.GPIO.input(LaserCamBox.OE_PIN)
     
     def is_pwm_enabled(self, ):
         """Return True if servos are enabled, otherwise False."""
-        state = GPIO.input(LaserCamBox.OE_PIN)
+        state = self.GPIO.input(LaserCamBox.OE_PIN)
         if state == 0:
             return True
         elif state == 1:
@@ -124,32 +207,28 @@ class LaserCamBox():
             return None
      
     def camera_up(self, step=None):
-        """Move the camera up the specified number of steps."""
+        """Move the camera up the specified number of degrees."""
         if step == None:
             step = self.camera_step
-        self.camera_y -= step
-        self.update_pwm()
+        self.camera_move_angle((0, -step))
         
     def camera_down(self, step=None):
-        """Move the camera down the specified number of steps."""
+        """Move the camera down the specified number of degrees."""
         if step == None:
             step = self.camera_step
-        self.camera_y += step
-        self.update_pwm()
+        self.camera_move_angle((0, step))
         
     def camera_left(self, step=None):
-        """Move the camera left the specified number of steps."""
+        """Move the camera left the specified number of degrees."""
         if step == None:
             step = self.camera_step
-        self.camera_x -= step
-        self.update_pwm()
+        self.camera_move_angle((-step, 0))
         
     def camera_right(self, step=None):
-        """Move the camera right the specified number of steps."""
+        """Move the camera right the specified number of degrees."""
         if step == None:
             step = self.camera_step
-        self.camera_x += step
-        self.update_pwm()
+        self.camera_move_angle((step, 0))
         
     def camera_move_relative(self, amount):
         """Move the camera the amount specified in the tuple."""
@@ -171,64 +250,86 @@ class LaserCamBox():
         self.camera_y = position[1]
         self.update_pwm()
         
-    def mjpegstream_start(self, port=8081, resize=(640,360)):
-        """Start thread to serve MJPEG stream on specified port."""
-        if not self._mjpegger == None:
-            return
-        camera = picamera.PiCamera(sensor_mode=5)
+    def _open_camera(self, ):
+        camera = self.backend.camera(sensor_mode=5)
         camera.hflip = True
         camera.vflip = True
-        kwargs = {'camera':camera, 'port':port, 'resize':resize}
-        self._mjpegger = mjpegger.MJPEGThread(kwargs=kwargs)
-        self._mjpegger.start()
-        while not self._mjpegger.streamRunning:
-            pass
-    
+        return camera
+
+    @property
+    def frames(self, ):
+        """FrameRing of the running MJPEG stream, or None."""
+        return self.cameras.frames
+
+    def camera_warm_up(self, wait=True):
+        """Open the camera ahead of time so the stream starts quickly."""
+        self.cameras.warm_up(wait)
+
+    def mjpegstream_start(self, resize=(640,360), on_frame=None, quality=None,
+                          tiers=()):
+        """Start capturing MJPEG frames into self.frames. The optional
+        on_frame callback is called from the capture thread per frame.
+        Lower quality tiers, as (resize, quality), can be subscribed to
+        through self.cameras."""
+        self.cameras.resize = resize
+        self.cameras.quality = quality
+        self.cameras.tiers = list(tiers)
+        self.cameras.start(on_frame)
+
     def mjpegstream_stop(self, ):
-        """Stop the MJPEG stream, if running."""
-        if not self._mjpegger == None:
-            if self._mjpegger.is_alive():
-                self._mjpegger.stop()
-            self._mjpegger = None
-                
+        """Stop the MJPEG stream, if running. The camera is kept in
+        standby for a while in case the stream is restarted."""
+        self.cameras.stop()
+
     def mjpgstream_is_alive(self, ):
         """Return True if stream is running, False otherwise."""
-        if self._mjpegger == None:
-            return False
-        else:
-            return self._mjpegger.is_alive()
-        
+        return self.cameras.is_streaming()
+
     def camera_get_position(self, ):
         """Return the current camera position."""
         return (self.camera_x, self.camera_y)
+
+    def camera_move_angle(self, amount):
+        """Move the camera by the (x, y) amount in degrees."""
+        self.camera_x, self.camera_y = self.calibration.move(servocal.CAMERA,
+                                        (self.camera_x, self.camera_y), amount)
+        self.update_pwm()
+
+    def camera_set_angle(self, angles):
+        """Move the camera to the absolute (x, y) angles in degrees."""
+        if not isinstance(angles, tuple):
+            return
+        if not len(angles) == 2:
+            return
+        self.camera_set_position(self.calibration.to_pwm(servocal.CAMERA, angles))
+
+    def camera_get_angle(self, ):
+        """Return the current camera angles in degrees."""
+        return self.calibration.to_angles(servocal.CAMERA, (self.camera_x, self.camera_y))
         
     def laser_up(self, step=None):
-        """Move the laser up the specified number of steps."""
+        """Move the laser up the specified number of degrees."""
         if step == None:
             step = self.laser_step
-        self.laser_y += step
-        self.update_pwm()
+        self.laser_move_angle((0, step))
         
     def laser_down(self, step=None):
-        """Move the laser down the specified number of steps."""
+        """Move the laser down the specified number of degrees."""
         if step == None:
             step = self.laser_step
-        self.laser_y -= step
-        self.update_pwm()
+        self.laser_move_angle((0, -step))
         
     def laser_left(self, step=None):
-        """Move the laser left the specified number of steps."""
+        """Move the laser left the specified number of degrees."""
         if step == None:
             step = self.laser_step
-        self.laser_x -= step
-        self.update_pwm()
+        self.laser_move_angle((-step, 0))
         
     def laser_right(self, step=None):
-        """Move the laser right the specified number of steps."""
+        """Move the laser right the specified number of degrees."""
         if step == None:
             step = self.laser_step
-        self.laser_x += step
-        self.update_pwm()
+        self.laser_move_angle((step, 0))
 
     def laser_home(self, ):
         """Move the laser to the home positon."""
@@ -247,66 +348,95 @@ class LaserCamBox():
     def laser_get_position(self, ):
         """Return the current laser position."""
         return (self.laser_x, self.laser_y)
+
+    def laser_move_angle(self, amount):
+        """Move the laser by the (x, y) amount in degrees."""
+        self.laser_x, self.laser_y = self.calibration.move(servocal.LASER,
+                                        (self.laser_x, self.laser_y), amount)
+        self.update_pwm()
+
+    def laser_set_angle(self, angles):
+        """Move the laser to the absolute (x, y) angles in degrees."""
+        if not isinstance(angles, tuple):
+            return
+        if not len(angles) == 2:
+            return
+        self.laser_set_position(self.calibration.to_pwm(servocal.LASER, angles))
+
+    def laser_get_angle(self, ):
+        """Return the current laser angles in degrees."""
+        return self.calibration.to_angles(servocal.LASER, (self.laser_x, self.laser_y))
         
     def laser_on(self, ):
         """Turn the laser on."""
-        GPIO.output(LaserCamBox.LASER_PIN, GPIO.HIGH)
+        self.GPIO.output(LaserCamBox.LASER_PIN, self.GPIO.HIGH)
         
     def laser_off(self, ):
         """Turn the laser off."""
-        GPIO.output(LaserCamBox.LASER_PIN, GPIO.LOW)
+        self.GPIO.output(LaserCamBox.LASER_PIN, self.GPIO.LOW)
         
     def get_laser_state(self, ):
         """Return current laser state."""
-        return GPIO.input(LaserCamBox.LASER_PIN)
+        return self.GPIO.input(LaserCamBox.LASER_PIN)
     
     def camera_led_on(self, ):
         """Turn camera LED on."""
-        GPIO.output(LaserCamBox.CAM_LED_PIN, GPIO.HIGH)
+        self.GPIO.output(LaserCamBox.CAM_LED_PIN, self.GPIO.HIGH)
         
     def camera_led_off(self, ):
         """Turn camera LED off."""
-        GPIO.output(LaserCamBox.CAM_LED_PIN, GPIO.LOW)
+        self.GPIO.output(LaserCamBox.CAM_LED_PIN, self.GPIO.LOW)
         
     def get_camera_led_state(self, ):
         """Return current LED state."""
-        return GPIO.input(LaserCamBox.CAM_LED_PIN)
+        return self.GPIO.input(LaserCamBox.CAM_LED_PIN)
     
     def status_led_on(self, led):
         """Turn on the specified front panel status LED."""
         if led == 1:
-            GPIO.output(LaserCamBox.LED1_PIN, GPIO.HIGH)
+            self.GPIO.output(LaserCamBox.LED1_PIN, self.GPIO.HIGH)
         elif led == 2:
-            GPIO.output(LaserCamBox.LED2_PIN, GPIO.HIGH)
+            self.GPIO.output(LaserCamBox.LED2_PIN, self.GPIO.HIGH)
         elif led == 3:
-            GPIO.output(LaserCamBox.LED3_PIN, GPIO.HIGH)
+            self.GPIO.output(LaserCamBox.LED3_PIN, self.GPIO.HIGH)
         else:
             pass
 
     def status_led_off(self, led):
         """Turn off the specified front panel status LED."""
         if led == 1:
-            GPIO.output(LaserCamBox.LED1_PIN, GPIO.LOW)
+            self.GPIO.output(LaserCamBox.LED1_PIN, self.GPIO.LOW)
         elif led == 2:
-            GPIO.output(LaserCamBox.LED2_PIN, GPIO.LOW)
+            self.GPIO.output(LaserCamBox.LED2_PIN, self.GPIO.LOW)
         elif led == 3:
-            GPIO.output(LaserCamBox.LED3_PIN, GPIO.LOW)
+            self.GPIO.output(LaserCamBox.LED3_PIN, self.GPIO.LOW)
         else:
             pass
 
+    def get_status_led_state(self, led):
+        """Return current state of the specified front panel status LED."""
+        pin = {1: LaserCamBox.LED1_PIN,
+               2: LaserCamBox.LED2_PIN,
+               3: LaserCamBox.LED3_PIN}.get(led)
+        if pin == None:
+            return None
+        return self.GPIO.input(pin)
+
     def status_led_all_off(self, ):
         """Turn off all of the front panel status LEDs."""
-        self.statusLEDOff(1)
-        self.statusLEDOff(2)
-        self.statusLEDOff(3)
+        self.status_led_off(1)
+        self.status_led_off(2)
+        self.status_led_off(3)
         
     def enable_audio(self, ):
         """Enable the audio amplifier."""
-        GPIO.output(LaserCamBox.AMP_PIN, GPIO.HIGH)
+        self._init_audio()
+        self.GPIO.output(LaserCamBox.AMP_PIN, self.GPIO.HIGH)
         
     def disable_audio(self, ):
         """Disable the audio amplifier."""
-        GPIO.output(LaserCamBox.AMP_PIN, GPIO.LOW)
+        self._init_audio()
+        self.GPIO.output(LaserCamBox.AMP_PIN, self.GPIO.LOW)
         
     def speak(self, msg="hello world"):
         """Output the supplied message on the speaker."""
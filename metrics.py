@@ -0,0 +1,216 @@
+#===========================================================================
+# metrics.py
+#
+# Lightweight counters, gauges and histograms, rendered in the Prometheus
+# text exposition format. Metrics are created once at module level where
+# they are used and updated from any thread. An update is a dict lookup
+# and an add under a lock, cheap enough for the servo and frame paths.
+#
+# Also holds a profiler for the thread that switches it on, meant to be
+# toggled on the server's IOLoop while it is running.
+#
+# 2026-10-18
+#===========================================================================
+import bisect
+import threading
+import cProfile
+import pstats
+import StringIO
+
+import clock
+
+# seconds, from a fast servo update to a slow speech queue
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Registry():
+    """Set of metrics rendered together."""
+
+    def __init__(self, ):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self, ):
+        """Return all metrics in Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.TYPE))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+# the default registry, everything created here ends up in it
+REGISTRY = Registry()
+
+def render():
+    """Return the default registry in Prometheus text format."""
+    return REGISTRY.render()
+
+def now():
+    """Clock to time things with."""
+    return clock.monotonic()
+
+def _labels(names, values, extra=None):
+    pairs = zip(names, values)
+    if not extra == None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(['{}="{}"'.format(n, str(v).replace('\\', r'\\')
+                                                      .replace('"', r'\"')
+                                                      .replace('\n', r'\n'))
+                           for n, v in pairs]) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric():
+    TYPE = 'untyped'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        if not registry == None:
+            registry.register(self)
+
+    def remove(self, labels=()):
+        """Forget the series for labels, e.g. when a client goes away."""
+        with self._lock:
+            self._values.pop(tuple(labels), None)
+
+    def _items(self, ):
+        with self._lock:
+            return sorted(self._values.items())
+
+class Counter(_Metric):
+    """Value that only goes up."""
+    TYPE = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        labels = tuple(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(tuple(labels), 0)
+
+    def samples(self, ):
+        return ["{}{} {}".format(self.name, _labels(self.label_names, key), _number(value))
+                for key, value in self._items()]
+
+class Gauge(_Metric):
+    """Value that goes up and down. With func, it is read by calling
+    func() when rendered, which returns a number or a dict of label
+    values tuple : number."""
+    TYPE = 'gauge'
+
+    def __init__(self, name, help, labels=(), func=None, registry=REGISTRY):
+        _Metric.__init__(self, name, help, labels, registry)
+        self.func = func
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[tuple(labels)] = value
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(tuple(labels), 0)
+
+    def _items(self, ):
+        if self.func == None:
+            return _Metric._items(self)
+        value = self.func()
+        if isinstance(value, dict):
+            return sorted(value.items())
+        return [((), value)]
+
+    def samples(self, ):
+        return ["{}{} {}".format(self.name, _labels(self.label_names, key), _number(value))
+                for key, value in self._items()]
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS, registry=REGISTRY):
+        _Metric.__init__(self, name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        labels = tuple(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry == None:
+                # per bucket counts, sum
+                entry = self._values[labels] = [[0] * (len(self.buckets)+1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def count(self, labels=()):
+        with self._lock:
+            entry = self._values.get(tuple(labels))
+            return 0 if entry == None else sum(entry[0])
+
+    def samples(self, ):
+        lines = []
+        for key, (counts, total) in self._items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                lines.append("{}_bucket{} {}".format(self.name,
+                    _labels(self.label_names, key, ('le', _number(bound))), cumulative))
+            labels = _labels(self.label_names, key)
+            lines.append("{}_sum{} {}".format(self.name, labels, _number(total)))
+            lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+        return lines
+
+class Profiler():
+    """cProfile for the thread that calls enable(). Statistics build up
+    until reset()."""
+
+    def __init__(self, ):
+        self.enabled = False
+        self._profile = cProfile.Profile()
+
+    def enable(self, ):
+        if not self.enabled:
+            self._profile.enable()
+            self.enabled = True
+
+    def disable(self, ):
+        if self.enabled:
+            self._profile.disable()
+            self.enabled = False
+
+    def reset(self, ):
+        enabled = self.enabled
+        self.disable()
+        self._profile = cProfile.Profile()
+        if enabled:
+            self.enable()
+
+    def report(self, sort='cumulative', limit=40):
+        """Return the top entries as text."""
+        out = StringIO.StringIO()
+        enabled = self.enabled
+        self.disable()
+        try:
+            pstats.Stats(self._profile, stream=out).sort_stats(sort).print_stats(limit)
+        except TypeError:
+            out.write("no profile data\n")     # nothing recorded yet
+        if enabled:
+            self.enable()
+        return out.getvalue()
@@ -3,76 +3,506 @@
 #
 # Runs a MJPG stream on provided port.
 #
+# A single capture loop writes frames into a ring of reusable buffers
+# and any number of clients are served from it, each at its own pace.
+#
+# Frames come from the GPU's MJPEG video encoder, recording continuously
+# into a JPEGSplitter that cuts the byte stream into frames at the JPEG
+# start and end markers. This avoids setting up a still capture per
+# frame like capture_continuous does.
+#
+# Split a recorded MJPEG byte stream to check the splitter:
+#   $ python mjpegger.py recording.mjpeg
+#
 # 2016-07-25
 # Carter Nelson
 #===========================================================================
 import threading
 import SimpleHTTPServer
 import SocketServer
+import socket
 import io
+import time
+import fcntl
+import termios
+import struct
+
+import metrics
+
+BOUNDARY = "--picameramjpg"
+PART_HEADER = BOUNDARY + "\r\nContent-type: image/jpeg\r\nContent-length: %d\r\n\r\n"
+HEADER_ROOM = 128               # bytes reserved in front of each frame
+FRAME_SIZE = 256*1024           # initial frame buffer size in bytes
+RING_SLOTS = 4                  # number of frame buffers in the ring
+SOI = '\xff\xd8'                # JPEG start of image marker
+EOI = '\xff\xd9'                # JPEG end of image marker
+
+FRAMES_CAPTURED = metrics.Counter('mjpeg_frames_captured_total',
+                                  'Frames from the camera', ('port',))
+FRAMES_DROPPED = metrics.Counter('mjpeg_frames_dropped_total',
+                                 'Frames dropped with every ring buffer in use', ('port',))
+
+class FrameBuffer():
+    """Reusable frame buffer, written to like a stream by the camera.
+
+    Space is reserved in front of the JPEG data so the multipart header
+    can be placed directly before it and the whole part sent in one go."""
+
+    def __init__(self, size=FRAME_SIZE):
+        self.data = bytearray(HEADER_ROOM + size)
+        self.view = memoryview(self.data)
+        self.length = 0
+        self.start = HEADER_ROOM
+        self.count = 0
+        self.refs = 0
+
+    def write(self, b):
+        n = len(b)
+        end = HEADER_ROOM + self.length + n
+        if end > len(self.data):
+            # readers may still hold views on the old array, so copy
+            # instead of resizing in place
+            data = bytearray(2*end)
+            data[:len(self.data)] = self.data
+            self.data = data
+            self.view = memoryview(self.data)
+        self.view[end-n:end] = b
+        self.length += n
+        return n
+
+    def flush(self, ):
+        pass
+
+    def reset(self, ):
+        self.length = 0
+        self.start = HEADER_ROOM
+
+    def set_header(self, header):
+        """Place header bytes directly in front of the frame."""
+        self.start = HEADER_ROOM - len(header)
+        self.view[self.start:HEADER_ROOM] = header
+
+    def frame(self, ):
+        """Return a memoryview of the JPEG data."""
+        return self.view[HEADER_ROOM:HEADER_ROOM+self.length]
+
+    def part(self, ):
+        """Return a memoryview of the header plus JPEG data."""
+        return self.view[self.start:HEADER_ROOM+self.length]
+
+class FrameRing():
+    """Ring of preallocated frame buffers shared between one producer and
+    many readers. The producer writes to it like a stream and calls
+    commit() at the end of each frame. Readers acquire() the latest frame
+    and must release() it when done. Buffers held by a reader are never
+    written to. If every buffer is busy the frame is dropped."""
+
+    def __init__(self, slots=RING_SLOTS, size=FRAME_SIZE):
+        self._cond = threading.Condition()
+        self.buffers = [FrameBuffer(size) for i in xrange(slots)]
+        self._spare = FrameBuffer(size)
+        self.latest = None
+        self.frame_count = 0
+        self.dropped = 0
+        self.running = True
+        self._writing = self._next_free()
+
+    def _next_free(self, ):
+        for buf in self.buffers:
+            if buf.refs == 0 and not buf is self.latest:
+                return buf
+        return self._spare
+
+    def write(self, b):
+        return self._writing.write(b)
+
+    def flush(self, ):
+        pass
+
+    def commit(self, ):
+        """Publish the frame just written and wake up all waiting readers."""
+        buf = self._writing
+        with self._cond:
+            if buf is self._spare:
+                self.dropped += 1
+            else:
+                buf.set_header(PART_HEADER % buf.length)
+                self.frame_count += 1
+                buf.count = self.frame_count
+                self.latest = buf
+                self._cond.notify_all()
+            self._writing = self._next_free()
+        self._writing.reset()
+
+    def acquire(self, last_count, timeout=1.0):
+        """Wait for a frame newer than last_count and hold it. A timeout
+        of 0 does not wait. Returns the FrameBuffer or None if timed out
+        or closed."""
+        with self._cond:
+            if self.running and self.frame_count == last_count and timeout:
+                self._cond.wait(timeout)
+            if not self.running or self.frame_count == last_count:
+                return None
+            self.latest.refs += 1
+            return self.latest
+
+    def release(self, buf):
+        """Hand a buffer from acquire() back to the ring."""
+        with self._cond:
+            buf.refs -= 1
+
+    def close(self, ):
+        """Release all readers."""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+
+class JPEGSplitter():
+    """File-like output for an MJPEG recording. Writes arrive in chunks
+    of any size, each frame found from SOI to the next EOI is written to
+    the output, which is committed and on_frame called. Bytes outside
+    frames are skipped. Markers may be split across writes. Encoder
+    frames carry no embedded thumbnail, so the first EOI ends a frame."""
+
+    def __init__(self, output, on_frame=None):
+        self.output = output
+        self.on_frame = on_frame
+        self.frames = 0
+        self.skipped = 0            # bytes outside any frame
+        self._in_frame = False
+        self._held = ''             # trailing 0xff, maybe half a marker
+
+    def write(self, b):
+        n = len(b)
+        data = self._held + b if self._held else b
+        end = len(data)
+        self._held = ''
+        if data[end-1:] == '\xff':
+            self._held = '\xff'
+            end -= 1
+        view = memoryview(data)
+        pos = 0
+        while pos < end:
+            start = pos
+            if not self._in_frame:
+                start = data.find(SOI, pos, end)
+                if start < 0:
+                    self.skipped += end - pos
+                    break
+                self.skipped += start - pos
+                self._in_frame = True
+            stop = data.find(EOI, start, end)
+            if stop < 0:
+                # frame carries on in the next write
+                self.output.write(view[start:end])
+                break
+            pos = stop + 2
+            self._in_frame = False
+            self.output.write(view[start:pos])
+            self.output.commit()
+            self.frames += 1
+            if not self.on_frame == None:
+                self.on_frame()
+        return n
+
+    def flush(self, ):
+        pass
+
+class CaptureThread(threading.Thread):
+    """Thread running one camera capture loop. Calls on_frame, if
+    provided, from this thread after each frame is committed. Several
+    can run at once on different video splitter ports. The output is
+    usually a FrameRing, anything with write() and commit() will do.
+    The mjpeg format records through a JPEGSplitter, any other is
+    captured a frame at a time."""
+
+    def __init__(self, camera, resize, ring, on_frame=None, quality=None,
+                 splitter_port=0, format='mjpeg'):
+        threading.Thread.__init__(self, name="CaptureThread")
+        self.daemon = True
+        self.camera = camera
+        self.resize = resize
+        self.ring = ring
+        self.on_frame = on_frame
+        self.quality = quality
+        self.splitter_port = splitter_port
+        self.format = format
+        self.keepRunning = True
+        self._dropped = 0
+
+    def run(self, ):
+        options = {}
+        if not self.quality == None:
+            options['quality'] = self.quality
+        if self.format == 'mjpeg':
+            self._record(options)
+            return
+        for frame in self.camera.capture_continuous(self.ring, self.format,
+                                                    use_video_port = True,
+                                                    resize = self.resize,
+                                                    splitter_port = self.splitter_port,
+                                                    **options):
+            if not self.keepRunning:
+                break
+            self.ring.commit()
+            self._committed()
+
+    def _record(self, options):
+        # bitrate 0 leaves the frame size to the quality setting
+        self.camera.start_recording(JPEGSplitter(self.ring, self._committed), 'mjpeg',
+                                    resize = self.resize,
+                                    splitter_port = self.splitter_port,
+                                    bitrate = 0,
+                                    **options)
+        try:
+            while self.keepRunning:
+                self.camera.wait_recording(0.1, splitter_port=self.splitter_port)
+        finally:
+            self.camera.stop_recording(splitter_port=self.splitter_port)
+
+    def _committed(self, ):
+        FRAMES_CAPTURED.inc(labels=(self.splitter_port,))
+        dropped = self.ring.dropped
+        if dropped > self._dropped:
+            FRAMES_DROPPED.inc(dropped - self._dropped, (self.splitter_port,))
+        self._dropped = dropped
+        if not self.on_frame == None:
+            self.on_frame()
+
+    def stop(self, ):
+        self.keepRunning = False
+
+def send_backlog(sock):
+    """Return bytes queued in the socket send buffer not yet sent to the
+    client, or 0 if the platform can't tell."""
+    try:
+        buf = fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, '\0\0\0\0')
+    except (IOError, AttributeError):
+        return 0
+    return struct.unpack('i', buf)[0]
+
+class StreamPacer():
+    """Per-client congestion control for a stream with several quality
+    tiers, tier 0 being the best. Call sent() after each frame with the
+    time it took to go out, its size and the socket send backlog left
+    from earlier frames when it was written, then sleep for delay()
+    before the next one.
 
-keepStreaming = False
-camera = None
-resize = (640,360)
+    When sends take longer than a frame interval, or more than half a
+    frame is still queued for the client a frame later, it is moved to
+    a lower tier, and at
+    the lowest tier its frame rate is cut. After up_after fast sends in
+    a row it steps back the other way."""
+
+    def __init__(self, tiers=1, max_fps=30, min_fps=2, up_after=30):
+        self.tiers = tiers
+        self.min_interval = 1.0 / max_fps
+        self.max_interval = 1.0 / min_fps
+        self.up_after = up_after
+        self.tier = 0
+        self.interval = self.min_interval
+        self.send_time = 0.0            # smoothed seconds per frame
+        self._fast = 0
+        self._last_send = 0.0
+
+    def sent(self, seconds, size=0, backlog=0):
+        """Record that a frame of size bytes took seconds to send, with
+        backlog bytes of earlier frames still queued ahead of it."""
+        self._last_send = seconds
+        self.send_time = 0.7*self.send_time + 0.3*seconds
+        if self.send_time > self.interval or backlog > size/2:
+            self._fast = 0
+            self._step_down()
+        elif self.send_time < 0.5*self.interval and backlog == 0:
+            self._fast += 1
+            if self._fast >= self.up_after:
+                self._fast = 0
+                self._step_up()
+        else:
+            self._fast = 0
+
+    def delay(self, ):
+        """Seconds to wait before taking the next frame."""
+        return max(0.0, self.interval - self._last_send)
+
+    def _step_down(self, ):
+        if self.tier < self.tiers - 1:
+            self.tier += 1
+        else:
+            self.interval = min(self.max_interval, self.interval*1.5)
+        self.send_time = 0.0
+
+    def _step_up(self, ):
+        if self.interval > self.min_interval:
+            self.interval = max(self.min_interval, self.interval/1.5)
+        elif self.tier > 0:
+            self.tier -= 1
+
+class MJPEGServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """TCPServer with one thread per client."""
+    daemon_threads = True
+    allow_reuse_address = True
 
 class MJPEGThread(threading.Thread):
     """Thread to server MJPEG stream."""
-    
+
     def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
         threading.Thread.__init__(self, group=group, target=target, name=name)
-        
-        global camera, resize
-        camera = kwargs['camera']
-        resize = kwargs['resize']
+
+        self.camera = kwargs['camera']
+        self.resize = kwargs['resize']
         self.port = kwargs['port']
-        self.keepRunnning = False
+        self.keepRunning = False
         self.streamRunning = False
         self.server = None
-    
+        self.ring = FrameRing()
+        self.capture = None
+
     def run(self, ):
         print "MJPEGThread starting"
-        self.server = SocketServer.TCPServer(("",self.port), MJPEGStreamHandler,
+        self.server = MJPEGServer(("",self.port), MJPEGStreamHandler,
             bind_and_activate=False)
-        self.server.allow_reuse_address = True
         self.server.timeout = 0.1
+        self.server.ring = self.ring
         self.server.server_bind()
         self.server.server_activate()
+        self.capture = CaptureThread(self.camera, self.resize, self.ring)
+        self.capture.start()
         self.keepRunning = True
-        self.streamRunning = True        
-        while self.keepRunning:   
+        self.streamRunning = True
+        while self.keepRunning:
             self.server.handle_request()
         self.streamRunning = False
-        camera.close()
+        self.ring.close()
+        self.capture.stop()
+        self.capture.join()
+        self.camera.close()
         self.server.server_close()
         print "MJPEGThread done"
-            
+
     def stop(self, ):
-        global keepStreaming
-        keepStreaming = False
         self.keepRunning = False
-        
+
 class MJPEGStreamHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
     """Handler for MJPEG stream."""
-    
+
     def do_GET(self, ):
         print "MJPEGStreamHandler GET"
-        global keepStreaming
-        keepStreaming = True
-        
-        stream = io.BytesIO()
-        
+        ring = self.server.ring
+
         self.send_response(200)
-        self.send_header('Content-type','multipart/x-mixed-replace; boundary=--picameramjpg')
+        self.send_header('Content-type','multipart/x-mixed-replace; boundary='+BOUNDARY)
         self.end_headers()
-        for frame in camera.capture_continuous(stream, 'jpeg',
-                                                    use_video_port = True,
-                                                    resize = resize):
-            if not keepStreaming:
+        last_count = 0
+        while ring.running:
+            buf = ring.acquire(last_count)
+            if buf == None:
+                continue
+            try:
+                last_count = buf.count
+                self.connection.sendall(buf.part())
+            except socket.error:
                 break
-            self.wfile.write("--picameramjpg")
-            self.send_header('Content-type','image/jpeg')
-            self.send_header('Content-length',len(stream.getvalue()))
-            self.end_headers()
-            self.wfile.write(stream.getvalue())
+            finally:
+                ring.release(buf)
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        # split a recorded MJPEG stream, fed in odd sized chunks
+        class Sizes():
+            def __init__(self, ):
+                self.sizes = []
+                self.length = 0
+            def write(self, b):
+                self.length += len(b)
+            def commit(self, ):
+                self.sizes.append(self.length)
+                self.length = 0
+        sizes = Sizes()
+        splitter = JPEGSplitter(sizes)
+        with open(sys.argv[1], 'rb') as f:
+            while True:
+                chunk = f.read(4093)
+                if not chunk:
+                    break
+                splitter.write(chunk)
+        print "{} frames, {} to {} bytes, {} bytes outside frames".format(
+            splitter.frames, min(sizes.sizes or [0]), max(sizes.sizes or [0]), splitter.skipped)
+        sys.exit(0)
+
+    # Micro-benchmark of the per-frame path with a synthetic frame source:
+    # the old BytesIO/getvalue() loop against the frame ring, both sending
+    # over a local socket that is drained by another thread. Then the cost
+    # of splitting a recorded stream into frames.
+    FRAMES = 2000
+    CHUNK = 65536
+    SIZES = (50*1024, 200*1024)     # about 640x360 and 1280x720 JPEGs
+
+    def synthetic_frames(output):
+        # camera writes each frame in several chunks, like the MMAL callback
+        for i in xrange(FRAMES):
+            for chunk in CHUNKS:
+                output.write(chunk)
+            yield output
+
+    def drain(sock):
+        while sock.recv(1<<16):
+            pass
+
+    def run(name, loop):
+        tx, rx = socket.socketpair()
+        reader = threading.Thread(target=drain, args=(rx,))
+        reader.start()
+        start = time.time()
+        loop(tx)
+        elapsed = time.time() - start
+        tx.close()
+        reader.join()
+        rx.close()
+        print "  {:10s}: {:7.1f} fps  {:6.1f} us/frame".format(
+            name, FRAMES/elapsed, 1e6*elapsed/FRAMES)
+
+    def bytesio_loop(sock):
+        wfile = sock.makefile('wb', 0)
+        stream = io.BytesIO()
+        for frame in synthetic_frames(stream):
+            wfile.write(BOUNDARY)
+            wfile.write('Content-type: image/jpeg\r\n')
+            wfile.write('Content-length: %d\r\n' % len(stream.getvalue()))
+            wfile.write('\r\n')
+            wfile.write(stream.getvalue())
             stream.seek(0)
-            stream.truncate() 
\ No newline at end of file
+            stream.truncate()
+
+    def ring_loop(sock):
+        ring = FrameRing()
+        last_count = 0
+        for frame in synthetic_frames(ring):
+            ring.commit()
+            buf = ring.acquire(last_count, timeout=0)
+            last_count = buf.count
+            sock.sendall(buf.part())
+            ring.release(buf)
+
+    for size in SIZES:
+        JPEG = '\xff\xd8' + 'x' * size + '\xff\xd9'
+        CHUNKS = [JPEG[i:i+CHUNK] for i in xrange(0, len(JPEG), CHUNK)]
+        print "{} frames of {} bytes".format(FRAMES, len(JPEG))
+        run("BytesIO", bytesio_loop)
+        run("FrameRing", ring_loop)
+        # encoder writes don't line up with frames
+        stream = JPEG * 8
+        chunks = [stream[i:i+CHUNK-7] for i in xrange(0, len(stream), CHUNK-7)]
+        ring = FrameRing()
+        splitter = JPEGSplitter(ring)
+        start = time.time()
+        for i in xrange(FRAMES // 8):
+            for chunk in chunks:
+                splitter.write(chunk)
+        elapsed = time.time() - start
+        print "  {:10s}: {:7.1f} fps  {:6.1f} us/frame  ({} frames)".format(
+            "splitter", splitter.frames/elapsed, 1e6*elapsed/splitter.frames, splitter.frames)
@@ -0,0 +1,282 @@
+#===========================================================================
+# patterns.py
+#
+# Server side laser patterns. A pattern is a path of laser servo offsets
+# stored as a compact int16 array, one point per servo update. A player
+# thread walks it on a monotonic deadline schedule, one point per servo
+# frame, and hands each point to the hardware actor. Nothing goes over
+# the network per point.
+#
+# Patterns are played around wherever the laser is when play starts.
+# Missed deadlines are skipped rather than caught up, so the pattern
+# keeps its timing, and counted.
+#
+# 2026-10-18
+#===========================================================================
+import array
+import math
+import random
+import time
+import threading
+import logging
+
+import clock
+import metrics
+
+UPDATE_RATE     = 50        # points per second, one per servo frame
+
+log = logging.getLogger(__name__)
+
+MISSED = metrics.Counter('pattern_deadlines_missed_total',
+                         'Pattern updates that ran more than half a period late')
+LATENESS_SECONDS = metrics.Histogram('pattern_lateness_seconds',
+                                     'How late each pattern update ran')
+
+class Pattern():
+    """Path of (x, y) servo offsets, one per update at rate per second."""
+
+    def __init__(self, name, points=(), rate=UPDATE_RATE):
+        self.name = name
+        self.rate = rate
+        self.data = array.array('h')
+        for x, y in points:
+            self.append(x, y)
+
+    def append(self, x, y):
+        self.data.append(int(round(x)))
+        self.data.append(int(round(y)))
+
+    def __len__(self, ):
+        return len(self.data) // 2
+
+    def duration(self, ):
+        return float(len(self)) / self.rate
+
+    def point(self, phase):
+        """Return the offset at fractional index phase, interpolated
+        between neighbouring points and wrapping at the end."""
+        n = len(self)
+        i = int(phase)
+        f = phase - i
+        i %= n
+        j = (i + 1) % n
+        d = self.data
+        return (d[2*i] + f*(d[2*j] - d[2*i]), d[2*i+1] + f*(d[2*j+1] - d[2*i+1]))
+
+#-------------------------------------------------------------------------
+# Pattern makers
+#-------------------------------------------------------------------------
+def circle(radius=60, period=2.0, rate=UPDATE_RATE):
+    """One lap of a circle every period seconds."""
+    n = int(period * rate)
+    return Pattern('circle', [(radius*math.cos(2*math.pi*i/n), radius*math.sin(2*math.pi*i/n))
+                              for i in xrange(n)], rate)
+
+def figure_eight(size=60, period=4.0, rate=UPDATE_RATE):
+    """Figure eight lying on its side, size across each loop."""
+    n = int(period * rate)
+    return Pattern('figure eight', [(size*math.sin(2*math.pi*i/n), size/2*math.sin(4*math.pi*i/n))
+                                    for i in xrange(n)], rate)
+
+def chase(radius=80, seconds=20.0, seed=None, rate=UPDATE_RATE):
+    """Random darting walk inside radius that ends where it started, so
+    it loops without a jump. Pauses now and then, like prey."""
+    rnd = random.Random(seed)
+    n = int(seconds * rate)
+    x = y = vx = vy = 0.0
+    points = []
+    for i in xrange(n):
+        if rnd.random() < 0.02:
+            vx, vy = 0.0, 0.0                   # freeze
+        elif rnd.random() < 0.05:
+            angle = rnd.uniform(0, 2*math.pi)   # dart off somewhere
+            speed = rnd.uniform(2, 8)
+            vx, vy = speed*math.cos(angle), speed*math.sin(angle)
+        x += vx
+        y += vy
+        r = math.hypot(x, y)
+        if r > radius:
+            # bounce back off the edge
+            x, y = x*radius/r, y*radius/r
+            vx, vy = -vx, -vy
+        points.append((x, y))
+    # spread the gap back to the start over the whole walk
+    ex, ey = points[-1]
+    return Pattern('chase', [(px - ex*i/n, py - ey*i/n)
+                             for i, (px, py) in enumerate(points)], rate)
+
+#-------------------------------------------------------------------------
+# Player
+#-------------------------------------------------------------------------
+class PatternPlayer(threading.Thread):
+    """Plays patterns through the hardware actor and records the laser
+    position into new ones. position is called for where the laser is."""
+
+    def __init__(self, actor, position, rate=UPDATE_RATE):
+        threading.Thread.__init__(self, name="PatternPlayer")
+        self.daemon = True
+        self.actor = actor
+        self.position = position
+        self.period = 1.0 / rate
+        self.rate = rate
+        self.speed = 1.0
+        self.loop = True
+        self.pattern = None
+        self.recording = None
+        self._recorded = None
+        self._center = None
+        self._phase = 0.0
+        self._running = True
+        self._cond = threading.Condition()
+        # counters
+        self.updates = 0
+        self.missed = 0
+
+    def play(self, pattern, speed=None, loop=None):
+        """Start pattern around the current laser position."""
+        with self._cond:
+            if not speed == None:
+                self.speed = speed
+            if not loop == None:
+                self.loop = loop
+            self.pattern = pattern
+            self._center = self.position()
+            self._phase = 0.0
+            self._cond.notify()
+
+    def stop(self, ):
+        """Stop the pattern and any recording, the laser stays where it
+        is. What was recorded is kept for stop_recording."""
+        with self._cond:
+            self.pattern = None
+            if not self.recording == None:
+                self._recorded = self.recording
+                self.recording = None
+
+    def set_speed(self, speed):
+        """Playback speed, 1.0 is as recorded."""
+        self.speed = max(0.0, speed)
+
+    def set_loop(self, loop):
+        self.loop = loop
+
+    def is_playing(self, ):
+        return not self.pattern == None
+
+    def record(self, name='recorded'):
+        """Start recording the laser position, relative to where it is now."""
+        with self._cond:
+            self.recording = Pattern(name, rate=self.rate)
+            self._recorded = None
+            self._record_from = self.position()
+            self._cond.notify()
+
+    def stop_recording(self, ):
+        """Stop recording and return the Pattern, or None if it is empty."""
+        with self._cond:
+            pattern = self.recording
+            if pattern == None:
+                pattern = self._recorded
+            self.recording = None
+            self._recorded = None
+        if pattern == None or len(pattern) == 0:
+            return None
+        return pattern
+
+    def shutdown(self, ):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def run(self, ):
+        deadline = None
+        while True:
+            with self._cond:
+                while self._running and self.pattern == None and self.recording == None:
+                    deadline = None
+                    self._cond.wait()
+                if not self._running:
+                    return
+                if deadline == None:
+                    deadline = clock.monotonic()
+            # plain sleep, Condition.wait with a timeout polls too coarsely,
+            # stop() takes effect at the next deadline
+            delay = deadline - clock.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            late = clock.monotonic() - deadline
+            LATENESS_SECONDS.observe(late)
+            ticks = 1
+            if late > self.period / 2:
+                # skip what was missed, stay on the original timeline
+                ticks += int(late / self.period + 0.5)
+                self.missed += 1
+                MISSED.inc()
+            deadline += ticks * self.period
+            self._tick(ticks)
+
+    def _tick(self, ticks):
+        # under the lock, play() and record() reset the pattern, its
+        # phase and centre together
+        with self._cond:
+            pattern = self.pattern
+            if not pattern == None:
+                dx, dy = pattern.point(self._phase)
+                self.actor.laser_set_position((int(round(self._center[0] + dx)),
+                                               int(round(self._center[1] + dy))))
+                self.updates += 1
+                self._phase += self.speed * ticks
+                if self._phase >= len(pattern):
+                    if self.loop:
+                        self._phase %= len(pattern)
+                    else:
+                        self.pattern = None
+            recording = self.recording
+            if not recording == None:
+                x, y = self.position()
+                for i in xrange(ticks):
+                    recording.append(x - self._record_from[0], y - self._record_from[1])
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # Play a circle into a stub actor for a few seconds and compare the
+    # update timing against a plain sleep(period) loop.
+    SECONDS = 3
+
+    class StubActor():
+        def __init__(self, ):
+            self.stamps = []
+        def laser_set_position(self, position):
+            self.stamps.append(clock.monotonic())
+
+    def report(label, stamps, period):
+        intervals = [b - a for a, b in zip(stamps, stamps[1:])]
+        mean = sum(intervals) / len(intervals)
+        jitter = math.sqrt(sum([(i - mean)**2 for i in intervals]) / len(intervals))
+        drift = (stamps[-1] - stamps[0]) - period * (len(stamps) - 1)
+        print "  {:10s}: {:5d} updates  {:6.2f} /s  jitter {:5.2f} ms  drift {:6.1f} ms".format(
+            label, len(stamps), (len(stamps)-1) / (stamps[-1] - stamps[0]),
+            1000*jitter, 1000*drift)
+
+    period = 1.0 / UPDATE_RATE
+    naive = StubActor()
+    end = clock.monotonic() + SECONDS
+    while clock.monotonic() < end:
+        naive.laser_set_position((0, 0))
+        sum([math.sin(i) for i in xrange(2000)])    # some work per update
+        time.sleep(period)
+
+    actor = StubActor()
+    player = PatternPlayer(actor, lambda: (320, 490))
+    player.start()
+    player.play(circle())
+    time.sleep(SECONDS)
+    player.shutdown()
+    player.join()
+
+    print "{} s at {} updates/s".format(SECONDS, UPDATE_RATE)
+    report("sleep loop", naive.stamps, period)
+    report("deadline", actor.stamps, period)
+    print "  missed deadlines: {}".format(player.missed)
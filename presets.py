@@ -0,0 +1,215 @@
+#===========================================================================
+# presets.py
+#
+# Process wide store for named camera and laser position presets.
+# Positions are servo angles in degrees, so they stay put when a servo
+# is recalibrated.
+#
+# Presets live in memory. Changes are appended to a journal file by a
+# background writer, and the journal is folded into a snapshot file once
+# it gets long. The snapshot is replaced atomically with a rename so a
+# power cut leaves either the old or the new one, never half of either.
+#
+# Snapshot format, one compact JSON object:
+#   {"version":2,"camera":{"1":[-4.2,-67.7]},"laser":{}}
+# Journal format, one JSON array per line, null position deletes:
+#   ["camera","1",[-4.2,-67.7]]
+#
+# Version 1 files held servo counts. They are converted when loaded and
+# written back as version 2.
+#
+# 2026-10-18
+#===========================================================================
+import os
+import json
+import pickle
+import threading
+import Queue
+import logging
+
+import metrics
+
+VERSION         = 2
+KINDS           = ('camera', 'laser')
+COMPACT_EVERY   = 100       # journal entries before compacting
+
+log = logging.getLogger(__name__)
+
+WRITE_SECONDS = metrics.Histogram('presets_write_seconds',
+                                  'Time to append to the journal or write a snapshot', ('op',))
+
+class PresetStore():
+    """Named camera and laser presets with write-behind persistence.
+    convert(kind, position) turns servo counts from old files into angles."""
+
+    def __init__(self, path, legacy_pkl=None, convert=None):
+        self.path = path
+        self.convert = convert
+        self._upgrading = False     # loading positions in servo counts
+        self.journal_path = path + '.journal'
+        self._lock = threading.Lock()
+        self._presets = dict([(kind, {}) for kind in KINDS])
+        self._journal_entries = 0
+        self._dirty = False         # snapshot is behind memory
+        self._load(legacy_pkl)
+        self._queue = Queue.Queue()
+        self._writer = threading.Thread(target=self._write_behind, name="PresetWriter")
+        self._writer.daemon = True
+        self._writer.start()
+
+    #-------------------------------------------------------------------
+    # public API, cheap and non-blocking
+    #-------------------------------------------------------------------
+    def get(self, kind, name):
+        """Return the (x, y) position stored as name, or None."""
+        with self._lock:
+            return self._presets[kind].get(str(name))
+
+    def set(self, kind, name, position):
+        """Store position as name."""
+        position = tuple(position)
+        with self._lock:
+            self._presets[kind][str(name)] = position
+        self._queue.put((kind, str(name), list(position)))
+
+    def delete(self, kind, name):
+        """Remove preset name."""
+        with self._lock:
+            self._presets[kind].pop(str(name), None)
+        self._queue.put((kind, str(name), None))
+
+    def names(self, kind):
+        """Return sorted list of preset names."""
+        with self._lock:
+            return sorted(self._presets[kind].keys())
+
+    def flush(self, ):
+        """Wait until all changes are on disk."""
+        self._queue.join()
+
+    def close(self, ):
+        """Write out everything and stop the writer."""
+        self._queue.put(None)
+        self._writer.join()
+
+    #-------------------------------------------------------------------
+    # loading
+    #-------------------------------------------------------------------
+    def _load(self, legacy_pkl):
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            if not data.get('version') in (1, VERSION):
+                raise ValueError("unknown preset version {}".format(data.get('version')))
+            self._upgrading = data['version'] == 1
+            for kind in KINDS:
+                for name, position in data.get(kind, {}).items():
+                    self._presets[kind][name] = self._position(kind, position)
+        elif not legacy_pkl == None and os.path.isfile(legacy_pkl):
+            self._upgrading = True
+            self._load_legacy(legacy_pkl)
+        if os.path.isfile(self.journal_path):
+            self._replay()
+        if self._upgrading:
+            # fold everything into a version 2 snapshot straight away so
+            # old and new units never meet in the journal
+            self._dirty = True
+            self._compact()
+            self._upgrading = False
+
+    def _position(self, kind, position):
+        if self._upgrading and not self.convert == None:
+            return tuple(self.convert(kind, position))
+        return tuple(position)
+
+    def _load_legacy(self, legacy_pkl):
+        # old format: [camera slots, laser slots] as five element lists
+        with open(legacy_pkl, 'rb') as f:
+            slots = pickle.load(f)
+        for kind, positions in zip(KINDS, slots):
+            for i, position in enumerate(positions):
+                if not position == None:
+                    self._presets[kind][str(i+1)] = self._position(kind, position)
+        self._dirty = True
+        log.info("presets imported from %s", legacy_pkl)
+
+    def _replay(self, ):
+        good = 0
+        with open(self.journal_path, 'r+b') as f:
+            for line in f:
+                try:
+                    kind, name, position = json.loads(line)
+                    if position == None:
+                        self._presets[kind].pop(name, None)
+                    else:
+                        self._presets[kind][name] = self._position(kind, position)
+                except (ValueError, TypeError, KeyError):
+                    # torn write at power loss, which may still parse as
+                    # the wrong thing, drop it so new entries don't get
+                    # appended to the partial line
+                    log.warning("preset journal truncated at %d", good)
+                    f.truncate(good)
+                    break
+                good += len(line)
+                self._journal_entries += 1
+                self._dirty = True
+
+    #-------------------------------------------------------------------
+    # writer thread
+    #-------------------------------------------------------------------
+    def _write_behind(self, ):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            try:
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+            records = [r for r in batch if not r == None]
+            running = len(records) == len(batch)
+            try:
+                if records:
+                    self._append(records)
+                if self._journal_entries >= COMPACT_EVERY or not running:
+                    self._compact()
+            except (IOError, OSError) as e:
+                log.error("preset write failed: %s", e)
+            for r in batch:
+                self._queue.task_done()
+
+    def _append(self, records):
+        start = metrics.now()
+        with open(self.journal_path, 'ab') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',',':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_entries += len(records)
+        self._dirty = True
+        WRITE_SECONDS.observe(metrics.now() - start, ('append',))
+
+    def _compact(self, ):
+        if not self._dirty:
+            return
+        start = metrics.now()
+        with self._lock:
+            data = {'version': VERSION}
+            for kind in KINDS:
+                data[kind] = dict([(name, list(position)) for name, position
+                                   in self._presets[kind].items()])
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(data, separators=(',',':'), sort_keys=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+        dirfd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        os.fsync(dirfd)
+        os.close(dirfd)
+        # a crash before this just replays entries the snapshot has
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_entries = 0
+        self._dirty = False
+        WRITE_SECONDS.observe(metrics.now() - start, ('compact',))
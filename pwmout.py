@@ -0,0 +1,203 @@
+#===========================================================================
+# pwmout.py
+#
+# Cached PWM output layer for the PCA9685 servo controller. Remembers the
+# last value sent to each channel and only writes channels that changed,
+# using a single auto-increment block write per update.
+#
+# Also provides a fake I2C bus that counts transactions so the savings
+# can be measured without hardware.
+#
+# 2026-10-18
+#===========================================================================
+import time
+
+# PCA9685 registers and bits
+MODE1               =   0x00
+LED0_ON_L           =   0x06
+AI                  =   0x20    # MODE1 register auto-increment bit
+REGS_PER_CHAN       =   4       # ON_L, ON_H, OFF_L, OFF_H
+MAX_BLOCK           =   32      # SMBus block write limit in bytes
+
+class PWMOutput():
+    """Write-through cache in front of a PCA9685 I2C device."""
+
+    def __init__(self, device, channels=16):
+        self._device = device
+        self._channels = channels
+        self._sent = [None] * channels      # last (on, off) written to chip
+        self._pending = [None] * channels   # requested (on, off)
+        self.writes = 0                     # block writes issued
+        self.skipped = 0                    # channel updates skipped
+        self.enable_auto_increment()
+
+    def enable_auto_increment(self, ):
+        """Set the auto-increment bit so block writes span registers."""
+        mode1 = self._device.readU8(MODE1)
+        if not mode1 & AI:
+            self._device.write8(MODE1, mode1 | AI)
+
+    def set_pwm(self, channel, on, off):
+        """Queue a new value for channel. Sent on next flush()."""
+        self._pending[channel] = (on, off)
+
+    def invalidate(self, channel=None):
+        """Forget what was sent so the next flush() rewrites it."""
+        if channel == None:
+            self._sent = [None] * self._channels
+        else:
+            self._sent[channel] = None
+
+    def dirty_channels(self, ):
+        """Return list of channels whose pending value differs from chip."""
+        dirty = []
+        for chan in xrange(self._channels):
+            value = self._pending[chan]
+            if value == None:
+                continue
+            if value == self._sent[chan]:
+                continue
+            dirty.append(chan)
+        return dirty
+
+    def flush(self, ):
+        """Send all changed channels. Returns number of block writes."""
+        dirty = self.dirty_channels()
+        self.skipped += len([c for c in xrange(self._channels)
+                             if self._pending[c] != None and not c in dirty])
+        if not dirty:
+            return 0
+        # Clean channels between dirty ones are re-sent from the cache so a
+        # contiguous span goes out as one transaction.
+        writes = 0
+        first = dirty[0]
+        while first <= dirty[-1]:
+            last = first
+            while (last+1 <= dirty[-1] and
+                   self._pending[last+1] != None and
+                   (last+2-first)*REGS_PER_CHAN <= MAX_BLOCK):
+                last += 1
+            while not last in dirty:
+                last -= 1
+            data = []
+            for chan in xrange(first, last+1):
+                on, off = self._pending[chan]
+                data.extend([on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+                self._sent[chan] = (on, off)
+            self._device.writeList(LED0_ON_L + REGS_PER_CHAN*first, data)
+            writes += 1
+            first = last + 1
+            while first <= dirty[-1] and not first in dirty:
+                first += 1
+        self.writes += writes
+        return writes
+
+#-------------------------------------------------------------------------
+# Fake I2C bus
+#-------------------------------------------------------------------------
+class FakeI2CDevice():
+    """Register level stand in for an Adafruit_GPIO I2C device."""
+
+    def __init__(self, address, bus_time=0.0):
+        self.address = address
+        self.bus_time = bus_time            # seconds per byte on the wire
+        self.registers = bytearray(256)
+        self.transactions = 0
+        self.bytes_written = 0
+        self.last_transfer = None           # time the last transfer finished
+
+    def _transfer(self, nbytes):
+        self.transactions += 1
+        self.bytes_written += nbytes
+        if self.bus_time:
+            time.sleep(self.bus_time * (nbytes + 2)) # + address and register
+        self.last_transfer = time.time()
+
+    def writeRaw8(self, value):
+        self._transfer(1)
+
+    def write8(self, register, value):
+        self._transfer(2)
+        self.registers[register] = value & 0xFF
+
+    def writeList(self, register, data):
+        self._transfer(1 + len(data))
+        if self.registers[MODE1] & AI:
+            for offset, value in enumerate(data):
+                self.registers[(register+offset) & 0xFF] = value & 0xFF
+        else:
+            for value in data:
+                self.registers[register] = value & 0xFF
+
+    def readU8(self, register):
+        self._transfer(1)
+        return self.registers[register]
+
+    def readList(self, register, length):
+        self._transfer(1)
+        return bytearray(self.registers[register:register+length])
+
+    def get_pwm(self, channel):
+        """Return (on, off) currently held in the channel registers."""
+        reg = LED0_ON_L + REGS_PER_CHAN*channel
+        r = self.registers
+        return (r[reg] | r[reg+1] << 8, r[reg+2] | r[reg+3] << 8)
+
+class FakeI2C():
+    """Stands in for the Adafruit_GPIO.I2C module, pass as i2c= to PCA9685."""
+
+    def __init__(self, bus_time=0.0):
+        self.bus_time = bus_time
+        self.devices = {}
+
+    def get_i2c_device(self, address, **kwargs):
+        if not address in self.devices:
+            self.devices[address] = FakeI2CDevice(address, self.bus_time)
+        return self.devices[address]
+
+    def transactions(self, ):
+        """Total transactions across all devices on the bus."""
+        return sum([d.transactions for d in self.devices.values()])
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # Compare per-channel set_pwm against the cached block writer for a
+    # run of single axis jogs, like holding down a direction button.
+    JOGS = 1000
+    CHANNELS = (2, 3, 0, 1)
+
+    bus = FakeI2C()
+    dev = bus.get_i2c_device(0x40)
+    values = {2:320, 3:490, 0:290, 1:100}
+    start = time.time()
+    for i in xrange(JOGS):
+        values[3] += 1 if i % 2 else -1
+        for chan in CHANNELS:
+            on, off = 0, values[chan]
+            reg = LED0_ON_L + REGS_PER_CHAN*chan
+            dev.write8(reg, on & 0xFF)
+            dev.write8(reg+1, on >> 8)
+            dev.write8(reg+2, off & 0xFF)
+            dev.write8(reg+3, off >> 8)
+    naive_time = time.time() - start
+    naive = dev.transactions
+
+    bus = FakeI2C()
+    out = PWMOutput(bus.get_i2c_device(0x40))
+    setup = bus.transactions()
+    values = {2:320, 3:490, 0:290, 1:100}
+    start = time.time()
+    for i in xrange(JOGS):
+        values[3] += 1 if i % 2 else -1
+        for chan in CHANNELS:
+            out.set_pwm(chan, 0, values[chan])
+        out.flush()
+    cached_time = time.time() - start
+    cached = bus.transactions() - setup
+
+    print "{} jogs".format(JOGS)
+    print "  set_pwm x4  : {:6d} transactions  {:.3f} s".format(naive, naive_time)
+    print "  PWMOutput   : {:6d} transactions  {:.3f} s".format(cached, cached_time)
+    print "  saving      : {:.1f}x".format(float(naive)/cached)
@@ -0,0 +1,317 @@
+#===========================================================================
+# recorder.py
+#
+# Pre-event clip recording. While armed, the viewer feed is kept in a
+# fixed size block of memory covering the last PRE_SECONDS. Nothing goes
+# to the SD card until something triggers a clip: the websocket, the top
+# button or the motion detector. The frames already in memory and the
+# next POST_SECONDS are then written out as one clip, frame by frame, by
+# a writer thread.
+#
+# The feed is MJPEG, every frame stands alone, so memory is freed a
+# whole frame at a time, oldest first. Frames the writer still needs are
+# never overwritten, if it falls that far behind new frames are dropped
+# instead. Clips are plain concatenated JPEGs, which ffplay and VLC play,
+# and mjpegger.py can split them back into frames:
+#   $ ffplay -f mjpeg clip.mjpeg
+#
+# 2026-10-18
+#===========================================================================
+import os
+import time
+import threading
+import collections
+import logging
+
+import clock
+import camctl
+import metrics
+
+PRE_SECONDS     = 10.0      # seconds of video kept before a trigger
+POST_SECONDS    = 10.0      # seconds recorded after a trigger
+BUDGET          = 16*1024*1024  # bytes of memory for the pre-event frames
+MAX_CLIPS       = 50        # clips kept on disk, oldest deleted first
+EXTENSION       = '.mjpeg'
+
+log = logging.getLogger(__name__)
+
+CLIPS_WRITTEN = metrics.Counter('recorder_clips_total', 'Clips written to disk')
+CLIP_SECONDS = metrics.Histogram('recorder_clip_write_seconds',
+                                 'Time to write a clip, including the wait for its frames')
+HISTORY_DROPPED = metrics.Counter('recorder_frames_dropped_total',
+                                  'Frames not kept with the memory full of frames still to write')
+
+class FrameHistory():
+    """Last seconds of frames in one preallocated block of memory used
+    as a ring. A feed consumer: the camera write()s each frame and
+    commit()s it. Frames are numbered from 1. Frames from pin onwards
+    are kept until unpinned whatever their age."""
+
+    def __init__(self, seconds=PRE_SECONDS, budget=BUDGET):
+        self.seconds = seconds
+        self.data = bytearray(budget)
+        self.view = memoryview(self.data)
+        self.frames = collections.deque()   # (number, start, length, time)
+        self.count = 0
+        self.dropped = 0
+        self.closed = False
+        self.pin = None
+        self._head = 0              # where the next byte goes
+        self._used = 0              # bytes in kept frames
+        self._start = 0             # start of the frame being written
+        self._written = 0           # bytes of it so far, None if dropped
+        self._cond = threading.Condition()
+
+    def used(self, ):
+        return self._used
+
+    # camera output interface
+    def write(self, b):
+        n = len(b)
+        if self._written == None:
+            return n
+        size = len(self.data)
+        with self._cond:
+            while self._used + self._written + n > size:
+                first = self.frames[0] if self.frames else None
+                if first == None or (not self.pin == None and first[0] >= self.pin):
+                    # full of frames still to be written, or one huge frame
+                    self._head = self._start
+                    self._written = None
+                    return n
+                self._evict()
+        head = self._head
+        end = min(size, head + n)
+        self.view[head:end] = b[:end - head]
+        if end - head < n:
+            self.view[:n - (end - head)] = b[end - head:]
+        self._head = (head + n) % size
+        self._written += n
+        return n
+
+    def flush(self, ):
+        pass
+
+    def commit(self, ):
+        now = clock.monotonic()
+        with self._cond:
+            if self._written == None:
+                self.dropped += 1
+                HISTORY_DROPPED.inc()
+            elif self._written:
+                self.count += 1
+                self.frames.append((self.count, self._start, self._written, now))
+                self._used += self._written
+            while (self.frames and self.frames[0][3] < now - self.seconds
+                   and (self.pin == None or self.frames[0][0] < self.pin)):
+                self._evict()
+            self._start = self._head
+            self._written = 0
+            self._cond.notify_all()
+
+    def close(self, ):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _evict(self, ):
+        number, start, length, t = self.frames.popleft()
+        self._used -= length
+
+    def oldest(self, since):
+        """Return the number of the oldest frame taken after since, the
+        next frame if there is none."""
+        with self._cond:
+            for number, start, length, t in self.frames:
+                if t >= since:
+                    return number
+            return self.count + 1
+
+    def wait_frame(self, number, timeout=1.0):
+        """Wait for frame number and return the first frame kept from
+        number on as (number, start, length, time), or None on timeout."""
+        with self._cond:
+            if self.count < number and not self.closed:
+                self._cond.wait(timeout)
+            for frame in self.frames:
+                if frame[0] >= number:
+                    return frame
+            return None
+
+    def parts(self, frame):
+        """Return the data of a frame as memoryviews, two if it wraps
+        round the end of the block."""
+        number, start, length, t = frame
+        end = start + length
+        if end <= len(self.data):
+            return [self.view[start:end]]
+        return [self.view[start:], self.view[:end - len(self.data)]]
+
+class ClipRecorder():
+    """Keeps a FrameHistory on the viewer feed while armed and writes
+    clips to clip_dir when triggered."""
+
+    def __init__(self, cameras, clip_dir, pre=PRE_SECONDS, post=POST_SECONDS,
+                 budget=BUDGET, max_clips=MAX_CLIPS):
+        self.cameras = cameras
+        self.clip_dir = clip_dir
+        self.pre = pre
+        self.post = post
+        self.budget = budget
+        self.max_clips = max_clips
+        self.history = None
+        self.last_clip = None
+        self._lock = threading.Lock()
+        self._writer = None
+        self._armed = False         # armed by arm(), not only for a clip
+
+    def is_armed(self, ):
+        return not self.history == None
+
+    def used(self, ):
+        """Bytes of video held in memory."""
+        history = self.history
+        return 0 if history == None else history.used()
+
+    def is_recording(self, ):
+        return not self._writer == None
+
+    def arm(self, ):
+        """Start keeping the last seconds of video in memory."""
+        with self._lock:
+            self._armed = True
+            self._register()
+
+    def disarm(self, ):
+        """Stop keeping video, after any clip being written is done."""
+        with self._lock:
+            self._armed = False
+            if self._writer == None:
+                self._unregister()
+
+    def trigger(self, reason='trigger'):
+        """Write a clip of the time before and after now. Returns the
+        path it will be at, or None if a clip is already being written.
+        Without being armed the clip only has the time after."""
+        with self._lock:
+            if not self._writer == None:
+                return None
+            self._register()
+            name = time.strftime('%Y%m%d-%H%M%S') + '-' + reason + EXTENSION
+            path = os.path.join(self.clip_dir, name)
+            self._writer = threading.Thread(target=self._write, name="ClipWriter",
+                                            args=(self.history, path, clock.monotonic()))
+            self._writer.daemon = True
+            self._writer.start()
+        log.info("recording clip %s", path)
+        return path
+
+    def wait(self, timeout=None):
+        """Wait for the clip being written, if any."""
+        writer = self._writer
+        if not writer == None:
+            writer.join(timeout)
+
+    def _register(self, ):
+        if self.history == None:
+            self.history = FrameHistory(self.pre, self.budget)
+            self.cameras.register(camctl.VIEW_PORT, self.history)
+
+    def _unregister(self, ):
+        if not self.history == None:
+            self.cameras.unregister(camctl.VIEW_PORT, self.history)
+            self.history = None
+
+    def _write(self, history, path, triggered):
+        start = clock.monotonic()
+        end = triggered + self.post
+        number = history.oldest(triggered - self.pre)
+        history.pin = number
+        frames = 0
+        try:
+            if not os.path.isdir(self.clip_dir):
+                os.makedirs(self.clip_dir)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                while not history.closed:
+                    frame = history.wait_frame(number)
+                    if frame == None:
+                        if clock.monotonic() > end:
+                            break
+                        continue
+                    if frame[3] > end:
+                        break
+                    for part in history.parts(frame):
+                        f.write(part)
+                    frames += 1
+                    number = frame[0] + 1
+                    history.pin = number
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, path)
+            self.last_clip = path
+            CLIPS_WRITTEN.inc()
+            CLIP_SECONDS.observe(clock.monotonic() - start)
+            log.info("clip %s written, %d frames", path, frames)
+            self._prune()
+        except (IOError, OSError):
+            log.exception("clip %s not written", path)
+        finally:
+            history.pin = None
+            with self._lock:
+                self._writer = None
+                if not self._armed:
+                    self._unregister()
+
+    def _prune(self, ):
+        clips = sorted([name for name in os.listdir(self.clip_dir) if name.endswith(EXTENSION)])
+        for name in clips[:max(0, len(clips) - self.max_clips)]:
+            os.remove(os.path.join(self.clip_dir, name))
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # A clip from a fake camera: memory held while armed, how much of the
+    # pre and post event time made it into the clip, and what continuous
+    # recording would have written to the card instead.
+    import sys
+    import tempfile
+    import shutil
+    import mjpegger
+
+    PRE, POST, ARMED = 2.0, 1.0, 4.0
+    manager = camctl.CameraManager(lambda: camctl.FakeCamera(init_delay=0, warmup_delay=0),
+                                   standby_timeout=None)
+    clip_dir = tempfile.mkdtemp()
+    try:
+        recorder = ClipRecorder(manager, clip_dir, pre=PRE, post=POST)
+        recorder.arm()
+        time.sleep(ARMED)
+        held = recorder.used()
+        path = recorder.trigger('bench')
+        recorder.wait()
+        recorder.disarm()
+        manager.close()
+
+        class Count():
+            def __init__(self, ):
+                self.frames = 0
+            def write(self, b):
+                pass
+            def commit(self, ):
+                self.frames += 1
+        count = Count()
+        splitter = mjpegger.JPEGSplitter(count)
+        with open(path, 'rb') as f:
+            splitter.write(f.read())
+        size = os.path.getsize(path)
+        fps = 30
+        print "armed {:.0f} s, trigger with {:.0f} s before and {:.0f} s after".format(ARMED, PRE, POST)
+        print "  memory held     : {:8.0f} KB of {:.0f} KB budget".format(held / 1024.0, BUDGET / 1024.0)
+        print "  clip            : {:8.0f} KB, {} frames, {:.1f} s at {} fps".format(
+            size / 1024.0, count.frames, float(count.frames) / fps, fps)
+        print "  continuous      : {:8.0f} KB for the same time armed".format(
+            (ARMED + POST) * size / (PRE + POST) / 1024.0)
+    finally:
+        shutil.rmtree(clip_dir)
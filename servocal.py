@@ -0,0 +1,227 @@
+#===========================================================================
+# servocal.py
+#
+# Per servo calibration from angle in degrees to PWM counts. The servos
+# are not linear, so each channel has its own measured points, with
+# linear interpolation between them. The points are sampled into an
+# evenly spaced array once, so converting an angle takes one index and
+# one interpolation, with no search. The range of each channel is the
+# range of its points. Servo counts outside it are never sent.
+#
+# Until a channel is calibrated it maps the old fixed 130 to 600 count
+# range linearly onto -90 to 90 degrees.
+#
+# Capture points for a channel by jogging the servo and entering the
+# angle it is at, saved to DEFAULT_FILE unless a path is given:
+#   $ python servocal.py laser_x
+#
+# 2026-10-18
+#===========================================================================
+import os
+import sys
+import json
+import array
+import bisect
+import math
+
+VERSION         = 1
+CHANNELS        = ('camera_x', 'camera_y', 'laser_x', 'laser_y')
+CAMERA          = ('camera_x', 'camera_y')
+LASER           = ('laser_x', 'laser_y')
+DEFAULT_POINTS  = ((-90.0, 130), (90.0, 600))   # (degrees, counts)
+RESOLUTION      = 0.5               # degrees between table entries
+DEFAULT_FILE    = '/home/pi/rpi-laser/servocal.json'
+
+class ServoTable():
+    """Angle to PWM count map for one servo, from (angle, counts)
+    calibration points. Counts must rise or fall steadily with angle."""
+
+    def __init__(self, points, resolution=RESOLUTION):
+        points = sorted([(float(a), int(c)) for a, c in points])
+        if len(points) < 2:
+            raise ValueError("need at least two calibration points")
+        steps = [b[1] - a[1] for a, b in zip(points, points[1:])]
+        if not (all([s > 0 for s in steps]) or all([s < 0 for s in steps])):
+            raise ValueError("counts must rise or fall steadily with angle")
+        self.points = points
+        self.limits = (points[0][0], points[-1][0])
+        counts = (points[0][1], points[-1][1])
+        self.pwm_limits = (min(counts), max(counts))
+        # evenly spaced table covering the limits exactly
+        span = self.limits[1] - self.limits[0]
+        n = max(1, int(math.ceil(span / resolution)))
+        self._step = span / n
+        self._scale = 1.0 / self._step
+        self.table = array.array('d', [self._interp(self.limits[0] + i*self._step)
+                                       for i in xrange(n)])
+        self.table.append(points[-1][1])
+        # inverse lookup on counts in rising order
+        self._rising = counts[1] > counts[0]
+        inverse = points if self._rising else points[::-1]
+        self._inv_counts = [c for a, c in inverse]
+        self._inv_angles = [a for a, c in inverse]
+
+    def _interp(self, angle):
+        points = self.points
+        i = bisect.bisect_right([a for a, c in points], angle) - 1
+        i = min(max(i, 0), len(points) - 2)
+        (a0, c0), (a1, c1) = points[i], points[i+1]
+        return c0 + (angle - a0) * (c1 - c0) / (a1 - a0)
+
+    def pwm(self, angle):
+        """Return counts for angle, limited to the calibrated range."""
+        f = (angle - self.limits[0]) * self._scale
+        if f <= 0:
+            return int(round(self.table[0]))
+        i = int(f)
+        if i >= len(self.table) - 1:
+            return int(round(self.table[-1]))
+        t = self.table
+        return int(round(t[i] + (f - i) * (t[i+1] - t[i])))
+
+    def angle(self, counts):
+        """Return the angle for counts, limited to the calibrated range."""
+        cs = self._inv_counts
+        a = self._inv_angles
+        if counts <= cs[0]:
+            return a[0]
+        if counts >= cs[-1]:
+            return a[-1]
+        i = bisect.bisect_right(cs, counts) - 1
+        return a[i] + float(counts - cs[i]) * (a[i+1] - a[i]) / (cs[i+1] - cs[i])
+
+    def bound(self, counts):
+        """Return counts limited to the calibrated range."""
+        return min(max(counts, self.pwm_limits[0]), self.pwm_limits[1])
+
+class ServoCalibration():
+    """Tables for all four servo channels, loaded from path if it exists."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.tables = dict([(channel, ServoTable(DEFAULT_POINTS)) for channel in CHANNELS])
+        if not path == None and os.path.isfile(path):
+            self.load()
+
+    def __getitem__(self, channel):
+        return self.tables[channel]
+
+    def set_points(self, channel, points):
+        """Replace the calibration points for channel."""
+        self.tables[channel] = ServoTable(points)
+
+    def to_pwm(self, channels, angles):
+        """Return counts for an (x, y) pair of angles on the channel pair."""
+        return (self.tables[channels[0]].pwm(angles[0]),
+                self.tables[channels[1]].pwm(angles[1]))
+
+    def to_angles(self, channels, position):
+        """Return angles for an (x, y) pair of counts on the channel pair."""
+        return (self.tables[channels[0]].angle(position[0]),
+                self.tables[channels[1]].angle(position[1]))
+
+    def bound(self, channels, position):
+        """Return an (x, y) pair of counts limited to each channel's range."""
+        return (self.tables[channels[0]].bound(position[0]),
+                self.tables[channels[1]].bound(position[1]))
+
+    def move(self, channels, position, amount):
+        """Return counts for position moved by amount in degrees."""
+        x, y = self.to_angles(channels, position)
+        return self.to_pwm(channels, (x + amount[0], y + amount[1]))
+
+    def save(self, path=None):
+        """Write the calibration, replacing the file atomically."""
+        path = self.path if path == None else path
+        data = {'version': VERSION,
+                'channels': dict([(channel, [list(p) for p in table.points])
+                                  for channel, table in self.tables.items()])}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(data, separators=(',',':'), sort_keys=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+
+    def load(self, path=None):
+        path = self.path if path == None else path
+        with open(path, 'rb') as f:
+            data = json.load(f)
+        if not data.get('version') == VERSION:
+            raise ValueError("unknown servo calibration version {}".format(data.get('version')))
+        for channel, points in data['channels'].items():
+            if channel in CHANNELS:
+                self.set_points(channel, points)
+
+#-------------------------------------------------------------------------
+# Capture tool
+#-------------------------------------------------------------------------
+def capture(channel, path):
+    """Jog one servo and record the angle it is at for each position."""
+    import lasercam
+    box = lasercam.LaserCamBox()
+    cal = ServoCalibration(path)
+    positions = {'camera_x': box.camera_get_position,
+                 'camera_y': box.camera_get_position,
+                 'laser_x': box.laser_get_position,
+                 'laser_y': box.laser_get_position}
+    index = CHANNELS.index(channel) % 2
+    points = {}
+    # jog in raw counts, the current calibration limits don't apply here
+    chan = getattr(lasercam.LaserCamBox, channel.upper() + '_CHAN')
+    counts = positions[channel]()[index]
+    box.enable_pwm(update=True)
+    print "  +N / -N  move {} by N counts".format(channel)
+    print "  = DEG    record the servo as at DEG degrees"
+    print "  w        save, q  quit"
+    while True:
+        box.pwm_out.set_pwm(chan, 0, counts)
+        box.pwm_out.flush()
+        line = raw_input("{} counts {} > ".format(channel, counts)).strip()
+        if line.startswith('+') or line.startswith('-'):
+            try:
+                counts += int(line)
+            except ValueError:
+                print "  not a number of counts: {}".format(line)
+        elif line.startswith('='):
+            try:
+                angle = float(line[1:])
+            except ValueError:
+                print "  not an angle: {}".format(line[1:].strip())
+                continue
+            points[angle] = counts
+            print "  points {}".format(sorted(points.items()))
+        elif line == 'w':
+            try:
+                cal.set_points(channel, points.items())
+            except ValueError as e:
+                print "  not saved, {}".format(e)
+                continue
+            cal.save(path)
+            print "  saved to {}".format(path)
+        elif line == 'q':
+            break
+    box.disable_pwm()
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        capture(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else DEFAULT_FILE)
+        sys.exit(0)
+
+    # Compare the table lookup with interpolating the points directly.
+    import timeit
+    N = 200000
+    table = ServoTable([(-90, 120), (-45, 240), (0, 365), (45, 480), (90, 610)])
+    angles = [-90 + 180.0 * i / 997 for i in xrange(997)]
+    err = max([abs(table.pwm(a) - int(round(table._interp(a)))) for a in angles])
+    t_table = min(timeit.repeat(lambda: table.pwm(12.3), number=N, repeat=3))
+    t_points = min(timeit.repeat(lambda: int(round(table._interp(12.3))), number=N, repeat=3))
+    t_angle = min(timeit.repeat(lambda: table.angle(412), number=N, repeat=3))
+    print "{} lookups".format(N)
+    print "  table  : {:6.2f} us".format(1e6 * t_table / N)
+    print "  points : {:6.2f} us".format(1e6 * t_points / N)
+    print "  inverse: {:6.2f} us".format(1e6 * t_angle / N)
+    print "  max difference {} counts".format(err)
@@ -0,0 +1,121 @@
+#===========================================================================
+# sessions.py
+#
+# Websocket clients of the laser server. Any number of clients can
+# watch, one at a time holds the controller lease and may move the
+# hardware. The lease is taken by the first command from a client when
+# nobody holds it, or when the holder has been quiet for LEASE_TIMEOUT.
+#
+# State is read with read_state() at most STATE_RATE times a second
+# and what changed since the last read is sent to every client as one
+# compact JSON object, encoded once however many are watching, e.g.
+#   {"l":[330,490],"z":1}
+# A client that joins is sent the whole state first. A client's own role
+# is sent to it alone as {"r":1} for controller or {"r":0} for observer.
+#
+# 2026-10-18
+#===========================================================================
+import json
+import logging
+
+import tornado.ioloop
+import tornado.websocket
+
+import clock
+import metrics
+
+STATE_RATE      = 10        # state updates per second at most
+LEASE_TIMEOUT   = 120       # seconds without a command before control can be taken
+
+log = logging.getLogger(__name__)
+
+STATE_MESSAGES = metrics.Counter('sessions_state_messages_total',
+                                 'State update messages sent to clients')
+
+def encode(state):
+    return json.dumps(state, separators=(',',':'), sort_keys=True)
+
+class SessionManager():
+    """Connected clients, the controller lease and the state they are
+    shown. read_state() returns a dict of short key : JSON value. Runs
+    on the IOLoop, sessions need write_message()."""
+
+    def __init__(self, read_state, rate=STATE_RATE, lease_timeout=LEASE_TIMEOUT):
+        self.read_state = read_state
+        self.lease_timeout = lease_timeout
+        self.sessions = []
+        self.controller = None
+        self._last_command = 0
+        self._state = {}
+        self._timer = tornado.ioloop.PeriodicCallback(self.broadcast, 1000.0 / rate)
+
+    def join(self, session):
+        """Add session and send it the whole state."""
+        self.sessions.append(session)
+        if not self._timer.is_running():
+            self._state = self._read()
+            self._timer.start()
+        self._send(session, encode(self._state))
+        self._send(session, encode({'r': 0}))
+
+    def leave(self, session):
+        """Remove session, releasing control if it had it. Return True if
+        it was the controller."""
+        if session in self.sessions:
+            self.sessions.remove(session)
+        if not self.sessions:
+            self._timer.stop()
+        if session is self.controller:
+            self.controller = None
+            return True
+        return False
+
+    def acquire(self, session):
+        """Give session control if it is free or lapsed. Return True if
+        session holds control afterwards."""
+        now = clock.monotonic()
+        if session is self.controller:
+            self._last_command = now
+            return True
+        if not self.controller == None and now - self._last_command < self.lease_timeout:
+            return False
+        if not self.controller == None:
+            log.info("control lease lapsed, taken over")
+            self._send(self.controller, encode({'r': 0}))
+        self.controller = session
+        self._last_command = now
+        self._send(session, encode({'r': 1}))
+        return True
+
+    def release(self, session):
+        """Give up control if session has it."""
+        if session is self.controller:
+            self.controller = None
+            self._send(session, encode({'r': 0}))
+
+    def is_controller(self, session):
+        return session is self.controller
+
+    def broadcast(self, ):
+        """Send what changed since last time to every session."""
+        state = self._read()
+        delta = dict([(k, v) for k, v in state.items() if not self._state.get(k) == v])
+        if not delta:
+            return
+        self._state = state
+        message = encode(delta)
+        for session in list(self.sessions):
+            self._send(session, message)
+
+    def _read(self, ):
+        state = self.read_state()
+        state['n'] = len(self.sessions)
+        state['k'] = int(not self.controller == None)
+        return state
+
+    def _send(self, session, message):
+        try:
+            session.write_message(message)
+            STATE_MESSAGES.inc()
+        except tornado.websocket.WebSocketClosedError:
+            pass
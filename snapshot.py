@@ -0,0 +1,233 @@
+#===========================================================================
+# snapshot.py
+#
+# Latest camera frame as a single JPEG, for dashboards and widgets that
+# poll the box. While the stream runs the newest frame is taken from its
+# ring, copied once per frame however many clients ask. Otherwise one
+# frame is captured on the viewer feed and served from memory for TTL
+# seconds, and callers arriving during the capture share it.
+#
+# Each snapshot has an ETag, so a client that already has the frame is
+# answered without sending it again. Thumbnails are scaled down from the
+# same cached frame, once per width, with PIL on a worker thread. Only
+# the THUMB_WIDTHS are made, other widths get the next size up:
+#   sudo apt-get install python-imaging
+#
+# 2026-10-18
+#===========================================================================
+import io
+import time
+import threading
+import itertools
+import logging
+
+import clock
+import camctl
+import metrics
+import futures
+
+TTL             = 5.0       # seconds a captured frame is served without a stream
+GRAB_TIMEOUT    = 5.0       # seconds to wait for a captured frame
+THUMB_WIDTHS    = (160, 320, 640)   # thumbnail widths made, in pixels
+THUMB_QUALITY   = 70        # JPEG quality of thumbnails
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_CAPTURES = metrics.Counter('snapshot_captures_total',
+                                    'Frames captured for snapshots with no stream running')
+SNAPSHOT_FRAMES = metrics.Counter('snapshot_frames_total',
+                                  'Stream frames copied into the snapshot cache')
+
+# ETags of this run, so a restart never repeats one
+_TOKEN = "{:x}".format(int(time.time()))
+_sequence = itertools.count(1)
+
+class Snapshot():
+    """One JPEG frame, when it was taken, its ETag and thumbnails made
+    from it. Thumbnails are scaled by submit(func, *args), which returns
+    a futures.Future, such as futures.Worker.submit. By default they are
+    scaled straight away."""
+
+    def __init__(self, jpeg, submit=futures.call):
+        self.jpeg = jpeg
+        self.time = clock.monotonic()
+        self.etag = '"{}-{}"'.format(_TOKEN, next(_sequence))
+        self.submit = submit
+        self._thumbs = {}           # width : Future of JPEG
+        self._lock = threading.Lock()
+
+    def age(self, ):
+        return clock.monotonic() - self.time
+
+    def thumb_width(self, width):
+        """Return the narrowest of THUMB_WIDTHS at least width wide, or
+        the widest. Only these widths are made, so a client can't fill
+        the cache with sizes."""
+        for allowed in THUMB_WIDTHS:
+            if allowed >= int(width):
+                return allowed
+        return THUMB_WIDTHS[-1]
+
+    def thumb_etag(self, width):
+        return '{}-w{}"'.format(self.etag[:-1], self.thumb_width(width))
+
+    def thumbnail(self, width):
+        """Return a futures.Future of the frame scaled to thumb_width(width)
+        pixels wide as JPEG, no wider than the frame itself. It fails with
+        ImportError without PIL."""
+        width = self.thumb_width(width)
+        with self._lock:
+            thumb = self._thumbs.get(width)
+            if thumb == None:
+                thumb = self._thumbs[width] = self.submit(self._scale, width)
+            return thumb
+
+    def _scale(self, width):
+        from PIL import Image
+        image = Image.open(io.BytesIO(self.jpeg))
+        w, h = image.size
+        if width >= w:
+            return self.jpeg
+        size = (width, max(1, h * width // w))
+        # decodes at 1/2, 1/4 or 1/8 size where that is still big enough
+        image.draft('RGB', size)
+        image = image.convert('RGB').resize(size, Image.BILINEAR)
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=THUMB_QUALITY)
+        return out.getvalue()
+
+class _OneFrame():
+    """Feed consumer that keeps the first whole frame it is given."""
+
+    def __init__(self, ):
+        self.parts = []
+        self.jpeg = None
+        self.done = threading.Event()
+
+    def write(self, b):
+        if self.jpeg == None:
+            # the splitter hands over memoryviews, bytes() of one is its repr
+            self.parts.append(memoryview(b).tobytes())
+        return len(b)
+
+    def commit(self, ):
+        if self.jpeg == None:
+            self.jpeg = ''.join(self.parts)
+            self.parts = []
+            self.done.set()
+
+    def close(self, ):
+        pass
+
+class SnapshotCache():
+    """Newest frame of a camctl.CameraManager, kept in memory."""
+
+    def __init__(self, cameras, ttl=TTL, timeout=GRAB_TIMEOUT):
+        self.cameras = cameras
+        self.ttl = ttl
+        self.timeout = timeout
+        self.snapshot = None
+        self._source = (None, 0)    # (ring, frame count) the snapshot came from
+        self._lock = threading.Lock()
+        self._grab = None           # Future of the capture in progress
+        self._scaler = futures.Worker("Thumbnails")
+
+    def latest(self, ):
+        """Return the newest Snapshot that can be served from memory, or
+        None if a frame has to be captured."""
+        with self._lock:
+            ring = self.cameras.frames
+            if not ring == None:
+                last = self._source[1] if self._source[0] is ring else 0
+                buf = ring.acquire(last, timeout=0)
+                if not buf == None:
+                    try:
+                        self.snapshot = Snapshot(buf.frame().tobytes(), self._scaler.submit)
+                        self._source = (ring, buf.count)
+                    finally:
+                        ring.release(buf)
+                    SNAPSHOT_FRAMES.inc()
+                    return self.snapshot
+                if last:
+                    return self.snapshot
+            if not self.snapshot == None and self.snapshot.age() <= self.ttl:
+                return self.snapshot
+            return None
+
+    def get(self, ):
+        """Return a futures.Future of the newest Snapshot, done at once
+        if it can be served from memory. Its result is None if the camera
+        gave no frame within the timeout."""
+        snapshot = self.latest()
+        with self._lock:
+            if snapshot == None and self._grab == None:
+                self._grab = futures.Future()
+                thread = threading.Thread(target=self._capture, name="Snapshot")
+                thread.daemon = True
+                thread.start()
+            if snapshot == None:
+                return self._grab
+        future = futures.Future()
+        future.set_result(snapshot)
+        return future
+
+    def _capture(self, ):
+        frame = _OneFrame()
+        SNAPSHOT_CAPTURES.inc()
+        self.cameras.register(camctl.VIEW_PORT, frame)
+        try:
+            frame.done.wait(self.timeout)
+        finally:
+            self.cameras.unregister(camctl.VIEW_PORT, frame)
+        with self._lock:
+            if not frame.jpeg == None:
+                self.snapshot = Snapshot(frame.jpeg, self._scaler.submit)
+                self._source = (None, 0)
+                snapshot = self.snapshot
+            else:
+                log.warning("no frame for snapshot in %.1f s", self.timeout)
+                snapshot = None
+            future, self._grab = self._grab, None
+        future.set_result(snapshot)
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # Polling clients against a fake camera: a capture per request, as
+    # if each opened the stream for one frame, against the cache with
+    # and without a stream running.
+    REQUESTS = 200
+    manager = camctl.CameraManager(lambda: camctl.FakeCamera(init_delay=0, warmup_delay=0),
+                                   standby_timeout=None)
+    manager.warm_up()
+
+    start = time.time()
+    for i in xrange(REQUESTS // 20):
+        frame = _OneFrame()
+        manager.register(camctl.VIEW_PORT, frame)
+        frame.done.wait()
+        manager.unregister(camctl.VIEW_PORT, frame)
+    per_capture = (time.time() - start) / (REQUESTS // 20)
+
+    cache = SnapshotCache(manager, ttl=60)
+    cache.get().wait()
+    start = time.time()
+    for i in xrange(REQUESTS):
+        cache.get().wait()
+    per_cached = (time.time() - start) / REQUESTS
+
+    manager.start()
+    manager.wait_first_frame()
+    time.sleep(0.1)
+    start = time.time()
+    for i in xrange(REQUESTS):
+        cache.get().wait()
+    per_streaming = (time.time() - start) / REQUESTS
+    copies = SNAPSHOT_FRAMES.value()
+    manager.close()
+
+    print "{} snapshot requests".format(REQUESTS)
+    print "  capture each : {:8.3f} ms".format(1000 * per_capture)
+    print "  cached, idle : {:8.3f} ms".format(1000 * per_cached)
+    print "  streaming    : {:8.3f} ms, {:.0f} frames copied".format(1000 * per_streaming, copies)
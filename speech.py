@@ -0,0 +1,177 @@
+#===========================================================================
+# speech.py
+#
+# Non-blocking speech output. Phrases are synthesized once with espeak
+# into an on-disk WAV cache and played back with aplay in a child
+# process by a worker thread, so callers never wait on audio.
+#
+# 2026-10-18
+#===========================================================================
+import os
+import threading
+import subprocess
+import hashlib
+import Queue
+import logging
+
+import metrics
+
+ESPEAK = 'espeak'
+APLAY = 'aplay'
+ESPEAK_OPTS = ('-p', '45', '-s', '165')     # same voice as LaserCamBox.speak
+MAX_ADHOC = 32                               # cached ad-hoc phrases kept
+
+log = logging.getLogger(__name__)
+
+QUEUE_SECONDS = metrics.Histogram('speech_queue_seconds',
+                                  'Time from say() until the phrase starts playing')
+
+class PhraseCache():
+    """WAV files keyed by phrase text and voice options. Pinned phrases
+    are kept forever, other phrases are evicted least recently used."""
+
+    def __init__(self, cache_dir, opts=ESPEAK_OPTS, max_adhoc=MAX_ADHOC):
+        self.cache_dir = cache_dir
+        self.opts = tuple(opts)
+        self.max_adhoc = max_adhoc
+        self.pinned = set()
+        self._lock = threading.Lock()
+
+    def path(self, text):
+        """Return the cache file name for text."""
+        key = hashlib.sha1(repr((text, self.opts))).hexdigest()
+        return os.path.join(self.cache_dir, key + '.wav')
+
+    def pin(self, text):
+        """Keep text in the cache permanently."""
+        self.pinned.add(self.path(text))
+
+    def get(self, text):
+        """Return path to WAV for text, synthesizing it if needed."""
+        path = self.path(text)
+        with self._lock:
+            if os.path.isfile(path):
+                os.utime(path, None)    # mark as recently used
+                return path
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+        tmp = '{}.{}.tmp'.format(path, threading.current_thread().ident)
+        cmd = [ESPEAK] + list(self.opts) + ['-w', tmp, text]
+        if subprocess.call(cmd) != 0:
+            raise OSError("espeak failed for: {}".format(text))
+        with self._lock:
+            os.rename(tmp, path)
+            self._evict()
+        return path
+
+    def _evict(self, ):
+        adhoc = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.wav') and not path in self.pinned:
+                adhoc.append((os.path.getmtime(path), path))
+        adhoc.sort()
+        for mtime, path in adhoc[:max(0, len(adhoc) - self.max_adhoc)]:
+            os.remove(path)
+
+class Speaker(threading.Thread):
+    """Worker thread that plays queued phrases one at a time.
+
+    amp_on and amp_off are called around each playback from this
+    thread, e.g. with LaserCamBox.enable_audio and disable_audio. They
+    must have taken effect when they return, playback starts straight
+    after amp_on."""
+
+    def __init__(self, cache, amp_on=None, amp_off=None):
+        threading.Thread.__init__(self, name="Speaker")
+        self.daemon = True
+        self.cache = cache
+        self.amp_on = amp_on
+        self.amp_off = amp_off
+        self._queue = Queue.Queue()
+        self._player = None
+        self._generation = 0        # bumped by cancel(), older phrases are dropped
+        self._lock = threading.Lock()
+
+    def prerender(self, phrases):
+        """Pin and synthesize phrases in the background."""
+        for text in phrases:
+            self.cache.pin(text)
+        thread = threading.Thread(target=self._prerender, args=(list(phrases),))
+        thread.daemon = True
+        thread.start()
+
+    def _prerender(self, phrases):
+        for text in phrases:
+            try:
+                self.cache.get(text)
+            except OSError as e:
+                log.warning("speech prerender: %s", e)
+
+    def say(self, text, preempt=False):
+        """Queue text for playback. With preempt, anything playing or
+        queued is dropped first."""
+        if preempt:
+            self._drop()
+        self._queue.put((text, metrics.now(), self._generation))
+        if preempt:
+            # queued first, so the amp stays on across the switch
+            self._terminate()
+
+    def cancel(self, ):
+        """Drop queued phrases and stop the current one."""
+        self._drop()
+        self._terminate()
+
+    def _drop(self, ):
+        with self._lock:
+            self._generation += 1
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+    def _terminate(self, ):
+        with self._lock:
+            if not self._player == None:
+                self._player.terminate()
+
+    def queue_depth(self, ):
+        """Return number of phrases waiting."""
+        return self._queue.qsize()
+
+    def stop(self, ):
+        self.cancel()
+        self._queue.put(None)
+
+    def run(self, ):
+        while True:
+            item = self._queue.get()
+            if item == None:
+                break
+            text, queued, generation = item
+            if not generation == self._generation:
+                continue
+            try:
+                path = self.cache.get(text)
+            except OSError as e:
+                log.warning("speech: %s", e)
+                continue
+            if not self.amp_on == None:
+                self.amp_on()
+            QUEUE_SECONDS.observe(metrics.now() - queued)
+            player = None
+            try:
+                with self._lock:
+                    # not if cancelled while it was being synthesized
+                    if generation == self._generation:
+                        player = self._player = subprocess.Popen([APLAY, '-q', path])
+                if not player == None:
+                    player.wait()
+            except OSError as e:
+                log.warning("speech: %s", e)
+            with self._lock:
+                self._player = None
+            if self._queue.empty() and not self.amp_off == None:
+                self.amp_off()
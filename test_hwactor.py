@@ -0,0 +1,131 @@
+#===========================================================================
+# test_hwactor.py
+#
+# HardwareActor on the simulated hardware backend: moves merged per
+# servo tick, ordering against queued calls, its counters and the state
+# it publishes:
+#   $ python -m unittest test_hwactor
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+
+import lasercam
+import hwbackend
+import hwactor
+import servocal
+
+class HardwareActorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = hwbackend.SimBackend(bus_time=0, camera_init=0, camera_warmup=0)
+        self.box = lasercam.LaserCamBox(backend=self.backend)
+        self.actor = None
+
+    def tearDown(self):
+        if not self.actor == None and self.actor.is_alive():
+            self.actor.stop()
+            self.actor.join(2.0)
+
+    def make(self, **kwargs):
+        self.actor = hwactor.HardwareActor(self.box, **kwargs)
+        return self.actor
+
+    def transactions(self):
+        return self.backend.counters()['i2c_transactions']
+
+    def settle(self):
+        self.assertTrue(self.actor.settled().wait(5.0))
+
+    def test_burst_merged_into_one_update(self):
+        self.box.warm_up()
+        self.box.update_pwm()
+        start = self.transactions()
+        camera = self.box.camera_get_position()
+        laser = self.box.laser_get_position()
+        actor = self.make()
+        # queued before the thread runs, so all land in one batch
+        for i in xrange(10):
+            actor.camera_move_relative((1, 0))
+            actor.laser_move_relative((0, -1))
+        actor.start()
+        self.settle()
+        self.assertEqual(self.box.camera_get_position(), (camera[0] + 10, camera[1]))
+        self.assertEqual(self.box.laser_get_position(), (laser[0], laser[1] - 10))
+        self.assertEqual(actor.moves, 20)
+        self.assertEqual(actor.applies, 1)
+        self.assertEqual(actor.coalescing_ratio(), 20.0)
+        self.assertEqual(self.transactions() - start, 1)
+
+    def test_relative_moves_limited_to_calibration(self):
+        actor = self.make()
+        for i in xrange(100):
+            actor.laser_move_relative((100, 0))
+        actor.start()
+        self.settle()
+        low, high = self.box.calibration[servocal.LASER[0]].pwm_limits
+        self.assertEqual(self.box.laser_get_position()[0], high)
+
+    def test_calls_keep_their_place(self):
+        actor = self.make()
+        seen = []
+        actor.laser_set_position((300, 300))
+        actor.call(lambda: seen.append(self.box.laser_get_position()))
+        actor.laser_set_position((400, 400))
+        actor.start()
+        self.settle()
+        self.assertEqual(seen, [(300, 300)])
+        self.assertEqual(self.box.laser_get_position(), (400, 400))
+        self.assertEqual(actor.calls, 1)
+        self.assertEqual(actor.applies, 2)
+        self.assertEqual(actor.intents, 4)
+
+    def test_failing_call_does_not_stop_actor(self):
+        actor = self.make()
+        actor.call(lambda: 1 / 0)
+        actor.laser_set_position((300, 300))
+        hwactor.log.disabled = True         # the traceback is expected
+        try:
+            actor.start()
+            self.settle()
+        finally:
+            hwactor.log.disabled = False
+        self.assertEqual(self.box.laser_get_position(), (300, 300))
+
+    def test_passthrough(self):
+        actor = self.make()
+        actor.laser_on()
+        actor.start()
+        self.settle()
+        self.assertEqual(self.box.get_laser_state(), 1)
+        self.assertRaises(AttributeError, getattr, actor, 'no_such_method')
+
+    def test_smooth_move_settles_on_target(self):
+        actor = self.make(smooth=True)
+        actor.start()
+        actor.camera_set_position((400, 300))
+        self.settle()
+        self.assertEqual(self.box.camera_get_position(), (400, 300))
+        self.assertTrue(actor.applies > 1)
+
+    def test_state_published_by_actor(self):
+        actor = self.make()
+        state = actor.state()
+        self.assertEqual(state['laser_on'], 0)
+        self.assertEqual(state['pwm_enabled'], False)
+        # reading it touched no hardware
+        self.assertEqual(self.box.init_seconds, {})
+        actor.laser_on()
+        actor.enable_pwm()
+        actor.status_led_on(2)
+        actor.laser_set_position((300, 310))
+        actor.start()
+        self.settle()
+        state = actor.state()
+        self.assertEqual(state['laser'], (300, 310))
+        self.assertEqual(state['laser_on'], 1)
+        self.assertEqual(state['status_leds'], [0, 1, 0])
+        self.assertEqual(state['pwm_enabled'], True)
+
+if __name__ == '__main__':
+    unittest.main()
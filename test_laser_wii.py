@@ -0,0 +1,119 @@
+#===========================================================================
+# test_laser_wii.py
+#
+# WiiLaserController on recorded stick traces, against a box that counts
+# what it is sent and against the simulated hardware:
+#   $ python -m unittest test_laser_wii
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+import os
+import tempfile
+
+import laser_wii
+import lasercam
+import hwbackend
+import servocal
+
+class Box():
+    """Records the laser commands it is given."""
+
+    def __init__(self, ):
+        self.calibration = servocal.ServoCalibration()
+        self.positions = []
+        self.laser = []
+
+    def laser_set_position(self, position):
+        self.positions.append(position)
+
+    def laser_on(self, ):
+        self.laser.append(True)
+
+    def laser_off(self, ):
+        self.laser.append(False)
+
+def still_trace(n=50, x=128, y=128, wobble=1):
+    """Stick held still with a small wobble, z held down."""
+    return [(i * 0.01, x + (wobble if i % 2 else 0), y - (wobble if i % 3 else 0), 1)
+            for i in xrange(n)]
+
+class WiiLaserControllerTest(unittest.TestCase):
+
+    def replay(self, trace, box=None, **kwargs):
+        box = Box() if box == None else box
+        controller = laser_wii.WiiLaserController(box, **kwargs)
+        laser_wii.TraceSource(trace, realtime=False).run(controller)
+        return controller, box
+
+    def test_wobble_inside_deadband_ignored(self):
+        controller, box = self.replay(still_trace(wobble=laser_wii.DEADBAND))
+        self.assertEqual(controller.samples, 50)
+        self.assertEqual(len(box.positions), 1)
+        self.assertEqual(box.laser, [True])
+        self.assertEqual(controller.writes, 2)
+        self.assertTrue(controller.done.is_set())
+
+    def test_wobble_outside_deadband_followed(self):
+        controller, box = self.replay(still_trace(wobble=laser_wii.DEADBAND + 1))
+        self.assertGreater(len(box.positions), 1)
+
+    def test_no_deadband_writes_only_changes(self):
+        trace = [(0.0, 100, 100, 0), (0.01, 100, 100, 0), (0.02, 101, 100, 0)]
+        table = [x // 2 for x in xrange(256)]
+        controller, box = self.replay(trace, deadband=0, tables=(table, table))
+        # 100 and 101 map to the same servo value
+        self.assertEqual(box.positions, [(50, 50)])
+        self.assertEqual(box.laser, [False])
+
+    def test_sweep_uses_table(self):
+        trace = [(i * 0.01, x, 255 - x, 0) for i, x in enumerate(xrange(laser_wii.NUNCHUK_MIN, laser_wii.NUNCHUK_MAX, 5))]
+        controller, box = self.replay(trace)
+        self.assertEqual(len(box.positions), len(set(box.positions)))
+        for (t, sx, sy, z), position in zip(trace, box.positions):
+            self.assertEqual(position, (controller.tables[0][sx], controller.tables[1][sy]))
+
+    def test_tables_span_calibration(self):
+        box = Box()
+        box.calibration.set_points('laser_x', [(-30.0, 250), (0.0, 340), (45.0, 480)])
+        controller = laser_wii.WiiLaserController(box)
+        x, y = controller.tables
+        self.assertEqual((x[0], x[laser_wii.NUNCHUK_MIN]), (250, 250))
+        self.assertEqual((x[255], x[laser_wii.NUNCHUK_MAX]), (480, 480))
+        self.assertEqual((y[0], y[255]), (130, 600))
+        # evenly spaced in angle, not in counts
+        middle = (laser_wii.NUNCHUK_MIN + laser_wii.NUNCHUK_MAX) // 2
+        self.assertAlmostEqual(box.calibration['laser_x'].angle(x[middle]), 7.5, delta=0.5)
+
+    def test_trigger_changes_only(self):
+        trace = [(i * 0.01, 128, 128, z) for i, z in enumerate((0, 0, 1, 1, 1, 0, 1))]
+        controller, box = self.replay(trace)
+        self.assertEqual(box.laser, [False, True, False, True])
+
+    def test_bus_traffic_on_sim(self):
+        backend = hwbackend.SimBackend(bus_time=0)
+        box = lasercam.LaserCamBox(backend=backend)
+        box.warm_up()
+        start = backend.counters()
+        trace = still_trace(n=20) + [(0.5 + i * 0.01, 128 + 10*i, 128, 0) for i in xrange(5)]
+        controller, box = self.replay(trace, box=box)
+        end = backend.counters()
+        # one position while still, then four more as the first sample of
+        # the move is inside the deadband: a block write each, and a GPIO
+        # write per laser change
+        self.assertEqual(end['i2c_transactions'] - start['i2c_transactions'], 5)
+        self.assertEqual(end['gpio_writes'] - start['gpio_writes'], 2)
+        self.assertEqual(controller.writes, 5 + 2)
+
+    def test_trace_file_round_trip(self):
+        trace = still_trace(n=5)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            laser_wii.save_trace(path, trace)
+            self.assertEqual(laser_wii.load_trace(path), trace)
+        finally:
+            os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
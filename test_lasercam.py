@@ -0,0 +1,70 @@
+#===========================================================================
+# test_lasercam.py
+#
+# LaserCamBox on the simulated hardware backend, bus traffic per command
+# and bring-up on first use:
+#   $ python -m unittest test_lasercam
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+
+import lasercam
+import hwbackend
+import servocal
+
+class LaserCamBoxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = hwbackend.SimBackend(bus_time=0, camera_init=0, camera_warmup=0)
+        self.box = lasercam.LaserCamBox(backend=self.backend)
+
+    def counts(self):
+        return self.backend.counters()
+
+    def test_nothing_touched_until_used(self):
+        counts = self.counts()
+        self.assertEqual(counts['gpio_writes'], 0)
+        self.assertEqual(counts['i2c_transactions'], 0)
+        self.assertEqual(self.box.init_seconds, {})
+        self.box.laser_on()
+        self.assertEqual(sorted(self.box.init_seconds), ['gpio'])
+        self.assertEqual(self.counts()['i2c_transactions'], 0)
+
+    def test_warm_up(self):
+        self.box.warm_up()
+        self.assertEqual(sorted(self.box.init_seconds), ['audio', 'gpio', 'pwm'])
+        self.assertEqual(self.counts()['cameras_opened'], 0)
+
+    def test_jog_is_one_transaction(self):
+        self.box.warm_up()
+        self.box.update_pwm()
+        start = self.counts()['i2c_transactions']
+        for i in xrange(10):
+            self.box.laser_left()
+        self.assertEqual(self.counts()['i2c_transactions'] - start, 10)
+        self.box.camera_set_position(self.box.camera_get_position())
+        self.assertEqual(self.counts()['i2c_transactions'] - start, 10)
+
+    def test_positions_limited_to_calibration(self):
+        low, high = self.box.calibration[servocal.LASER[0]].pwm_limits
+        self.box.laser_set_position((high + 100, low - 100))
+        self.assertEqual(self.box.laser_get_position(), (high, low))
+        device = self.backend.i2c.get_i2c_device(lasercam.LaserCamBox.PWM_I2C)
+        self.assertEqual(device.get_pwm(lasercam.LaserCamBox.LASER_X_CHAN), (0, high))
+
+    def test_angles_round_trip(self):
+        self.box.laser_set_angle((10.0, -20.0))
+        x, y = self.box.laser_get_angle()
+        self.assertAlmostEqual(x, 10.0, delta=0.5)
+        self.assertAlmostEqual(y, -20.0, delta=0.5)
+
+    def test_top_button(self):
+        pressed = []
+        self.box.register_btn_func(lambda: pressed.append(1))
+        self.box.warm_up()
+        self.backend.GPIO.press(lasercam.LaserCamBox.TOP_BTN_PIN)
+        self.assertEqual(pressed, [1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#===========================================================================
+# test_mjpegger.py
+#
+# JPEGSplitter cutting a recorded byte stream into frames however it is
+# chunked, and the frame ring dropping frames while readers hold them:
+#   $ python -m unittest test_mjpegger
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+
+import mjpegger
+
+def jpeg(n, size=50):
+    """Made up JPEG, SOI, body without markers, EOI."""
+    body = ''.join([chr((n + i) % 0xfe) for i in xrange(size)])
+    return mjpegger.SOI + body + mjpegger.EOI
+
+class FrameList():
+    """Output collecting committed frames."""
+
+    def __init__(self, ):
+        self.frames = []
+        self._current = []
+
+    def write(self, b):
+        self._current.append(b.tobytes() if isinstance(b, memoryview) else b)
+        return len(b)
+
+    def commit(self, ):
+        self.frames.append(''.join(self._current))
+        self._current = []
+
+def split(stream, chunks):
+    """Feed stream to a splitter in chunks of the given sizes, the rest
+    in one go. Returns the splitter, its output and on_frame calls."""
+    output = FrameList()
+    calls = []
+    splitter = mjpegger.JPEGSplitter(output, on_frame=lambda: calls.append(output.frames[-1]))
+    pos = 0
+    for size in chunks:
+        splitter.write(stream[pos:pos+size])
+        pos += size
+    if pos < len(stream):
+        splitter.write(stream[pos:])
+    return splitter, output, calls
+
+class JPEGSplitterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = [jpeg(n) for n in xrange(3)]
+        self.stream = ''.join(self.frames)
+
+    def test_several_frames_in_one_write(self):
+        splitter, output, calls = split(self.stream, [])
+        self.assertEqual(output.frames, self.frames)
+        self.assertEqual(calls, self.frames)
+        self.assertEqual(splitter.frames, 3)
+        self.assertEqual(splitter.skipped, 0)
+
+    def test_every_chunk_size(self):
+        for size in xrange(1, len(self.stream) + 1):
+            splitter, output, calls = split(self.stream, [size] * (len(self.stream) / size))
+            self.assertEqual(output.frames, self.frames, "chunk size {}".format(size))
+            self.assertEqual(splitter.skipped, 0)
+
+    def test_markers_split_across_writes(self):
+        first = len(self.frames[0])
+        # SOI of the second frame, then EOI of the first, cut in half
+        for cut in (first + 1, first - 1):
+            splitter, output, calls = split(self.stream, [cut])
+            self.assertEqual(output.frames, self.frames)
+
+    def test_held_ff_at_end_of_chunk(self):
+        output = FrameList()
+        splitter = mjpegger.JPEGSplitter(output)
+        frame = self.frames[0]
+        splitter.write(frame[:-1])
+        self.assertEqual(output.frames, [])
+        self.assertEqual(splitter._held, '\xff')
+        splitter.write(frame[-1:])
+        self.assertEqual(output.frames, [frame])
+
+    def test_lone_ff_is_not_lost(self):
+        # a 0xff held at the end of a write that turns out not to be a marker
+        frame = mjpegger.SOI + 'ab\xff' + 'cd' + mjpegger.EOI
+        splitter, output, calls = split(frame, [5])
+        self.assertEqual(output.frames, [frame])
+
+    def test_bytes_outside_frames_skipped(self):
+        stream = 'junk' + self.frames[0] + 'more junk' + self.frames[1] + 'tail'
+        splitter, output, calls = split(stream, [3, 7, 20])
+        self.assertEqual(output.frames, self.frames[:2])
+        self.assertEqual(splitter.skipped, len('junk') + len('more junk') + len('tail'))
+
+    def test_write_returns_length(self):
+        splitter = mjpegger.JPEGSplitter(FrameList())
+        self.assertEqual(splitter.write(self.stream[:7]), 7)
+        self.assertEqual(splitter.write(self.stream[7:8]), 1)
+
+class FrameRingTest(unittest.TestCase):
+
+    def publish(self, ring, data):
+        ring.write(data)
+        ring.commit()
+
+    def test_acquire_latest(self):
+        ring = mjpegger.FrameRing(slots=2, size=64)
+        self.assertEqual(ring.acquire(0, timeout=0), None)
+        self.publish(ring, 'one')
+        self.publish(ring, 'two')
+        buf = ring.acquire(0, timeout=0)
+        self.assertEqual(buf.frame().tobytes(), 'two')
+        self.assertEqual(buf.count, 2)
+        self.assertTrue(buf.part().tobytes().startswith(mjpegger.BOUNDARY))
+        self.assertEqual(ring.acquire(buf.count, timeout=0), None)
+        ring.release(buf)
+
+    def test_held_buffers_are_not_written(self):
+        ring = mjpegger.FrameRing(slots=2, size=64)
+        self.publish(ring, 'one')
+        first = ring.acquire(0, timeout=0)
+        self.publish(ring, 'two')
+        second = ring.acquire(first.count, timeout=0)
+        # both slots held, next frame goes to the spare and is dropped
+        self.publish(ring, 'three')
+        self.assertEqual(ring.dropped, 1)
+        self.assertEqual(ring.frame_count, 2)
+        self.assertEqual(first.frame().tobytes(), 'one')
+        self.assertEqual(second.frame().tobytes(), 'two')
+        ring.release(first)
+        # the buffer for the next frame was picked at the last commit
+        self.publish(ring, 'four')
+        self.assertEqual(ring.dropped, 2)
+        self.publish(ring, 'five')
+        self.assertEqual(ring.dropped, 2)
+        buf = ring.acquire(second.count, timeout=0)
+        self.assertEqual(buf.frame().tobytes(), 'five')
+        ring.release(buf)
+        ring.release(second)
+
+    def test_close_releases_readers(self):
+        ring = mjpegger.FrameRing(slots=2, size=64)
+        ring.close()
+        self.assertEqual(ring.acquire(0, timeout=5), None)
+
+if __name__ == '__main__':
+    unittest.main()
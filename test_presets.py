@@ -0,0 +1,149 @@
+#===========================================================================
+# test_presets.py
+#
+# PresetStore recovery from what a power cut leaves on disk: journal
+# replay, a torn last line, old version files, and compaction of the
+# journal into the snapshot:
+#   $ python -m unittest test_presets
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+import os
+import json
+import pickle
+import shutil
+import tempfile
+
+import presets
+
+def counts_to_angles(kind, position):
+    return (position[0] / 10.0, position[1] / 10.0)
+
+class PresetStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'presets.json')
+        self.journal = self.path + '.journal'
+        self.stores = []
+        self._compact_every = presets.COMPACT_EVERY
+        presets.log.disabled = True         # truncation warnings are expected
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        presets.COMPACT_EVERY = self._compact_every
+        presets.log.disabled = False
+        shutil.rmtree(self.dir)
+
+    def open(self, **kwargs):
+        store = presets.PresetStore(self.path, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def write(self, path, text):
+        with open(path, 'wb') as f:
+            f.write(text)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def snapshot(self, data):
+        self.write(self.path, json.dumps(data))
+
+    def test_changes_survive_reopen(self):
+        store = self.open()
+        store.set('camera', 1, (1.5, -2.0))
+        store.set('laser', 'a', (3.0, 4.0))
+        store.delete('laser', 'a')
+        store.flush()
+        self.assertEqual(len(self.read(self.journal).splitlines()), 3)
+        self.assertEqual(self.open().get('camera', 1), (1.5, -2.0))
+        self.assertEqual(self.stores[-1].get('laser', 'a'), None)
+
+    def test_journal_replayed_over_snapshot(self):
+        self.snapshot({'version': 2, 'camera': {'1': [1, 1], '2': [2, 2]}, 'laser': {}})
+        self.write(self.journal, '["camera","2",[5,5]]\n'
+                                 '["camera","1",null]\n'
+                                 '["laser","3",[3,3]]\n')
+        store = self.open()
+        self.assertEqual(store.names('camera'), ['2'])
+        self.assertEqual(store.get('camera', 2), (5, 5))
+        self.assertEqual(store.get('laser', 3), (3, 3))
+
+    def test_torn_last_line(self):
+        good = '["camera","1",[1,1]]\n["camera","2",[2,2]]\n'
+        self.write(self.journal, good + '["camera","3",[3.')
+        store = self.open()
+        self.assertEqual(store.names('camera'), ['1', '2'])
+        self.assertEqual(self.read(self.journal), good)
+        # the next entry starts on a line of its own
+        store.set('camera', 4, (4, 4))
+        store.flush()
+        self.assertEqual(self.read(self.journal), good + '["camera","4",[4,4]]\n')
+        self.assertEqual(self.open().names('camera'), ['1', '2', '4'])
+
+    def test_torn_line_parsing_as_wrong_shape(self):
+        good = '["camera","1",[1,1]]\n'
+        for torn in ('["camera"', '1', '["nokind","1",[1,1]]', '["camera","1",7]'):
+            self.write(self.journal, good + torn + '\n')
+            store = self.open()
+            self.assertEqual(store.names('camera'), ['1'], torn)
+            self.assertEqual(store.get('camera', 1), (1, 1))
+            self.assertEqual(self.read(self.journal), good)
+            store.close()
+            self.stores.remove(store)
+            os.remove(self.path)
+
+    def test_compaction(self):
+        presets.COMPACT_EVERY = 3
+        store = self.open()
+        for i in xrange(5):
+            store.set('laser', i, (i, i))
+            store.flush()
+        data = json.loads(self.read(self.path))
+        self.assertEqual(data['version'], presets.VERSION)
+        self.assertEqual(sorted(data['laser']), ['0', '1', '2'])
+        self.assertEqual(len(self.read(self.journal).splitlines()), 2)
+        store.close()
+        self.stores.remove(store)
+        # closing folds the rest in and removes the journal
+        self.assertFalse(os.path.exists(self.journal))
+        self.assertEqual(sorted(json.loads(self.read(self.path))['laser']),
+                         ['0', '1', '2', '3', '4'])
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_version_1_upgraded(self):
+        self.snapshot({'version': 1, 'camera': {'1': [100, 200]}, 'laser': {}})
+        self.write(self.journal, '["laser","2",[300,400]]\n')
+        store = self.open(convert=counts_to_angles)
+        self.assertEqual(store.get('camera', 1), (10.0, 20.0))
+        self.assertEqual(store.get('laser', 2), (30.0, 40.0))
+        # written back as version 2 straight away, journal folded in
+        data = json.loads(self.read(self.path))
+        self.assertEqual(data['version'], 2)
+        self.assertEqual(data['laser'], {'2': [30.0, 40.0]})
+        self.assertFalse(os.path.exists(self.journal))
+        # new entries are in angles and not converted again
+        store.set('laser', 3, (1.0, 2.0))
+        store.flush()
+        self.assertEqual(self.open(convert=counts_to_angles).get('laser', 3), (1.0, 2.0))
+
+    def test_legacy_pickle_imported(self):
+        pkl = os.path.join(self.dir, 'locations.pkl')
+        with open(pkl, 'wb') as f:
+            pickle.dump([[(100, 100), None, None, None, (500, 500)],
+                         [None, (200, 300), None, None, None]], f)
+        store = self.open(legacy_pkl=pkl, convert=counts_to_angles)
+        self.assertEqual(store.names('camera'), ['1', '5'])
+        self.assertEqual(store.get('laser', 2), (20.0, 30.0))
+        self.assertEqual(json.loads(self.read(self.path))['version'], 2)
+
+    def test_unknown_version(self):
+        self.snapshot({'version': 99})
+        self.assertRaises(ValueError, presets.PresetStore, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#===========================================================================
+# test_pwmout.py
+#
+# PWMOutput write coalescing against the fake I2C bus:
+#   $ python -m unittest test_pwmout
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+
+import pwmout
+
+class PWMOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = pwmout.FakeI2C()
+        self.dev = self.bus.get_i2c_device(0x40)
+        self.out = pwmout.PWMOutput(self.dev)
+        self.setup = self.dev.transactions
+
+    def transactions(self):
+        return self.dev.transactions - self.setup
+
+    def test_auto_increment_enabled(self):
+        self.assertTrue(self.dev.registers[pwmout.MODE1] & pwmout.AI)
+        # a second output finds it already set and only reads MODE1
+        pwmout.PWMOutput(self.dev)
+        self.assertEqual(self.transactions(), 1)
+
+    def test_contiguous_channels_one_write(self):
+        for chan, value in enumerate((290, 100, 320, 490)):
+            self.out.set_pwm(chan, 0, value)
+        self.assertEqual(self.out.flush(), 1)
+        self.assertEqual(self.transactions(), 1)
+        for chan, value in enumerate((290, 100, 320, 490)):
+            self.assertEqual(self.dev.get_pwm(chan), (0, value))
+
+    def test_unchanged_values_not_sent(self):
+        self.out.set_pwm(0, 0, 300)
+        self.out.flush()
+        self.out.set_pwm(0, 0, 300)
+        self.assertEqual(self.out.flush(), 0)
+        self.assertEqual(self.transactions(), 1)
+        self.assertEqual(self.out.skipped, 1)
+
+    def test_only_changed_channel_written(self):
+        for chan in xrange(4):
+            self.out.set_pwm(chan, 0, 300 + chan)
+        self.out.flush()
+        sent = self.dev.bytes_written
+        self.out.set_pwm(3, 0, 400)
+        self.assertEqual(self.out.flush(), 1)
+        # register address plus one channel
+        self.assertEqual(self.dev.bytes_written - sent, 1 + pwmout.REGS_PER_CHAN)
+        self.assertEqual(self.dev.get_pwm(3), (0, 400))
+
+    def test_clean_channels_between_dirty_resent(self):
+        for chan in xrange(4):
+            self.out.set_pwm(chan, 0, 300)
+        self.out.flush()
+        self.out.set_pwm(0, 0, 310)
+        self.out.set_pwm(3, 0, 330)
+        self.assertEqual(self.out.flush(), 1)
+        self.assertEqual(self.dev.get_pwm(0), (0, 310))
+        self.assertEqual(self.dev.get_pwm(1), (0, 300))
+        self.assertEqual(self.dev.get_pwm(3), (0, 330))
+
+    def test_unset_channels_split_writes(self):
+        self.out.set_pwm(0, 0, 300)
+        self.out.set_pwm(3, 0, 330)
+        self.assertEqual(self.out.flush(), 2)
+        self.assertEqual(self.dev.get_pwm(1), (0, 0))
+
+    def test_block_size_limit(self):
+        for chan in xrange(16):
+            self.out.set_pwm(chan, 0, 200 + chan)
+        per_block = pwmout.MAX_BLOCK // pwmout.REGS_PER_CHAN
+        self.assertEqual(self.out.flush(), 16 // per_block)
+        for chan in xrange(16):
+            self.assertEqual(self.dev.get_pwm(chan), (0, 200 + chan))
+
+    def test_invalidate_resends(self):
+        self.out.set_pwm(2, 0, 320)
+        self.out.flush()
+        self.out.invalidate(2)
+        self.assertEqual(self.out.flush(), 1)
+        self.out.invalidate()
+        self.assertEqual(self.out.flush(), 1)
+        self.assertEqual(self.out.writes, 3)
+
+    def test_jogs_one_write_each(self):
+        values = {2:320, 3:490, 0:290, 1:100}
+        for chan, value in values.items():
+            self.out.set_pwm(chan, 0, value)
+        self.out.flush()
+        start = self.transactions()
+        for i in xrange(100):
+            values[3] += 1 if i % 2 else -1
+            for chan, value in values.items():
+                self.out.set_pwm(chan, 0, value)
+            self.out.flush()
+        self.assertEqual(self.transactions() - start, 100)
+
+if __name__ == '__main__':
+    unittest.main()
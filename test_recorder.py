@@ -0,0 +1,128 @@
+#===========================================================================
+# test_recorder.py
+#
+# FrameHistory on a small block of memory and a made up clock: what is
+# evicted by age and by space, what a pin keeps, and frames wrapping
+# round the end of the block:
+#   $ python -m unittest test_recorder
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+import threading
+
+import recorder
+
+class FakeClock():
+
+    def __init__(self, ):
+        self.now = 100.0
+
+    def monotonic(self, ):
+        return self.now
+
+class FrameHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self._clock, recorder.clock = recorder.clock, self.clock
+
+    def tearDown(self):
+        recorder.clock = self._clock
+
+    def add(self, history, data, chunk=16, at=None):
+        if not at == None:
+            self.clock.now = at
+        for i in xrange(0, len(data), chunk):
+            history.write(data[i:i+chunk])
+        history.commit()
+
+    def numbers(self, history):
+        return [frame[0] for frame in history.frames]
+
+    def data(self, history, frame):
+        return ''.join([part.tobytes() for part in history.parts(frame)])
+
+    def test_evicted_by_age(self):
+        history = recorder.FrameHistory(seconds=1.0, budget=1000)
+        self.add(history, 'a' * 10, at=100.0)
+        self.add(history, 'b' * 10, at=100.8)
+        self.add(history, 'c' * 10, at=101.5)
+        self.assertEqual(self.numbers(history), [2, 3])
+        self.assertEqual(history.used(), 20)
+
+    def test_evicted_by_space(self):
+        history = recorder.FrameHistory(seconds=60.0, budget=100)
+        for letter in 'abc':
+            self.add(history, letter * 40)
+        self.assertEqual(self.numbers(history), [2, 3])
+        self.assertEqual(history.used(), 80)
+        self.assertEqual(history.dropped, 0)
+
+    def test_frame_wraps_round(self):
+        history = recorder.FrameHistory(seconds=60.0, budget=100)
+        frames = ['a' * 40, 'b' * 40, ''.join([chr(i) for i in xrange(40)])]
+        for data in frames:
+            self.add(history, data, chunk=7)
+        last = history.frames[-1]
+        self.assertEqual(len(history.parts(last)), 2)
+        self.assertEqual(self.data(history, last), frames[2])
+        self.assertEqual(self.data(history, history.frames[0]), frames[1])
+
+    def test_pinned_frames_kept_whatever_their_age(self):
+        history = recorder.FrameHistory(seconds=1.0, budget=1000)
+        self.add(history, 'a' * 10, at=100.0)
+        self.add(history, 'b' * 10, at=100.5)
+        history.pin = 2
+        self.add(history, 'c' * 10, at=105.0)
+        self.assertEqual(self.numbers(history), [2, 3])
+        history.pin = None
+        self.add(history, 'd' * 10, at=105.2)
+        self.assertEqual(self.numbers(history), [3, 4])
+
+    def test_dropped_when_full_of_pinned_frames(self):
+        history = recorder.FrameHistory(seconds=60.0, budget=100)
+        self.add(history, 'a' * 40)
+        self.add(history, 'b' * 40)
+        history.pin = 1
+        self.add(history, 'c' * 40)
+        self.assertEqual(self.numbers(history), [1, 2])
+        self.assertEqual(history.dropped, 1)
+        self.assertEqual(history.count, 2)
+        self.assertEqual(self.data(history, history.frames[0]), 'a' * 40)
+        history.pin = None
+        self.add(history, 'd' * 40)
+        self.assertEqual(self.numbers(history), [2, 3])
+        self.assertEqual(self.data(history, history.frames[1]), 'd' * 40)
+
+    def test_frame_bigger_than_budget_dropped(self):
+        history = recorder.FrameHistory(seconds=60.0, budget=100)
+        self.add(history, 'a' * 150)
+        self.assertEqual(history.dropped, 1)
+        self.assertEqual(history.count, 0)
+        self.add(history, 'b' * 50)
+        self.assertEqual(self.data(history, history.frames[0]), 'b' * 50)
+
+    def test_oldest(self):
+        history = recorder.FrameHistory(seconds=60.0, budget=1000)
+        self.add(history, 'a', at=100.0)
+        self.add(history, 'b', at=101.0)
+        self.add(history, 'c', at=102.0)
+        self.assertEqual(history.oldest(0), 1)
+        self.assertEqual(history.oldest(100.5), 2)
+        self.assertEqual(history.oldest(103.0), 4)
+
+    def test_wait_frame(self):
+        history = recorder.FrameHistory(seconds=60.0, budget=1000)
+        self.add(history, 'a')
+        self.assertEqual(history.wait_frame(1)[0], 1)
+        self.assertEqual(history.wait_frame(2, timeout=0.01), None)
+        timer = threading.Timer(0.05, self.add, (history, 'b'))
+        timer.start()
+        frame = history.wait_frame(2, timeout=5.0)
+        timer.join()
+        self.assertEqual(frame[0], 2)
+        self.assertEqual(self.data(history, frame), 'b')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#===========================================================================
+# test_tracker.py
+#
+# MotionDetector on made up frame sequences, and the shared frame slots
+# dropping frames when the worker is busy:
+#   $ python -m unittest test_tracker
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+import math
+import Queue
+
+import numpy
+
+import tracker
+
+ROWS, COLS = tracker.ANALYTICS_SIZE[1], tracker.ANALYTICS_SIZE[0]
+
+def scene(seed=1):
+    rnd = numpy.random.RandomState(seed)
+    return rnd, rnd.randint(40, 120, (ROWS, COLS)).astype(numpy.uint8)
+
+def blob(frame, cx, cy, radius=6, level=230):
+    ys, xs = numpy.indices(frame.shape)
+    frame[(xs-cx)**2 + (ys-cy)**2 < radius**2] = level
+    return frame
+
+class MotionDetectorTest(unittest.TestCase):
+
+    def test_first_frame_learns_background(self):
+        rnd, background = scene()
+        self.assertEqual(tracker.MotionDetector().detect(background), [])
+
+    def test_noise_is_not_motion(self):
+        rnd, background = scene()
+        frames = [background + rnd.randint(0, 8, (ROWS, COLS)).astype(numpy.uint8)
+                  for i in xrange(20)]
+        self.assertEqual([t for t in tracker.detect_sequence(frames) if t], [])
+
+    def test_follows_moving_blob(self):
+        rnd, background = scene()
+        frames = [background.copy()]
+        truth = [None]
+        for i in xrange(60):
+            cx = COLS/2 + 50*math.sin(i/20.0)
+            cy = ROWS/2 + 25*math.sin(i/13.0)
+            noise = rnd.randint(0, 8, (ROWS, COLS)).astype(numpy.uint8)
+            frames.append(blob(background + noise, cx, cy))
+            truth.append((cx, cy))
+        found = tracker.detect_sequence(frames)
+        self.assertEqual(len(found), len(frames))
+        self.assertEqual(found[0], [])
+        for targets, (cx, cy) in zip(found[1:], truth[1:]):
+            self.assertTrue(targets)
+            x, y, area = targets[0]
+            self.assertLess(math.hypot(x - cx, y - cy), 2.0)
+            self.assertGreaterEqual(area, tracker.MIN_AREA)
+
+    def test_biggest_first(self):
+        rnd, background = scene()
+        frame = blob(blob(background.copy(), 30, 30, radius=4), 120, 60, radius=8)
+        found = tracker.detect_sequence([background, frame])[1]
+        self.assertEqual(len(found), 2)
+        self.assertAlmostEqual(found[0][0], 120, delta=1.0)
+        self.assertAlmostEqual(found[1][0], 30, delta=1.0)
+        self.assertGreater(found[0][2], found[1][2])
+
+    def test_small_blobs_ignored(self):
+        rnd, background = scene()
+        frame = blob(background.copy(), 80, 45, radius=2)
+        self.assertEqual(tracker.detect_sequence([background, frame])[1], [])
+
+    def test_reset_relearns(self):
+        rnd, background = scene()
+        detector = tracker.MotionDetector()
+        detector.detect(background)
+        detector.reset()
+        moved = blob(background.copy(), 80, 45)
+        self.assertEqual(detector.detect(moved), [])
+        self.assertEqual(detector.detect(moved), [])
+
+class SharedFramesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shared = tracker.SharedFrames(slots=2)
+        # done with the process queues, flush them before they are dropped
+        for queue in (self.shared.frames, self.shared.free):
+            queue.close()
+            queue.join_thread()
+        # in process queues, so slots are handed over at once rather than
+        # by a feeder thread
+        self.shared.frames = Queue.Queue()
+        self.shared.free = Queue.Queue()
+        for slot in xrange(2):
+            self.shared.free.put(slot)
+
+    def write_frame(self, value):
+        rows, cols = self.shared.shape
+        data = numpy.empty(rows * cols * 3 // 2, dtype=numpy.uint8)
+        data[:] = value
+        # in pieces, like the camera does
+        data = data.tostring()
+        for i in xrange(0, len(data), 4096):
+            self.shared.write(data[i:i+4096])
+        self.shared.commit()
+
+    def test_frames_dropped_when_worker_busy(self):
+        for value in (10, 20, 30):
+            self.write_frame(value)
+        self.assertEqual(self.shared.count, 3)
+        self.assertEqual(self.shared.dropped, 1)
+        slots = self.shared.slots()
+        for value in (10, 20):
+            slot, count = self.shared.frames.get_nowait()
+            self.assertTrue((slots[slot] == value).all())
+            self.shared.free.put(slot)
+        self.write_frame(40)
+        slot, count = self.shared.frames.get_nowait()
+        self.assertEqual(count, 4)
+        self.assertTrue((slots[slot] == 40).all())
+
+    def test_short_frame_slot_returned(self):
+        self.shared.write('\x00' * 100)
+        self.shared.commit()
+        self.assertTrue(self.shared.frames.empty())
+        self.assertEqual(self.shared.free.qsize(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
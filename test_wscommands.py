@@ -0,0 +1,82 @@
+#===========================================================================
+# test_wscommands.py
+#
+# Text and binary websocket command parsing, good and bad messages:
+#   $ python -m unittest test_wscommands
+#
+# 2026-10-18
+#===========================================================================
+import unittest
+import struct
+
+import wscommands
+
+class ParseTextTest(unittest.TestCase):
+
+    def test_commands_and_arguments(self):
+        self.assertEqual(wscommands.parse_text("LP:320:490;LN"),
+                         [('LP', (320, 490)), ('LN', ())])
+
+    def test_case_spaces_and_empty_parts(self):
+        self.assertEqual(wscommands.parse_text(" cm:1:-2 ;; ln;"),
+                         [('CM', (1, -2)), ('LN', ())])
+
+    def test_floats_truncated(self):
+        self.assertEqual(wscommands.parse_text("CM:1.9:-2.5"), [('CM', (1, -2))])
+
+    def test_unknown_opcode_passed_on(self):
+        # left to the dispatcher, which knows the handlers
+        self.assertEqual(wscommands.parse_text("ZZ:1"), [('ZZ', (1,))])
+
+    def test_bad_arguments(self):
+        for message in ("LP:abc:0", "LP::0", "LP:nan:0", "LP:inf:0", "LP:-inf:0"):
+            self.assertRaises(wscommands.ProtocolError, wscommands.parse_text, message)
+
+    def test_arguments_limited_to_int16(self):
+        self.assertEqual(wscommands.parse_text("LP:32767:-32768"), [('LP', (32767, -32768))])
+        for message in ("LP:32768:0", "LP:0:-32769", "LP:1e30:0"):
+            self.assertRaises(wscommands.ProtocolError, wscommands.parse_text, message)
+
+    def test_protocol_error_is_value_error(self):
+        self.assertTrue(issubclass(wscommands.ProtocolError, ValueError))
+
+class ParseBinaryTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        commands = [('LP', (320, 490)), ('LN', ()), ('CM', (-3, 2)), ('PP', (1,)),
+                    ('RC', ())]
+        self.assertEqual(wscommands.parse_binary(wscommands.pack(commands)), commands)
+
+    def test_every_opcode_round_trips(self):
+        for op, n in wscommands.OPCODES:
+            commands = [(op, tuple(range(-1, n-1)))]
+            self.assertEqual(wscommands.parse_binary(wscommands.pack(commands)), commands)
+
+    def test_codes_are_stable(self):
+        # clients hard code these, new opcodes only go at the end
+        self.assertEqual(wscommands.CODES['LU'], 1)
+        self.assertEqual(wscommands.CODES['CM'], 29)
+        self.assertEqual(wscommands.pack([('CM', (1, -1))]), '\x1d\x01\x00\xff\xff')
+
+    def test_text_and_binary_agree(self):
+        text = "LP:320:490;LN;CG:2"
+        commands = wscommands.parse_text(text)
+        self.assertEqual(wscommands.parse_binary(wscommands.pack(commands)), commands)
+
+    def test_empty(self):
+        self.assertEqual(wscommands.parse_binary(''), [])
+
+    def test_truncated(self):
+        data = wscommands.pack([('LN', ()), ('LP', (320, 490))])
+        for end in xrange(2, len(data)):
+            self.assertRaises(wscommands.ProtocolError, wscommands.parse_binary, data[:end])
+
+    def test_unknown_code(self):
+        for code in (0, len(wscommands.OPCODES) + 1, 0xff):
+            self.assertRaises(wscommands.ProtocolError, wscommands.parse_binary, chr(code))
+
+    def test_pack_out_of_range(self):
+        self.assertRaises(struct.error, wscommands.pack, [('LP', (40000, 0))])
+
+if __name__ == '__main__':
+    unittest.main()
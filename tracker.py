@@ -0,0 +1,373 @@
+#===========================================================================
+# tracker.py
+#
+# Motion detection and "follow the cat" mode.
+#
+# Small luminance frames come from the camera's analytics feed, next to
+# the MJPEG stream, straight into a ring of shared memory slots.
+# A worker process runs background subtraction and blob extraction on
+# them with NumPy, so the detection work stays off the server's threads
+# and the stream. If the worker falls behind, frames are dropped rather
+# than queued.
+#
+# Detected targets come back to a thread in the server process, which
+# aims the laser just ahead of the biggest one and turns the camera when
+# it nears the edge of the picture, through the hardware actor.
+#
+# MotionDetector works on any sequence of 2D uint8 arrays, so it can be
+# run against frames saved with save_sequence().
+#
+# 2026-10-18
+#===========================================================================
+import time
+import threading
+import multiprocessing
+import Queue
+import logging
+
+import numpy
+
+import camctl
+import metrics
+
+ANALYTICS_SIZE  = camctl.ANALYTICS_SIZE     # (width, height) of analysed frames
+SLOTS           = 4                 # shared memory frame slots
+THRESHOLD       = 25                # luminance change that counts as motion
+ALPHA           = 0.05              # background learning rate
+MIN_AREA        = 30                # pixels, ignores noise and the laser dot
+MAX_TARGETS     = 3
+CELL            = 8                 # pixels per side of a coarse search cell
+RADIUS          = 12                # pixels around a cell a blob is collected from
+LEAD            = 0.3               # seconds ahead of the target to aim the laser
+SMOOTHING       = 0.5               # weight of the newest target position
+EDGE            = 0.3               # fraction of the picture near the edges
+CAMERA_SETTLE   = 1.5               # seconds between camera moves
+
+RESET = 'reset'                     # tells the worker to relearn the background
+
+log = logging.getLogger(__name__)
+
+# frames captured and dropped are counted by mjpegger for the port
+DETECT_SECONDS = metrics.Histogram('tracker_detect_seconds',
+                                   'Time to run motion detection on a frame')
+
+def plane_shape(size):
+    """(rows, columns) of the luminance plane picamera writes for a YUV
+    frame of size, which is padded to 16 rows and 32 columns."""
+    return ((size[1] + 15) // 16 * 16, (size[0] + 31) // 32 * 32)
+
+class MotionDetector():
+    """Background subtraction and blob centroids on luminance frames."""
+
+    def __init__(self, threshold=THRESHOLD, alpha=ALPHA, min_area=MIN_AREA,
+                 max_targets=MAX_TARGETS, cell=CELL, radius=RADIUS):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.min_area = min_area
+        self.max_targets = max_targets
+        self.cell = cell
+        self.radius = radius
+        self.background = None
+        self._frame = None
+        self._diff = None
+
+    def reset(self, ):
+        """Forget the background, e.g. after the camera has moved."""
+        self.background = None
+
+    def detect(self, frame):
+        """Return list of (x, y, area) of moving blobs in frame, biggest
+        first, in frame pixels."""
+        if self.background is None or not self.background.shape == frame.shape:
+            self.background = frame.astype(numpy.float32)
+            self._frame = numpy.empty_like(self.background)
+            self._diff = numpy.empty_like(self.background)
+            return []
+        f, d, bg = self._frame, self._diff, self.background
+        f[...] = frame
+        numpy.subtract(f, bg, out=d)
+        mask = numpy.abs(d) > self.threshold
+        # learn the background much slower where something moves, so a
+        # cat sitting still isn't absorbed straight away but whatever was
+        # there when it started still fades out
+        d *= self.alpha
+        d[mask] *= 0.2
+        bg += d
+        return self._blobs(mask)
+
+    def _blobs(self, mask):
+        c = self.cell
+        h, w = mask.shape
+        cells = mask[:h//c*c, :w//c*c].reshape(h//c, c, w//c, c).sum(axis=(1, 3))
+        reach = self.radius // c + 1
+        targets = []
+        while len(targets) < self.max_targets:
+            row, col = divmod(int(cells.argmax()), cells.shape[1])
+            if cells[row, col] == 0:
+                break
+            y0 = max(0, row*c + c//2 - self.radius)
+            x0 = max(0, col*c + c//2 - self.radius)
+            ys, xs = numpy.nonzero(mask[y0:row*c + c//2 + self.radius,
+                                        x0:col*c + c//2 + self.radius])
+            cells[max(0, row-reach):row+reach+1, max(0, col-reach):col+reach+1] = 0
+            if len(xs) < self.min_area:
+                continue
+            targets.append((x0 + xs.mean(), y0 + ys.mean(), len(xs)))
+        targets.sort(key=lambda t: -t[2])
+        return targets
+
+def detect_sequence(frames, **kwargs):
+    """Run a MotionDetector over frames, returns a list of targets per frame."""
+    detector = MotionDetector(**kwargs)
+    return [detector.detect(frame) for frame in frames]
+
+def save_sequence(path, frames):
+    """Save frames, a sequence of equal size 2D uint8 arrays, for replay."""
+    numpy.save(path, numpy.asarray(frames, dtype=numpy.uint8))
+
+def load_sequence(path):
+    """Load frames saved with save_sequence() as a (frames, rows, columns) array."""
+    return numpy.load(path)
+
+#-------------------------------------------------------------------------
+# Capture side
+#-------------------------------------------------------------------------
+class SharedFrames():
+    """Luminance frames in shared memory slots, written by the camera in
+    this process and read by the worker process. Slots go to the worker
+    through the frames queue and come back through the free queue."""
+
+    def __init__(self, size=ANALYTICS_SIZE, slots=SLOTS):
+        self.size = size
+        self.shape = plane_shape(size)
+        self.plane = self.shape[0] * self.shape[1]
+        self.memory = multiprocessing.RawArray('B', slots * self.plane)
+        self.frames = multiprocessing.Queue()
+        self.free = multiprocessing.Queue()
+        for slot in xrange(slots):
+            self.free.put(slot)
+        self._view = numpy.frombuffer(self.memory, dtype=numpy.uint8)
+        self._slot = None
+        self._written = 0
+        self.count = 0
+        self.dropped = 0
+        self.closed = False
+
+    def slots(self, ):
+        """Return the slots as a (slots, rows, columns) array."""
+        return numpy.frombuffer(self.memory, dtype=numpy.uint8).reshape((-1,) + self.shape)
+
+    # camera output interface, write() is called with parts of a frame
+    # and commit() once it is complete
+    def write(self, b):
+        if self._written == 0:
+            try:
+                self._slot = self.free.get_nowait()
+            except Queue.Empty:
+                self._slot = None           # worker busy, drop this frame
+        n = len(b)
+        if not self._slot == None and self._written < self.plane:
+            # only the luminance plane is kept, chroma is ignored
+            start = self._slot * self.plane + self._written
+            take = min(n, self.plane - self._written)
+            self._view[start:start+take] = numpy.frombuffer(b, dtype=numpy.uint8, count=take)
+        self._written += n
+        return n
+
+    def flush(self, ):
+        pass
+
+    def commit(self, ):
+        self.count += 1
+        if self._slot == None:
+            self.dropped += 1
+        elif self._written >= self.plane:
+            self.frames.put((self._slot, self.count))
+        else:
+            self.free.put(self._slot)       # short frame
+        self._slot = None
+        self._written = 0
+
+    def close(self, ):
+        self.closed = True
+
+def _worker(shared, results, params):
+    detector = MotionDetector(**params)
+    rows, cols = shared.size[1], shared.size[0]
+    slots = shared.slots()
+    while True:
+        item = shared.frames.get()
+        if item == None:
+            break
+        if item == RESET:
+            detector.reset()
+            continue
+        slot, count = item
+        start = time.time()
+        targets = detector.detect(slots[slot, :rows, :cols])
+        shared.free.put(slot)
+        results.put((count, targets, time.time() - start))
+
+class Tracker():
+    """Follow the cat: detects motion off the camera and points the laser
+    and camera at it through the hardware actor."""
+
+    def __init__(self, box, actor, aimmap, follow_laser=True, follow_camera=True,
+                 params=None, on_motion=None):
+        self.box = box
+        self.actor = actor
+        self.aimmap = aimmap
+        self.size = ANALYTICS_SIZE
+        self.follow_laser = follow_laser
+        self.follow_camera = follow_camera
+        self.params = params or {}
+        self.on_motion = on_motion      # called when motion starts
+        self.shared = None
+        self.targets = []
+        self.frames_processed = 0
+        self._worker = None
+        self._results = None
+        self._thread = None
+        self._target = None
+        self._velocity = (0.0, 0.0)
+        self._last = None
+        self._camera_hold = 0.0
+
+    def is_running(self, ):
+        return not self._worker == None
+
+    def start(self, ):
+        if self.is_running():
+            return
+        self.shared = SharedFrames(self.size)
+        self._results = multiprocessing.Queue()
+        self._worker = multiprocessing.Process(target=_worker, name="MotionDetector",
+                                               args=(self.shared, self._results, self.params))
+        self._worker.daemon = True
+        self._worker.start()
+        self._thread = threading.Thread(target=self._follow_loop, name="Tracker")
+        self._thread.daemon = True
+        self._thread.start()
+        self._target = None
+        self.box.cameras.register(camctl.ANALYTICS_PORT, self.shared)
+
+    def stop(self, ):
+        if not self.is_running():
+            return
+        self.box.cameras.unregister(camctl.ANALYTICS_PORT, self.shared)
+        # only signal here, this runs on the server's IOLoop; the worker
+        # and follow thread are joined on a thread of their own
+        self.shared.frames.put(None)
+        self._results.put(None)
+        reaper = threading.Thread(target=self._reap, name="TrackerStop",
+                                  args=(self._worker, self._thread))
+        reaper.daemon = True
+        reaper.start()
+        self._worker = None
+        self._thread = None
+        # the next start() gets new queues and shared memory
+        self.shared = None
+        self._results = None
+
+    def _reap(self, worker, thread):
+        worker.join(2.0)
+        thread.join(2.0)
+        if worker.is_alive():
+            log.warning("motion detector did not stop, terminating it")
+            worker.terminate()
+
+    def _follow_loop(self, ):
+        while True:
+            item = self._results.get()
+            if item == None:
+                break
+            count, targets, seconds = item
+            DETECT_SECONDS.observe(seconds)
+            self.frames_processed += 1
+            if targets and not self.targets and not self.on_motion == None:
+                self.on_motion()
+            self.targets = targets
+            if targets:
+                try:
+                    self._follow(targets[0])
+                except Exception:
+                    log.exception("tracker follow failed")
+
+    def _follow(self, target):
+        # into stream pixels, which is what aiming is calibrated in
+        sx = float(self.aimmap.size[0]) / self.size[0]
+        sy = float(self.aimmap.size[1]) / self.size[1]
+        x, y = target[0] * sx, target[1] * sy
+        now = time.time()
+        if self._target == None:
+            self._target = (x, y)
+        else:
+            dt = max(1e-3, now - self._last)
+            px, py = self._target
+            self._target = (px + SMOOTHING*(x - px), py + SMOOTHING*(y - py))
+            vx = (self._target[0] - px) / dt
+            vy = (self._target[1] - py) / dt
+            self._velocity = (self._velocity[0] + SMOOTHING*(vx - self._velocity[0]),
+                              self._velocity[1] + SMOOTHING*(vy - self._velocity[1]))
+        self._last = now
+        x, y = self._target
+        camera = self.box.camera_get_position()
+        if self.follow_laser:
+            # just ahead of the cat, for it to pounce on
+            laser = self.aimmap.laser_for_pixel(camera, (x + LEAD*self._velocity[0],
+                                                         y + LEAD*self._velocity[1]))
+            if not laser == None:
+                self.actor.laser_set_position(laser)
+        if self.follow_camera and now > self._camera_hold:
+            w, h = self.aimmap.size
+            if not (EDGE*w < x < (1-EDGE)*w and EDGE*h < y < (1-EDGE)*h):
+                self.actor.camera_set_position(self.aimmap.camera_for_pixel(camera, (x, y)))
+                # the picture moves, start the background again
+                shared = self.shared
+                if not shared == None:
+                    shared.frames.put(RESET)
+                self._target = None
+                self._camera_hold = now + CAMERA_SETTLE
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # Run the detector over a recorded sequence given on the command line,
+    # or over a made up one with a blob wandering over a noisy background,
+    # and report the frame rate it manages and how close it tracked.
+    import sys
+    import math
+
+    if len(sys.argv) > 1:
+        frames = load_sequence(sys.argv[1])
+        truth = None
+    else:
+        FRAMES_N = 300
+        rows, cols = ANALYTICS_SIZE[1], ANALYTICS_SIZE[0]
+        rnd = numpy.random.RandomState(1)
+        scene = rnd.randint(40, 120, (rows, cols)).astype(numpy.uint8)
+        ys, xs = numpy.indices((rows, cols))
+        frames = []
+        truth = []
+        for i in xrange(FRAMES_N):
+            cx = cols/2 + 50*math.sin(i/20.0)
+            cy = rows/2 + 25*math.sin(i/13.0)
+            frame = scene + rnd.randint(0, 8, (rows, cols)).astype(numpy.uint8)
+            frame[(xs-cx)**2 + (ys-cy)**2 < 36] = 230
+            frames.append(frame)
+            truth.append((cx, cy))
+
+    detector = MotionDetector()
+    start = time.time()
+    found = [detector.detect(frame) for frame in frames]
+    elapsed = time.time() - start
+
+    print "{} frames of {}x{}".format(len(frames), frames[0].shape[1], frames[0].shape[0])
+    print "  detect   : {:.2f} ms per frame, {:.0f} fps".format(
+        1000*elapsed/len(frames), len(frames)/elapsed)
+    print "  targets  : found in {} frames".format(len([f for f in found if f]))
+    if not truth == None:
+        errors = [math.hypot(f[0][0]-t[0], f[0][1]-t[1]) for f, t in zip(found, truth) if f]
+        print "  error    : {:.2f} px mean, {:.2f} px worst".format(
+            sum(errors)/len(errors), max(errors))
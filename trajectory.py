@@ -0,0 +1,111 @@
+#===========================================================================
+# trajectory.py
+#
+# Smooth servo moves. Rather than jumping to a new position, a servo
+# pair is stepped toward its target once per servo frame, speeding up
+# and slowing down within speed and acceleration limits. The path is
+# a straight line in servo angles. Changing the target part way through
+# a move carries the current velocity into the new one, so a stream of
+# targets from a joystick or a pattern is followed without jerks.
+#
+# Smaller steps per frame mean less inrush current for the servos on
+# the shared 5V supply and less shaking of the mechanism.
+#
+# 2026-10-18
+#===========================================================================
+import math
+
+CAMERA_LIMITS   = (120.0, 600.0)    # degrees per second, per second squared
+LASER_LIMITS    = (360.0, 3000.0)   # light mirror servos, quick enough for patterns
+
+class Trajectory():
+    """Moves an (x, y) pair of angles toward a target within a speed
+    and an acceleration limit, one step at a time."""
+
+    def __init__(self, position, speed, accel):
+        self.speed = speed
+        self.accel = accel
+        self.position = tuple(position)
+        self.target = tuple(position)
+        self._vx = 0.0
+        self._vy = 0.0
+
+    def set_target(self, target):
+        self.target = tuple(target)
+
+    def jump(self, position):
+        """Put the trajectory at position, at rest, with no move."""
+        self.position = self.target = tuple(position)
+        self._vx = self._vy = 0.0
+
+    def moving(self, ):
+        return not (self.position == self.target and self._vx == 0.0 and self._vy == 0.0)
+
+    def step(self, dt):
+        """Advance by dt seconds and return the new position."""
+        x, y = self.position
+        dx = self.target[0] - x
+        dy = self.target[1] - y
+        dist = math.hypot(dx, dy)
+        vx, vy = self._vx, self._vy
+        dv = self.accel * dt
+        if dist <= dv * dt and math.hypot(vx, vy) <= dv:
+            # close enough to stop dead this step
+            self.jump(self.target)
+            return self.position
+        # fastest velocity that can still stop at the target
+        if dist > 0:
+            v = min(self.speed, math.sqrt(2 * self.accel * dist))
+            wx, wy = v * dx / dist, v * dy / dist
+        else:
+            wx = wy = 0.0
+        # change velocity toward it, limited by acceleration
+        cx, cy = wx - vx, wy - vy
+        c = math.hypot(cx, cy)
+        if c > dv:
+            cx, cy = cx * dv / c, cy * dv / c
+        vx += cx
+        vy += cy
+        sx, sy = vx * dt, vy * dt
+        if sx*dx + sy*dy >= dist*dist:
+            # would pass the target, stop on it
+            self.jump(self.target)
+            return self.position
+        self._vx, self._vy = vx, vy
+        self.position = (x + sx, y + sy)
+        return self.position
+
+    def duration(self, dt):
+        """Return seconds a move from here to the target takes, in steps
+        of dt. Steps a copy, the trajectory is not changed."""
+        copy = Trajectory(self.position, self.speed, self.accel)
+        copy.target = self.target
+        copy._vx, copy._vy = self._vx, self._vy
+        steps = 0
+        while copy.moving():
+            copy.step(dt)
+            steps += 1
+        return steps * dt
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    # Camera move across most of its range: a jump against the planned
+    # move, as the largest step in one servo frame, which is what draws
+    # the current spike, and the time taken.
+    DT = 1.0 / 50
+    start, target = (-60.0, -40.0), (60.0, 40.0)
+    distance = math.hypot(target[0] - start[0], target[1] - start[1])
+    for name, (speed, accel) in (('camera', CAMERA_LIMITS), ('laser', LASER_LIMITS)):
+        t = Trajectory(start, speed, accel)
+        t.set_target(target)
+        steps = []
+        last = start
+        while t.moving():
+            p = t.step(DT)
+            steps.append(math.hypot(p[0] - last[0], p[1] - last[1]))
+            last = p
+        print "{} move of {:.0f} degrees".format(name, distance)
+        print "  jump    : largest step {:6.1f} degrees in {:5.2f} s".format(distance, DT)
+        print "  planned : largest step {:6.1f} degrees in {:5.2f} s".format(max(steps), len(steps) * DT)
@@ -3,8 +3,15 @@
 # watchdog.py
 #
 # A safety watchdog to turn off the servo power if idle for a period of
-# time. Basically watches a file and turns servo power off if file is
-# older than specified time interval. Add a cron entry to run this.
+# time.
+#
+# The server runs a Watchdog inside its hardware actor. Every hardware
+# command re-arms the deadline and servo power is cut when it expires.
+#
+# When the server is not running this can still be run from cron as
+# before. It watches a file and turns servo power off if the file is
+# older than MAX_IDLE_TIME. Only the servo enable pin is touched, the
+# rest of the hardware is left alone.
 #
 # 2014-10-11
 # Carter Nelson
@@ -12,9 +19,7 @@
 import os.path
 import time
 
-import lasercam
-
-theBox = lasercam.LaserCamBox()
+import clock
 
 #-------------------------------
 # set up
@@ -22,14 +27,56 @@ theBox = lasercam.LaserCamBox()
 WATCHDOG_FILE = "/home/pi/rpi-laser/servo.wd" # file to watch
 MAX_IDLE_TIME = 600                           # time in seconds
 
-#-------------------------------
-# run the check
-#-------------------------------
-if os.path.exists(WATCHDOG_FILE):
-  ctime = time.time()                         # current time
-  mtime = os.path.getmtime(WATCHDOG_FILE)     # time of last modification
-  dtime = ctime - mtime                       # delta time in seconds
-  if dtime>MAX_IDLE_TIME:
-    theBox.disablePWM()                       # disable if max time reached
-else:
-  theBox.disablePWM()                         # disable if watchdog file is missing
+class Watchdog():
+    """Monotonic deadline, re-armed by kick()."""
+
+    def __init__(self, timeout=MAX_IDLE_TIME):
+        self.timeout = timeout
+        self.deadline = None
+        self.expirations = 0
+
+    def kick(self, ):
+        """Re-arm the deadline."""
+        self.deadline = clock.monotonic() + self.timeout
+
+    def disarm(self, ):
+        self.deadline = None
+
+    def armed(self, ):
+        return not self.deadline == None
+
+    def remaining(self, ):
+        """Return seconds until expiry, None if not armed."""
+        if self.deadline == None:
+            return None
+        return max(0.0, self.deadline - clock.monotonic())
+
+    def expire(self, ):
+        """Disarm and count an expiry. Returns True if it was armed."""
+        if self.deadline == None:
+            return False
+        self.deadline = None
+        self.expirations += 1
+        return True
+
+def disable_servos():
+    """Turn servo power off, touching only the enable pin."""
+    import hwbackend
+    import lasercam
+    GPIO = hwbackend.get_backend().gpio()
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(lasercam.LaserCamBox.OE_PIN, GPIO.OUT, initial=GPIO.HIGH)
+
+#===========================================================
+# MAIN
+#===========================================================
+if __name__ == '__main__':
+    if os.path.exists(WATCHDOG_FILE):
+        ctime = time.time()                         # current time
+        mtime = os.path.getmtime(WATCHDOG_FILE)     # time of last modification
+        dtime = ctime - mtime                       # delta time in seconds
+        if dtime>MAX_IDLE_TIME:
+            disable_servos()                        # disable if max time reached
+    else:
+        disable_servos()                            # disable if watchdog file is missing
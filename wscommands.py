@@ -0,0 +1,100 @@
+#===========================================================================
+# wscommands.py
+#
+# Websocket command protocol for the laser server.
+#
+# Commands are two character opcodes with optional integer arguments.
+# Text messages carry one or more commands separated by ';' with the
+# arguments separated by ':', e.g. "LP:320:490;LN".
+#
+# Binary messages carry the same commands packed back to back as a one
+# byte opcode followed by its arguments as little endian int16s, so a
+# whole joystick sample fits in one small frame. Text arguments are held
+# to the same int16 range.
+#
+# 2026-10-18
+#===========================================================================
+import struct
+
+# opcode : number of int16 arguments
+# the binary code of an opcode is its index in this list plus one, so
+# only ever add new opcodes to the end
+OPCODES = [
+    ('LU', 0), ('LD', 0), ('LL', 0), ('LR', 0),     # laser jog
+    ('LN', 0), ('LO', 0),                           # laser on/off
+    ('L!', 0), ('L1', 0), ('L2', 0), ('L3', 0), ('L4', 0), ('L5', 0),
+    ('CU', 0), ('CD', 0), ('CL', 0), ('CR', 0),     # camera jog
+    ('CN', 0), ('CO', 0),                           # stream start/stop
+    ('C!', 0), ('C1', 0), ('C2', 0), ('C3', 0), ('C4', 0), ('C5', 0),
+    ('QN', 0), ('QO', 0),                           # camera LED on/off
+    ('SN', 0), ('SO', 0),                           # servos on/off
+    ('CM', 2),                                      # camera move relative, degrees
+    ('S1', 0), ('S2', 0), ('S3', 0), ('S4', 0), ('S5', 0),
+    ('S6', 0), ('S7', 0), ('S8', 0), ('S9', 0),     # sounds
+    ('LP', 2),                                      # laser set position, servo counts
+    ('CP', 2),                                      # camera set position, servo counts
+    ('LS', 1), ('LG', 1),                           # laser preset store/goto
+    ('CS', 1), ('CG', 1),                           # camera preset store/goto
+    ('LA', 2),                                      # aim laser at image pixel
+    ('CA', 2),                                      # centre camera on image pixel
+    ('LK', 0),                                      # calibrate aiming at this camera pose
+    ('PP', 1), ('PS', 0),                           # pattern play n/stop
+    ('PV', 1), ('PL', 1),                           # pattern speed percent/loop on off
+    ('PR', 1),                                      # pattern record start 1/stop 0
+    ('TN', 0), ('TO', 0),                           # follow the cat on/off
+    ('RQ', 0), ('RL', 0),                           # request/release control
+    ('RC', 0),                                      # save a clip of the last seconds
+]
+
+NARGS = dict(OPCODES)
+CODES = dict([(op, i+1) for i, (op, n) in enumerate(OPCODES)])
+BY_CODE = dict([(i+1, (op, struct.Struct('<'+'h'*n))) for i, (op, n) in enumerate(OPCODES)])
+
+ARG_MIN, ARG_MAX = -32768, 32767    # int16, as in binary messages
+
+class ProtocolError(ValueError):
+    """Raised for malformed messages."""
+    pass
+
+def parse_text(message):
+    """Return list of (opcode, args) from a text message."""
+    commands = []
+    for part in message.split(';'):
+        fields = part.strip().upper().split(':')
+        op = fields[0]
+        if not op:
+            continue
+        try:
+            args = tuple([int(float(f)) for f in fields[1:]])
+        except (ValueError, OverflowError):
+            raise ProtocolError("bad arguments in {}".format(part))
+        for arg in args:
+            if not ARG_MIN <= arg <= ARG_MAX:
+                raise ProtocolError("argument out of range in {}".format(part))
+        commands.append((op, args))
+    return commands
+
+def parse_binary(data):
+    """Return list of (opcode, args) from a binary message."""
+    commands = []
+    data = bytearray(data)
+    offset = 0
+    while offset < len(data):
+        code = data[offset]
+        offset += 1
+        if not code in BY_CODE:
+            raise ProtocolError("unknown code 0x{:02x}".format(code))
+        op, fmt = BY_CODE[code]
+        if offset + fmt.size > len(data):
+            raise ProtocolError("truncated arguments for {}".format(op))
+        commands.append((op, fmt.unpack_from(data, offset)))
+        offset += fmt.size
+    return commands
+
+def pack(commands):
+    """Pack list of (opcode, args) into a binary message."""
+    out = bytearray()
+    for op, args in commands:
+        out.append(CODES[op])
+        out.extend(struct.pack('<'+'h'*NARGS[op], *args))
+    return bytes(out)